@@ -1,30 +1,156 @@
+"""Transactional email through the Brevo API.
+
+One BrevoClient per thread holds a requests.Session with a pooled,
+keep-alive HTTPAdapter, so a worker sending a queue of emails pays the
+TCP+TLS handshake once instead of once per email. Requests time out after
+BREVO_CONNECT_TIMEOUT seconds connecting and BREVO_READ_TIMEOUT waiting for
+the answer. The client never retries by itself: a failed send raises
+requests.HTTPError (or a connection error) and the job queue retries it
+with backoff (account/tasks.py).
+
+send_batch() sends one text to many recipients in as few requests as
+Brevo allows: every recipient gets a message version of their own (so no
+one sees the other addresses), BREVO_BATCH_SIZE versions per request.
+
+Every request is logged to the "account.emailer" logger with its outcome,
+status and duration; recipients' addresses and message bodies are not.
+"""
+import logging
+import threading
+import time
+
 import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from jobs.queue import enqueue
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 1000  # message versions Brevo accepts in one request
+ERROR_BODY_CHARS = 500  # of an error response, in the log
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class BrevoClient:
+    def __init__(self, api_key=None, base_url=None, sender=None, timeout=None, pool_size=4):
+        self.base_url = (base_url or settings.BREVO_API_BASE).rstrip('/')
+        self.sender = sender or {
+            'name': settings.BREVO_SENDER_NAME, 'email': settings.BREVO_SENDER_EMAIL,
+        }
+        self.timeout = timeout or (settings.BREVO_CONNECT_TIMEOUT, settings.BREVO_READ_TIMEOUT)
+        self.session = requests.Session()
+        self.session.headers.update({
+            'accept': 'application/json',
+            'api-key': api_key if api_key is not None else settings.BREVO_API_KEY,
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _post(self, payload, kind, recipients):
+        started = time.monotonic()
+        try:
+            response = self.session.post(
+                f'{self.base_url}/smtp/email', json=payload, timeout=self.timeout,
+            )
+        except requests.RequestException as exc:
+            logger.warning(
+                'brevo %s failed: recipients=%d error=%r duration_ms=%d',
+                kind, recipients, exc, (time.monotonic() - started) * 1000,
+            )
+            raise
+        duration = (time.monotonic() - started) * 1000
+        if not response.ok:
+            logger.warning(
+                'brevo %s rejected: recipients=%d status=%d duration_ms=%d body=%s',
+                kind, recipients, response.status_code, duration,
+                response.text[:ERROR_BODY_CHARS],
+            )
+            response.raise_for_status()
+        data = response.json() if response.content else {}
+        ids = data.get('messageIds') or [data.get('messageId')]
+        logger.info(
+            'brevo %s sent: recipients=%d status=%d duration_ms=%d message_ids=%d',
+            kind, recipients, response.status_code, duration, len(ids),
+        )
+        return ids
+
+    def send(self, to_email, subject, text):
+        """Send one email; returns Brevo's message id."""
+        return self._post({
+            'sender': self.sender,
+            'to': [{'email': to_email}],
+            'subject': subject,
+            'textContent': text,
+        }, 'send', 1)[0]
+
+    def send_batch(self, recipients, subject, text, batch_size=None):
+        """Send ``text`` to every address in ``recipients``; returns the message ids.
+
+        One request per BREVO_BATCH_SIZE recipients. If a request fails the
+        ones before it have been sent: queue_email_batch() retries each
+        chunk on its own for that reason.
+        """
+        size = min(batch_size or settings.BREVO_BATCH_SIZE, MAX_BATCH_SIZE)
+        ids = []
+        for chunk in chunked(list(recipients), size):
+            ids.extend(self._post({
+                'sender': self.sender,
+                'subject': subject,
+                'textContent': text,
+                'messageVersions': [{'to': [{'email': email}]} for email in chunk],
+            }, 'batch', len(chunk)))
+        return ids
+
+    def close(self):
+        self.session.close()
+
+
+_local = threading.local()
+
+
+def get_client():
+    # a Session is not safe to share between threads, so each has its own
+    client = getattr(_local, 'client', None)
+    if client is None:
+        client = _local.client = BrevoClient()
+    return client
+
 
 def send_email_brevo(to_email, subject, text):
-    api_key = settings.BREVO_API_KEY
-    sender_email = settings.BREVO_SENDER_EMAIL
-    sender_name = settings.BREVO_SENDER_NAME
-
-    payload = {
-        "sender": {"name": sender_name, "email": sender_email},
-        "to": [{"email": to_email}],
-        "subject": subject,
-        "textContent": text,
-    }
-
-    headers = {
-        "accept": "application/json",
-        "api-key": api_key,
-        "content-type": "application/json",
-    }
-
-    response = requests.post(
-        "https://api.brevo.com/v3/smtp/email",
-        json=payload,
-        headers=headers,
-        timeout=60,
+    return get_client().send(to_email, subject, text)
+
+
+def queue_email(to_email, subject, text, key=None):
+    """Send the email from the job queue (account/tasks.py), not this request.
+
+    A ``key`` makes the call idempotent: the same key is only ever sent once.
+    """
+    return enqueue(
+        'account.send_email',
+        {'to_email': to_email, 'subject': subject, 'text': text},
+        key=key,
     )
-    # For debugging:
-    print(response.status_code, response.text)
-    response.raise_for_status()
\ No newline at end of file
+
+
+def queue_email_batch(recipients, subject, text, key=None):
+    """Queue ``text`` for many recipients (say, a new-post notification).
+
+    One job per BREVO_BATCH_SIZE recipients, so a failed request is retried
+    without sending the other chunks again. With a ``key``, each chunk is
+    enqueued at most once.
+    """
+    size = min(settings.BREVO_BATCH_SIZE, MAX_BATCH_SIZE)
+    return [
+        enqueue(
+            'account.send_email_batch',
+            {'recipients': chunk, 'subject': subject, 'text': text},
+            key=None if key is None else f'{key}:{n}',
+        )
+        for n, chunk in enumerate(chunked(list(recipients), size))
+    ]
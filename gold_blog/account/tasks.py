@@ -0,0 +1,15 @@
+from jobs.queue import task
+
+from .emailer import get_client, send_email_brevo
+
+
+@task('account.send_email')
+def send_email(to_email, subject, text):
+    # raises on a failed request, so the queue retries it with backoff
+    send_email_brevo(to_email, subject, text)
+
+
+@task('account.send_email_batch')
+def send_email_batch(recipients, subject, text):
+    # one chunk of queue_email_batch(): a single Brevo request
+    get_client().send_batch(recipients, subject, text)
@@ -1,3 +1,167 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from jobs.models import Job
+from jobs.queue import work
+
+from . import emailer
+
+
+class RegistrationEmailTests(TestCase):
+    def register(self):
+        return self.client.post(reverse('register'), {
+            'username': 'cook',
+            'first_name': 'Cook',
+            'email': 'cook@example.com',
+            'password': 'pass-word-1',
+            'password2': 'pass-word-1',
+        })
+
+    def test_code_is_queued_not_sent_during_the_request(self):
+        with mock.patch('account.tasks.send_email_brevo') as send:
+            response = self.register()
+            self.assertRedirects(response, reverse('verify_email'), fetch_redirect_response=False)
+            send.assert_not_called()
+            job = Job.objects.get()
+            self.assertEqual(job.name, 'account.send_email')
+            self.assertEqual(job.payload['to_email'], 'cook@example.com')
+
+            self.assertEqual(work(), (1, 0))
+        send.assert_called_once_with(
+            'cook@example.com', 'Your verification code', job.payload['text']
+        )
+
+    def test_failed_send_is_retried(self):
+        self.register()
+        with mock.patch('account.tasks.send_email_brevo', side_effect=RuntimeError('503')):
+            self.assertEqual(work(), (1, 1))
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.Status.QUEUED, 1))
+        self.assertTrue(get_user_model().objects.filter(username='cook').exists())
+
+
+class StubBrevo(BaseHTTPRequestHandler):
+    """Local stand-in for POST /v3/smtp/email.
+
+    Subject "reject" gets a 400, "slow" answers after half a second.
+    """
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse shows
+    connections = set()
+    payloads = []
+    keys = []
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        StubBrevo.connections.add(self.client_address)
+        StubBrevo.payloads.append(payload)
+        StubBrevo.keys.append(self.headers['api-key'])
+        if payload['subject'] == 'slow':
+            time.sleep(0.5)
+        if payload['subject'] == 'reject':
+            status, body = 400, {'code': 'invalid_parameter', 'message': 'bad sender'}
+        elif 'messageVersions' in payload:
+            count = len(payload['messageVersions'])
+            start = len(StubBrevo.payloads) * 100
+            status, body = 201, {'messageIds': [f'<{start + i}@stub>' for i in range(count)]}
+        else:
+            status, body = 201, {'messageId': f'<{len(StubBrevo.payloads)}@stub>'}
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except BrokenPipeError:
+            pass  # the client timed out waiting
+
+    def log_message(self, *args):
+        pass
+
+
+class BrevoClientTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubBrevo)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+
+    def setUp(self):
+        StubBrevo.connections.clear()
+        StubBrevo.payloads = []
+        StubBrevo.keys = []
+        self.enterContext(override_settings(
+            BREVO_API_BASE=f'http://127.0.0.1:{self.server.server_port}/v3',
+            BREVO_API_KEY='key-1',
+            BREVO_SENDER_EMAIL='blog@example.com',
+            BREVO_SENDER_NAME='Blog',
+            BREVO_BATCH_SIZE=2,
+        ))
+        # the thread's client was built with other settings
+        emailer._local.__dict__.clear()
+        self.addCleanup(emailer._local.__dict__.clear)
+
+    def test_sends_over_one_pooled_connection(self):
+        with self.assertLogs('account.emailer', 'INFO') as logs:
+            first = emailer.send_email_brevo('a@example.com', 'hello', 'text')
+            second = emailer.send_email_brevo('b@example.com', 'hello', 'text')
+        self.assertEqual((first, second), ('<1@stub>', '<2@stub>'))
+        self.assertEqual(len(StubBrevo.connections), 1)
+        self.assertEqual(StubBrevo.keys, ['key-1', 'key-1'])
+        self.assertEqual(StubBrevo.payloads[0], {
+            'sender': {'name': 'Blog', 'email': 'blog@example.com'},
+            'to': [{'email': 'a@example.com'}],
+            'subject': 'hello',
+            'textContent': 'text',
+        })
+        self.assertIn('brevo send sent: recipients=1 status=201', logs.output[0])
+        self.assertNotIn('a@example.com', ''.join(logs.output))
+
+    def test_batch_is_chunked_one_version_per_recipient(self):
+        recipients = [f'r{i}@example.com' for i in range(5)]
+        ids = emailer.get_client().send_batch(recipients, 'New post', 'Read it')
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(
+            [[v['to'] for v in p['messageVersions']] for p in StubBrevo.payloads],
+            [
+                [[{'email': 'r0@example.com'}], [{'email': 'r1@example.com'}]],
+                [[{'email': 'r2@example.com'}], [{'email': 'r3@example.com'}]],
+                [[{'email': 'r4@example.com'}]],
+            ],
+        )
+        self.assertEqual(len(StubBrevo.connections), 1)
+
+    def test_rejected_request_raises_and_logs(self):
+        with self.assertLogs('account.emailer', 'WARNING') as logs:
+            with self.assertRaises(requests.HTTPError):
+                emailer.send_email_brevo('a@example.com', 'reject', 'text')
+        self.assertIn('status=400', logs.output[0])
+        self.assertIn('bad sender', logs.output[0])
+
+    @override_settings(BREVO_READ_TIMEOUT=0.1)
+    def test_read_timeout(self):
+        emailer._local.__dict__.clear()
+        with self.assertLogs('account.emailer', 'WARNING'):
+            with self.assertRaises(requests.Timeout):
+                emailer.send_email_brevo('a@example.com', 'slow', 'text')
+
+    def test_queued_batch_sends_each_chunk_once(self):
+        recipients = [f'r{i}@example.com' for i in range(3)]
+        jobs = emailer.queue_email_batch(recipients, 'New post', 'Read it', key='post:1')
+        again = emailer.queue_email_batch(recipients, 'New post', 'Read it', key='post:1')
+        self.assertEqual([job.pk for job in jobs], [job.pk for job in again])
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(work(), (2, 0))
+        sent = [v['to'][0]['email'] for p in StubBrevo.payloads for v in p['messageVersions']]
+        self.assertEqual(sent, recipients)
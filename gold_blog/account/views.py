@@ -5,12 +5,17 @@ from django.views.decorators.http import require_POST
 from django.contrib.auth.hashers import make_password, check_password
 from django.utils import timezone
 
-from .emailer import send_email_brevo
+from .emailer import queue_email
 from .models import EmailOTP
 from .utils import generate_otp, otp_expire, otp_cooldown_remaining
 from .forms import UserRegistrationForm
 
 COOLDOWN_SECONDS = 60
+
+def otp_email_key(otp):
+    # one email per code issued, however often the request is repeated
+    return f"otp:{otp.user_id}:{otp.last_sent_at.timestamp()}"
+
 # Create your views here.
 # registration from forms.py->views.py -> urls.py -> templates
 def register(request):
@@ -26,7 +31,7 @@ def register(request):
             # save user object
             new_user.save()
             code = generate_otp()
-            EmailOTP.objects.update_or_create(
+            otp, _ = EmailOTP.objects.update_or_create(
                 user=new_user,
                 defaults={
                     'code_hash': make_password(code),
@@ -36,18 +41,13 @@ def register(request):
                 }
             )
 
-            try:
-                send_email_brevo(
-                    new_user.email,
-                    "Your verification code",
-                    f"Your code is: {code}",
-                )
-            except Exception:
-                messages.error(
-                    request,
-                    "We couldn't send the verification email. Please try again later."
-                )
-                return render(request, 'account/register.html', {'user_form': user_form})
+            # sent by the run_jobs worker, so a slow Brevo never holds up this request
+            queue_email(
+                new_user.email,
+                "Your verification code",
+                f"Your code is: {code}",
+                key=otp_email_key(otp),
+            )
 
             request.session['pending_user_id'] = new_user.id
             return redirect('verify_email')
@@ -133,7 +133,7 @@ def resend_otp(request):
     otp.attempts = 0
     otp.last_sent_at = timezone.now()
     otp.save()
-    send_email_brevo(user.email, "Your verification code", f"Your code is: {code}")
+    queue_email(user.email, "Your verification code", f"Your code is: {code}", key=otp_email_key(otp))
 
     return render(
                     request,
@@ -5,6 +5,8 @@ from django.contrib import admin
  it provides other class such as modelAdmin register function @admin.register decorator
  admin configratio obtion llike filter search display and other"""
 from .models import Post, Comment
+from . import cache
+from .comment_counts import recount
 """here one this to remind dot means from the current folder from that we import our Post class"""
 # Register your models here.
 @admin.register(Post)
@@ -27,6 +29,25 @@ class CommentAdmin(admin.ModelAdmin):
     list_display = ['user_name', 'user_email', 'post', 'created', 'active']
     list_filter = ['active', 'created', 'updated']
     search_fields = ['user__username', 'user__email', 'body']
+    actions = ['activate_comments', 'deactivate_comments']
+
+    # queryset.update() skips the signals that keep Post.active_comment_count
+    # and the sidebar cache, so both actions recount the posts they touched
+    # and invalidate the sidebar themselves. The post ids are read first: a
+    # changelist filtered on active no longer matches the rows once updated
+    @admin.action(description='Mark selected comments as active')
+    def activate_comments(self, request, queryset):
+        post_ids = set(queryset.values_list('post_id', flat=True))
+        queryset.update(active=True)
+        recount(post_ids)
+        cache.invalidate()
+
+    @admin.action(description='Mark selected comments as inactive')
+    def deactivate_comments(self, request, queryset):
+        post_ids = set(queryset.values_list('post_id', flat=True))
+        queryset.update(active=False)
+        recount(post_ids)
+        cache.invalidate()
     def user_email(self, obj):
         return obj.user.email if obj.user else ""
     def user_name(self, obj):
@@ -0,0 +1,194 @@
+"""In-memory prefix index behind the search-as-you-type endpoint.
+
+Every worker keeps a sorted array of lower-cased keys (each title from every
+word onwards, plus every tag name) and answers a prefix with a bisect and a
+short forward walk.
+
+Changes reach the workers through a log in the shared cache, like the like
+buffer in blog/likes.py: record() numbers a list of changed posts and tags
+with an atomic counter (the index version) once the transaction commits. A
+worker that notices a new version re-reads just those posts and tags and
+moves their keys in its array. Only when it has fallen more than MAX_CHANGES
+behind, or a log entry is gone, does it rebuild the whole array; invalidate()
+forces that for every worker. Saves that leave titles, slugs, dates, status
+and tags alone record nothing (see blog/signals.py).
+
+Recent answers sit in an LRU keyed by version, so stale entries can never be
+served and simply age out.
+"""
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+from threading import Lock
+
+from django.core.cache import cache
+from django.db import transaction
+from django.urls import reverse
+from taggit.models import Tag
+
+from .models import Post
+
+VERSION_KEY = 'blog:autocomplete:version'
+MAX_SUGGESTIONS = 8
+MAX_CHANGES = 200  # further behind than this, a worker rebuilds
+CHANGE_TIMEOUT = 60 * 60 * 24
+
+
+class PrefixIndex:
+    def __init__(self, entries):
+        # entries: (key, owner, suggestion); sorting them once makes every
+        # prefix a contiguous run starting at bisect_left(keys, prefix)
+        entries = sorted(entries, key=lambda entry: entry[0])
+        self.keys = [key for key, _, _ in entries]
+        self.owners = [owner for _, owner, _ in entries]
+        self.suggestions = [suggestion for _, _, suggestion in entries]
+        # ('post', id) or ('tag', id) -> its keys, to find them again
+        self.owned = defaultdict(list)
+        for key, owner, _ in entries:
+            self.owned[owner].append(key)
+
+    def lookup(self, prefix, limit):
+        results, seen = [], set()
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(results) < limit:
+            if not self.keys[i].startswith(prefix):
+                break
+            suggestion = self.suggestions[i]
+            i += 1
+            if suggestion['url'] not in seen:
+                seen.add(suggestion['url'])
+                results.append(suggestion)
+        return results
+
+    def remove(self, owner):
+        for key in self.owned.pop(owner, ()):
+            i = bisect_left(self.keys, key)
+            while self.owners[i] != owner:  # other owners may share the key
+                i += 1
+            del self.keys[i], self.owners[i], self.suggestions[i]
+
+    def replace(self, owner, entries):
+        """Swap the keys of ``owner`` for ``entries``: (key, suggestion) pairs."""
+        self.remove(owner)
+        for key, suggestion in entries:
+            i = bisect_left(self.keys, key)
+            self.keys.insert(i, key)
+            self.owners.insert(i, owner)
+            self.suggestions.insert(i, suggestion)
+            self.owned[owner].append(key)
+
+
+def post_entries(post):
+    suggestion = {
+        'type': 'post', 'label': post.title, 'url': post.get_absolute_url(),
+    }
+    words = post.title.lower().split()
+    # "orm" should find "Django ORM tips", so index every word onwards
+    return [(' '.join(words[i:]), suggestion) for i in range(len(words))]
+
+
+def tag_entries(tag):
+    return [(tag.name.lower(), {
+        'type': 'tag', 'label': tag.name,
+        'url': reverse('blog:post_list_by_tag', args=[tag.slug]),
+    })]
+
+
+def published_tags():
+    return Tag.objects.filter(post__status=Post.Status.PUBLISHED).distinct().only('name', 'slug')
+
+
+def build_index():
+    entries = []
+    for post in Post.published.only('id', 'title', 'slug', 'publish'):
+        entries.extend((key, ('post', post.pk), s) for key, s in post_entries(post))
+    for tag in published_tags():
+        entries.extend((key, ('tag', tag.pk), s) for key, s in tag_entries(tag))
+    return PrefixIndex(entries)
+
+
+def apply_change(index, kind, pk):
+    # re-read one post or tag; gone or unpublished means no keys
+    if kind == 'post':
+        post = Post.published.only('id', 'title', 'slug', 'publish').filter(pk=pk).first()
+        index.replace(('post', pk), post_entries(post) if post else [])
+    else:
+        tag = published_tags().filter(pk=pk).first()
+        index.replace(('tag', pk), tag_entries(tag) if tag else [])
+
+
+def current_version():
+    # seeded from the clock so a version lost to eviction never repeats
+    return cache.get_or_set(VERSION_KEY, time.time_ns, timeout=None)
+
+
+def _change_key(version):
+    return f'blog:autocomplete:change:{version}'
+
+
+def invalidate():
+    """Make every worker rebuild its whole index."""
+    try:
+        cache.incr(VERSION_KEY)  # with no log entry for it
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def _record(changes):
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)  # rebuilds anyway
+        return
+    cache.set(_change_key(version), changes, CHANGE_TIMEOUT)
+
+
+def record(posts=(), tags=()):
+    """Log changed post and tag ids for the workers once the transaction commits."""
+    changes = [('post', pk) for pk in posts] + [('tag', pk) for pk in tags]
+    if changes:
+        transaction.on_commit(lambda: _record(changes))
+
+
+_index = (None, None)
+_index_lock = Lock()
+
+
+def _catch_up(version):
+    # called with _index_lock held
+    global _index
+    built, index = _index
+    if built is not None and built >= version:
+        return index  # already there (or past it, for a request that read earlier)
+    changes = None
+    if built is not None and version - built <= MAX_CHANGES:
+        found = cache.get_many([_change_key(v) for v in range(built + 1, version + 1)])
+        if len(found) == version - built:
+            changes = [change for v in range(built + 1, version + 1) for change in found[_change_key(v)]]
+    if changes is None:
+        index = build_index()
+    else:
+        for kind, pk in dict.fromkeys(changes):  # each post or tag once
+            apply_change(index, kind, pk)
+    _index = (version, index)
+    return index
+
+
+def get_index(version):
+    with _index_lock:
+        return _catch_up(version)
+
+
+@lru_cache(maxsize=1024)
+def _suggest(version, prefix, limit):
+    # under the lock: another thread may be moving keys around
+    with _index_lock:
+        return tuple(_catch_up(version).lookup(prefix, limit))
+
+
+def suggest(prefix, limit=MAX_SUGGESTIONS):
+    prefix = ' '.join(prefix.lower().split())
+    if not prefix:
+        return []
+    return list(_suggest(current_version(), prefix, limit))
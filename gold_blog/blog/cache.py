@@ -0,0 +1,192 @@
+"""Two-level cache-aside helpers for the blog.
+
+Reads go through a small per-process LRU (BLOG_LOCAL_CACHE_SIZE entries, each
+kept at most BLOG_LOCAL_CACHE_TIMEOUT seconds) and then through the shared
+cache (CACHES["default"]: locmem, file or redis, see foodie/settings.py).
+Hit/miss counters for both levels are kept per process, see stats().
+
+Cached data that depends on posts or comments is stored under versioned keys
+(versioned_key()): the version number lives in the shared cache and save/
+delete signals bump it (see blog/signals.py), so every worker misses on its
+next read instead of keys being deleted one by one. The version itself is
+never held in the local LRU, which keeps invalidation immediate everywhere.
+
+get_or_build() adds stampede protection for the sidebar template tags:
+entries are stored as (value, fresh_until) and kept STALE_GRACE seconds past
+their TTL. After fresh_until one request takes a short lock and rebuilds
+while the others keep serving the stale value; on a cold key the others wait
+briefly for that rebuild instead of all running the same query at once.
+"""
+import time
+from collections import Counter, OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+
+STALE_GRACE = 60  # seconds a stale entry may still be served during a rebuild
+LOCK_TIMEOUT = 10  # a crashed rebuild frees the lock after this long
+WAIT_STEP = 0.05
+WAIT_STEPS = 20
+
+_missing = object()
+
+
+class LocalCache:
+    """Thread-safe LRU with a per-entry expiry, private to one process."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        if self.maxsize <= 0 or timeout <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local = LocalCache(settings.BLOG_LOCAL_CACHE_SIZE)
+_counters = Counter()
+_counters_lock = Lock()
+
+
+def _count(event):
+    with _counters_lock:
+        _counters[event] += 1
+
+
+def stats():
+    """Hit/miss counts of this process: local_hits, shared_hits, misses."""
+    with _counters_lock:
+        return {
+            'local_hits': _counters['local_hits'],
+            'shared_hits': _counters['shared_hits'],
+            'misses': _counters['misses'],
+        }
+
+
+def reset_stats():
+    with _counters_lock:
+        _counters.clear()
+
+
+def _local_timeout(timeout):
+    if timeout is None:
+        return settings.BLOG_LOCAL_CACHE_TIMEOUT
+    return min(timeout, settings.BLOG_LOCAL_CACHE_TIMEOUT)
+
+
+def get(key, default=None):
+    """Read ``key`` from the local LRU, then from the shared cache."""
+    value = local.get(key, _missing)
+    if value is not _missing:
+        _count('local_hits')
+        return value
+    value = cache.get(key, _missing)
+    if value is _missing:
+        _count('misses')
+        return default
+    _count('shared_hits')
+    local.set(key, value, _local_timeout(None))
+    return value
+
+
+def set(key, value, timeout=None):
+    """Write ``key`` to both levels; ``timeout`` defaults to the shared cache's."""
+    cache.set(key, value, timeout if timeout is not None else cache.default_timeout)
+    local.set(key, value, _local_timeout(timeout))
+
+
+def delete(key):
+    # only this process's LRU can be cleared; other workers age theirs out
+    local.delete(key)
+    cache.delete(key)
+
+
+def cached(key, build, timeout=None):
+    """Cache-aside: return the cached value of ``key`` or store ``build()``."""
+    value = get(key, _missing)
+    if value is _missing:
+        value = build()
+        set(key, value, timeout)
+    return value
+
+
+def current_version(namespace='sidebar'):
+    # seeded from the clock so a version lost to eviction never repeats
+    return cache.get_or_set(f'blog:{namespace}:version', time.time_ns, timeout=None)
+
+
+def invalidate(namespace='sidebar'):
+    key = f'blog:{namespace}:version'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def versioned_key(namespace, name):
+    return f'blog:{namespace}:{current_version(namespace)}:{name}'
+
+
+def get_or_build(name, build, timeout=None):
+    """Return the cached result of ``build()`` for ``name``, rebuilding at most once."""
+    if timeout is None:
+        timeout = settings.BLOG_SIDEBAR_CACHE_TIMEOUT
+    key = versioned_key('sidebar', name)
+    lock_key = f'{key}:lock'
+
+    locked = False
+    entry = get(key)
+    if entry is not None:
+        value, fresh_until = entry
+        if fresh_until > time.time():
+            return value
+        locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+        if not locked:
+            return value  # stale, but somebody else already rebuilds it
+    else:
+        for _ in range(WAIT_STEPS):
+            locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+            if locked:
+                break
+            time.sleep(WAIT_STEP)
+            entry = get(key)
+            if entry is not None:
+                return entry[0]
+        # waited long enough: build it ourselves rather than fail the page
+
+    try:
+        value = build()
+        fresh_until = time.time() + timeout
+        cache.set(key, (value, fresh_until), timeout + STALE_GRACE)
+        local.set(key, (value, fresh_until), _local_timeout(timeout))
+    finally:
+        if locked:  # never free a lock another request holds
+            cache.delete(lock_key)
+    return value
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# backends whose add() and incr() are atomic across processes
+SHARED_CACHE_BACKENDS = (
+    'django.core.cache.backends.redis.RedisCache',
+    'django_redis.cache.RedisCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    # buffered likes, the LLM key pool limits, the index writer locks, the
+    # autocomplete change log, the sidebar stampede lock and the page
+    # versions all coordinate through cache.add()/cache.incr()
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DEBUG or backend in SHARED_CACHE_BACKENDS:
+        return []
+    return [
+        Warning(
+            f'The default cache ({backend}) is not shared atomically between '
+            'processes.',
+            hint=(
+                'Locks, counters and change logs kept in the cache only hold '
+                'within one process: with several gunicorn workers, or with '
+                'run_jobs and flush_likes running beside them, likes, key pool '
+                'limits and index writes can be lost or doubled. Set REDIS_URL '
+                '(or CACHE_BACKEND=redis).'
+            ),
+            id='blog.W001',
+        )
+    ]
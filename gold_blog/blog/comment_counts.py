@@ -0,0 +1,28 @@
+"""Post.active_comment_count, so pages never COUNT(*) the comments table.
+
+Single comments move the counter with F() updates from signals (new,
+moderated, deleted; see blog/signals.py). Bulk changes that bypass signals,
+such as the admin's activate/deactivate actions, call recount() for the
+posts they touched, and reconcile_comment_counts recounts everything.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Post
+
+
+def adjust(post_id, delta):
+    if delta:
+        Post.objects.filter(pk=post_id).update(
+            active_comment_count=F('active_comment_count') + delta
+        )
+
+
+def recount(post_ids=None):
+    """Recompute active_comment_count from the comments table (all posts by default)."""
+    active = (
+        Comment.objects.filter(post_id=OuterRef('pk'), active=True)
+        .order_by().values('post_id').annotate(n=Count('id')).values('n')
+    )
+    posts = Post.objects.all() if post_ids is None else Post.objects.filter(pk__in=post_ids)
+    return posts.update(active_comment_count=Coalesce(Subquery(active), 0))
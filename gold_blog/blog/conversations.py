@@ -0,0 +1,87 @@
+"""LLM chat history stored in the database instead of the session.
+
+The session only holds the id of the user's current Conversation. Each
+answer appends one Turn row with its markdown already rendered, so a chat
+turn no longer rewrites a growing session blob and the chat page no longer
+re-renders every stored answer. The page loads the newest turns and pages
+back through older ones on (created, id) with pagination.paginate_newest.
+
+The context sent with a prompt is the newest turns that fit in
+LLM_CONTEXT_TOKENS, estimated at about four characters per token, rather
+than a fixed number of turns: many short exchanges fit, while one long
+answer may be all there is room for. Passages retrieved from our own posts
+are sent too, so they come out of the same budget.
+"""
+import math
+
+from django.conf import settings
+
+from . import llm
+from .models import Conversation, Turn
+from .pagination import paginate_newest
+
+SESSION_KEY = 'llm_conversation'
+LEGACY_SESSION_KEY = 'llm_history'  # full history, as sessions used to store it
+CHARS_PER_TOKEN = 4
+MAX_CONTEXT_TURNS = 50  # never look further back than this
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def current(session, user, create=False):
+    """The conversation whose id is in ``session``, started if ``create``."""
+    conversation = None
+    conversation_id = session.get(SESSION_KEY)
+    if conversation_id is not None:
+        conversation = Conversation.objects.filter(pk=conversation_id, user=user).first()
+    if conversation is None and (create or LEGACY_SESSION_KEY in session):
+        conversation = Conversation.objects.create(user=user)
+        session[SESSION_KEY] = conversation.pk
+        for item in session.pop(LEGACY_SESSION_KEY, []):
+            append(conversation, item.get('prompt', ''), item.get('response', ''))
+    return conversation
+
+
+def append(conversation, prompt, response, response_html=None):
+    """Store a turn; pass ``response_html`` when the answer is already rendered."""
+    if response_html is None:
+        response_html = llm.render(response)
+    return Turn.objects.create(
+        conversation=conversation,
+        prompt=prompt,
+        response=response,
+        response_html=response_html,
+        tokens=estimate_tokens(prompt) + estimate_tokens(response),
+    )
+
+
+def context(conversation, prompt, passages=()):
+    """The newest turns that fit in the token budget next to ``prompt``, oldest first.
+
+    ``passages`` are the ones sent with ``prompt`` (see llm.build_contents).
+    """
+    budget = settings.LLM_CONTEXT_TOKENS - estimate_tokens(prompt)
+    if passages:
+        budget -= estimate_tokens(llm.passages_text(passages))
+    window = []
+    turns = (
+        conversation.turns.only('prompt', 'response', 'tokens')
+        .order_by('-created', '-pk')[:MAX_CONTEXT_TURNS]
+    )
+    for turn in turns:
+        budget -= turn.tokens
+        if budget < 0:
+            break
+        window.append({'prompt': turn.prompt, 'response': turn.response})
+    window.reverse()
+    return window
+
+
+def history_page(conversation, token, per_page):
+    """A CursorPage of turns, newest first, older than the ``token`` turn."""
+    return paginate_newest(
+        conversation.turns.only('id', 'prompt', 'response_html', 'created'),
+        token, per_page,
+    )
@@ -1,8 +1,6 @@
 from django.contrib.syndication.views import Feed
-from django.template.defaultfilters import truncatewords_html
 from django.urls import reverse_lazy
 
-import markdown
 from .models import Post
 class LatestPostsFeed(Feed):
     title = 'My blog'
@@ -10,14 +8,13 @@ class LatestPostsFeed(Feed):
     description = 'New posts of my blog.'
     
     def items(self):
-        return Post.published.all()[:5]
+        return Post.published.defer('body', 'body_html', 'search_vector')[:5]
     
     def item_title(self, item):
         return item.title
     
     def item_description(self, item):
-        return truncatewords_html(markdown.markdown(item.body),
-    30)
+        return item.get_excerpt(30)
         
     def item_pubdate(self, item):
         return item.publish
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""Health, rotation and rate limits for the GEMINI_API_KEY_* pool.
+
+Every worker shares the pool state through the cache, keyed by the name of
+the environment variable (never the key itself):
+
+* a circuit breaker per key. A 429 (or a 401/403) opens it at once, and
+  LLM_KEY_FAILURE_THRESHOLD errors within a minute open it too. An open key
+  is skipped, with no request sent, for LLM_KEY_COOLDOWN seconds (or the
+  server's Retry-After), doubling on every trip in a row up to 16x. When the
+  cooldown ends a single trial request is let through (half-open); success
+  closes the breaker and failure opens it again;
+* a rotating start, so healthy keys share the load instead of the first one
+  taking every request;
+* at most LLM_KEY_MAX_CONCURRENCY requests in flight per key, and a token
+  bucket of LLM_KEY_RATE requests a minute with bursts of LLM_KEY_BURST. A
+  key that is busy or out of tokens is passed over like an open one;
+* counters for requests, errors, 429s and time to response headers, read
+  back by stats() and the llm_key_stats command.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+PREFIX = 'blog:llm:keys'
+FAILURE_WINDOW = 60  # seconds over which errors add up towards a trip
+MAX_BACKOFF = 16  # the cooldown doubles per consecutive trip up to this factor
+INFLIGHT_TIMEOUT = 600  # a crashed worker's slots free themselves this long after the last request
+COUNTERS = ('requests', 'errors', 'rate_limited', 'timed', 'latency_ms')
+
+
+def _key(name, part):
+    return f'{PREFIX}:{name}:{part}'
+
+
+async def _incr(key, delta=1, timeout=None):
+    await cache.aadd(key, 0, timeout)
+    try:
+        return await cache.aincr(key, delta)
+    except ValueError:  # expired between the two calls
+        await cache.aset(key, delta, timeout)
+        return delta
+
+
+async def ordered(names):
+    """(name, trial) for the keys a request may use, in rotation order.
+
+    Keys whose cooldown has ended come last, flagged as trials: acquire()
+    lets only one request at a time through on them.
+    """
+    if not names:
+        return []
+    start = await _incr(f'{PREFIX}:rotation') % len(names)
+    names = names[start:] + names[:start]
+    state = await cache.aget_many(
+        [_key(name, part) for name in names for part in ('open', 'tripped')]
+    )
+    closed = [(name, False) for name in names if _key(name, 'tripped') not in state]
+    half_open = [
+        (name, True) for name in names
+        if _key(name, 'tripped') in state and _key(name, 'open') not in state
+    ]
+    return closed + half_open
+
+
+async def retry_after(names):
+    """Seconds until the first open breaker among ``names`` closes, if known."""
+    until = await cache.aget_many([_key(name, 'open') for name in names])
+    if not until:
+        return None
+    return max(0, round(min(until.values()) - time.time()))
+
+
+async def _take_token(name):
+    rate, burst = settings.LLM_KEY_RATE, settings.LLM_KEY_BURST
+    if rate <= 0:
+        return True
+    lock = _key(name, 'bucket-lock')
+    for _ in range(10):
+        if await cache.aadd(lock, 1, 5):
+            break
+        await asyncio.sleep(0.002)
+    else:
+        return False  # too contended to tell: treat the key as busy
+    try:
+        now = time.time()
+        tokens, updated = await cache.aget(_key(name, 'bucket'), (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate / 60)
+        if tokens < 1:
+            return False
+        # idle a full refill and the bucket is simply full again
+        await cache.aset(_key(name, 'bucket'), (tokens - 1, now), 60 * burst / rate + 1)
+        return True
+    finally:
+        await cache.adelete(lock)
+
+
+async def acquire(name, trial=False):
+    """Take a concurrency slot and a token for ``name``; False if it has none."""
+    if trial and not await cache.aadd(_key(name, 'trial'), 1, settings.LLM_TIMEOUT * 2):
+        return False  # another request is already trying the key
+    inflight = _key(name, 'inflight')
+    slots = await _incr(inflight, timeout=INFLIGHT_TIMEOUT)
+    # incr keeps the first timeout on Redis and drops it on other backends:
+    # count it from the newest request so live slots never expire early
+    await cache.atouch(inflight, INFLIGHT_TIMEOUT)
+    if slots <= settings.LLM_KEY_MAX_CONCURRENCY:
+        if await _take_token(name):
+            return True
+    await release(name)
+    if trial:
+        await cache.adelete(_key(name, 'trial'))
+    return False
+
+
+async def release(name):
+    """Give back the slot taken by acquire()."""
+    try:
+        await cache.adecr(_key(name, 'inflight'))
+    except ValueError:
+        pass  # expired meanwhile
+
+
+async def _trip(name, cooldown=None):
+    trips = await _incr(_key(name, 'tripped'))
+    if cooldown is None:
+        cooldown = settings.LLM_KEY_COOLDOWN * min(2 ** (trips - 1), MAX_BACKOFF)
+    await cache.aset(_key(name, 'open'), time.time() + cooldown, cooldown)
+    await cache.adelete_many([_key(name, 'failures'), _key(name, 'trial')])
+
+
+async def record(name, status=None, latency=None, retry_after=None):
+    """Count the outcome of one request: an HTTP ``status``, or None for a network error."""
+    await _incr(_key(name, 'requests'))
+    if latency is not None:
+        await _incr(_key(name, 'timed'))
+        await _incr(_key(name, 'latency_ms'), round(latency * 1000))
+    if status == 200:
+        if await cache.aget(_key(name, 'tripped')) is not None:
+            await cache.adelete_many([_key(name, part) for part in ('tripped', 'trial')])
+        await cache.adelete(_key(name, 'failures'))
+        return
+    await _incr(_key(name, 'errors'))
+    if status == 429:
+        await _incr(_key(name, 'rate_limited'))
+        await _trip(name, retry_after)
+    elif status in (401, 403):
+        # a revoked or mistyped key will not recover by itself soon
+        await _trip(name, settings.LLM_KEY_COOLDOWN * MAX_BACKOFF)
+    elif status is None or status >= 500:
+        on_trial = await cache.aget(_key(name, 'tripped')) is not None
+        failures = await _incr(_key(name, 'failures'), timeout=FAILURE_WINDOW)
+        if on_trial or failures >= settings.LLM_KEY_FAILURE_THRESHOLD:
+            await _trip(name)
+    else:
+        # other 4xx are the request's fault, not the key's
+        await cache.adelete(_key(name, 'trial'))
+
+
+def parse_retry_after(value):
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return None  # an HTTP date or nothing: use our own cooldown
+
+
+def stats(names):
+    """Per-key breaker state and counters, for all workers together."""
+    keys = [_key(name, part) for name in names for part in (
+        *COUNTERS, 'open', 'tripped', 'inflight',
+    )]
+    values = cache.get_many(keys)
+    report = {}
+    for name in names:
+        counts = {part: values.get(_key(name, part), 0) for part in COUNTERS}
+        if _key(name, 'open') in values:
+            state = 'open'
+        elif _key(name, 'tripped') in values:
+            state = 'half-open'
+        else:
+            state = 'closed'
+        report[name] = {
+            'state': state,
+            'requests': counts['requests'],
+            'errors': counts['errors'],
+            'rate_limited': counts['rate_limited'],
+            'inflight': values.get(_key(name, 'inflight'), 0),
+            'avg_latency_ms': (
+                counts['latency_ms'] / counts['timed'] if counts['timed'] else None
+            ),
+        }
+    return report
@@ -0,0 +1,201 @@
+"""Likes: the users_like M2M plus a denormalized Post.like_count.
+
+like()/unlike() write the M2M row directly and move like_count with an F()
+update in the same transaction, so a click costs two small queries and
+never a COUNT(*). Other writers (admin, shell) go through users_like.add()
+and friends; a m2m_changed receiver recounts those posts (blog/signals.py),
+and the reconcile_like_counts command repairs any drift.
+
+With BLOG_LIKE_BUFFERING on, toggle() only records the click in the shared
+cache: a log of (post, user, liked, delta) entries numbered by an atomic
+counter, the viewer's latest state and a per-post pending delta. A short
+per-viewer lock (cache.add) makes reading and changing that state atomic.
+Bursts of like/unlike clicks then reach the database once, when flush()
+(the flush_likes command) applies the last state of every (post, user) pair
+and drops the states it applied, so later reads come from the database. A
+counter lost to eviction restarts after the entries still in the log, so
+none of them is overwritten or skipped with its delta left pending.
+"""
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import trending
+from .models import Post
+
+Like = Post.users_like.through
+BUFFER_TIMEOUT = 60 * 60 * 24  # flush_likes must run well within this
+SEQ_KEY = 'blog:likes:seq'
+FLUSHED_KEY = 'blog:likes:flushed'
+FLUSH_LOCK_KEY = 'blog:likes:flush-lock'
+LOCK_TRIES = 50  # ~0.5s of waiting for a viewer's previous click
+SCAN_SIZE = 100  # log entries looked up at a time when the counter is lost
+
+
+def has_liked(post_id, user_id):
+    # answered by the (post_id, user_id) unique index of the M2M table
+    return Like.objects.filter(post_id=post_id, user_id=user_id).exists()
+
+
+def like(post_id, user_id):
+    with transaction.atomic():
+        _, created = Like.objects.get_or_create(post_id=post_id, user_id=user_id)
+        if created:
+            Post.objects.filter(pk=post_id).update(like_count=F('like_count') + 1)
+            trending.record({post_id: trending.LIKE_WEIGHT})
+    return created
+
+
+def unlike(post_id, user_id):
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(post_id=post_id, user_id=user_id).delete()
+        if deleted:
+            Post.objects.filter(pk=post_id).update(like_count=F('like_count') - 1)
+            trending.record({post_id: -trending.LIKE_WEIGHT})
+    return bool(deleted)
+
+
+def recount(post_ids=None):
+    """Recompute like_count from the M2M table (all posts by default)."""
+    likes = (
+        Like.objects.filter(post_id=OuterRef('pk'))
+        .order_by().values('post_id').annotate(n=Count('id')).values('n')
+    )
+    posts = Post.objects.all() if post_ids is None else Post.objects.filter(pk__in=post_ids)
+    return posts.update(like_count=Coalesce(Subquery(likes), 0))
+
+
+def _state_key(post_id, user_id):
+    return f'blog:likes:state:{post_id}:{user_id}'
+
+
+def _lock_key(post_id, user_id):
+    return f'blog:likes:lock:{post_id}:{user_id}'
+
+
+def _delta_key(post_id):
+    return f'blog:likes:delta:{post_id}'
+
+
+def _entry_key(seq):
+    return f'blog:likes:entry:{seq}'
+
+
+def _incr(key, delta, timeout=BUFFER_TIMEOUT):
+    cache.add(key, 0, timeout)
+    return cache.incr(key, delta)
+
+
+def _last_logged():
+    # the highest number still in the log: entries are numbered without
+    # gaps from the last flushed one on
+    seq = cache.get(FLUSHED_KEY, 0)
+    while True:
+        numbers = range(seq + 1, seq + SCAN_SIZE + 1)
+        found = cache.get_many([_entry_key(n) for n in numbers])
+        if len(found) < SCAN_SIZE:
+            return max([seq, *(n for n in numbers if _entry_key(n) in found)])
+        seq += SCAN_SIZE
+
+
+def _next_seq():
+    if cache.get(SEQ_KEY) is None:
+        # evicted: carry on after the clicks still waiting for flush(),
+        # rather than number new ones over them and lose their deltas
+        cache.add(SEQ_KEY, _last_logged(), timeout=None)
+    return _incr(SEQ_KEY, 1, timeout=None)
+
+
+@contextmanager
+def _user_lock(post_id, user_id):
+    # one click at a time per viewer and post: two at once would both see
+    # the old state and count the same change twice
+    key = _lock_key(post_id, user_id)
+    for _ in range(LOCK_TRIES):
+        if cache.add(key, 1, 5):
+            break
+        time.sleep(0.01)
+    else:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        cache.delete(key)
+
+
+def pending_delta(post_id):
+    return cache.get(_delta_key(post_id), 0)
+
+
+def buffered_state(post_id, user_id, default):
+    state = cache.get(_state_key(post_id, user_id))
+    return default if state is None else state[0]
+
+
+def toggle(post_id, user_id, liked, buffered=False):
+    """Set the like state; return True if it changed."""
+    if not buffered:
+        return like(post_id, user_id) if liked else unlike(post_id, user_id)
+    with _user_lock(post_id, user_id) as locked:
+        if not locked:
+            return False  # the same viewer's other click is still being recorded
+        state = cache.get(_state_key(post_id, user_id))
+        current = has_liked(post_id, user_id) if state is None else state[0]
+        if current == liked:
+            return False
+        delta = 1 if liked else -1
+        seq = _next_seq()
+        cache.set(_entry_key(seq), (post_id, user_id, liked, delta), BUFFER_TIMEOUT)
+        # (state, seq of the click that set it): flush() drops states it applied
+        cache.set(_state_key(post_id, user_id), (liked, seq), BUFFER_TIMEOUT)
+        _incr(_delta_key(post_id), delta)
+        return True
+
+
+def flush():
+    """Apply buffered clicks to the database; return the number of writes."""
+    if not cache.add(FLUSH_LOCK_KEY, 1, 60):
+        return 0  # another flush is running
+    try:
+        last = cache.get(SEQ_KEY, 0)
+        first = cache.get(FLUSHED_KEY, 0) + 1
+        if first > last + 1:
+            first = 1  # the counter was evicted and started over
+        if first > last:
+            return 0
+        entries = cache.get_many([_entry_key(seq) for seq in range(first, last + 1)])
+        final, deltas = {}, {}
+        for seq in range(first, last + 1):
+            entry = entries.get(_entry_key(seq))
+            if entry is None:
+                continue  # expired: reconcile_like_counts covers the gap
+            post_id, user_id, liked, delta = entry
+            final[post_id, user_id] = liked  # later clicks win
+            deltas[post_id] = deltas.get(post_id, 0) + delta
+        writes = 0
+        for (post_id, user_id), liked in final.items():
+            writes += toggle(post_id, user_id, liked)
+        for post_id, delta in deltas.items():
+            if delta:
+                _incr(_delta_key(post_id), -delta)
+        for post_id, user_id in final:
+            _forget_state(post_id, user_id, last)
+        cache.set(FLUSHED_KEY, last, timeout=None)
+        cache.delete_many([_entry_key(seq) for seq in range(first, last + 1)])
+        return writes
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+
+
+def _forget_state(post_id, user_id, last):
+    # the database has it now, and may be edited (admin, shell) before the
+    # state would expire; a click made after ``last`` is still pending
+    with _user_lock(post_id, user_id) as locked:
+        state = cache.get(_state_key(post_id, user_id))
+        if locked and state is not None and state[1] <= last:
+            cache.delete(_state_key(post_id, user_id))
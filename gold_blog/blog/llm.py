@@ -0,0 +1,232 @@
+"""Async Gemini client behind the chat widget.
+
+All calls go through one pooled httpx.AsyncClient per event loop, so a
+worker keeps its TLS connections to the API open between prompts instead of
+paying a new handshake each time. stream_reply() asks for an SSE stream
+(``:streamGenerateContent?alt=sse``) and yields text as it arrives, trying
+the GEMINI_API_KEY_* keys until one answers. blog/keypool.py decides the
+order and skips keys that are rate limited, failing, busy or out of tokens
+without sending them anything. Once text has been sent on to the browser
+there is no switching keys; a broken stream ends with LLMError.
+
+Served through foodie/asgi.py, a slow answer only holds a coroutine, not a
+whole worker process.
+
+Answers are cached by a hash of the normalized request (model, history
+window and prompt) for LLM_CACHE_TIMEOUT seconds: in a per-process LRU of
+LLM_CACHE_SIZE entries, then in the shared cache. An entry holds the text
+and its markdown HTML, so a repeated question costs neither an API call nor
+a render. cache_stats() reports the hit rate of this process.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from collections import Counter
+
+import httpx
+import markdown
+from django.conf import settings
+from django.core.cache import cache
+
+from . import keypool
+from .cache import LocalCache
+
+KEY_NAMES = [f'GEMINI_API_KEY_{i}' for i in range(1, 5)]
+RETRIEVAL_PREAMBLE = (
+    'Excerpts from posts on this blog that may be relevant. Use them when they '
+    'help and mention the post you took something from.'
+)
+
+
+class LLMError(Exception):
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
+
+def api_keys():
+    """{name: key} of the GEMINI_API_KEY_* variables that are set."""
+    return {name: os.getenv(name) for name in KEY_NAMES if os.getenv(name)}
+
+
+def passages_text(passages):
+    """The part ``passages`` from blog/retrieval.py take up in the prompt."""
+    excerpts = '\n\n'.join(
+        'From "{title}" ({url}):\n{text}'.format(**passage)
+        for passage in passages
+    )
+    return f'{RETRIEVAL_PREAMBLE}\n\n{excerpts}'
+
+
+def build_contents(history, prompt, passages=()):
+    """Gemini ``contents`` for the ``history`` turns plus ``prompt``.
+
+    ``history`` is already cut to the context window, see blog/conversations.py.
+    ``passages`` from blog/retrieval.py go in a part of their own before the
+    prompt.
+    """
+    contents = []
+    for item in history:
+        if item.get('prompt'):
+            contents.append({'role': 'user', 'parts': [{'text': item['prompt']}]})
+        if item.get('response'):
+            contents.append({'role': 'model', 'parts': [{'text': item['response']}]})
+    parts = [{'text': prompt}]
+    if passages:
+        parts.insert(0, {'text': passages_text(passages)})
+    contents.append({'role': 'user', 'parts': parts})
+    return contents
+
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    # an AsyncClient's pool belongs to the loop it was first used on
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            base_url=settings.LLM_API_BASE,
+            timeout=httpx.Timeout(settings.LLM_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+        _clients[loop] = client
+    return client
+
+
+def _stream_url():
+    return f'/v1/models/{settings.LLM_MODEL}:streamGenerateContent'
+
+
+def _chunk_text(data):
+    try:
+        parts = data['candidates'][0]['content']['parts']
+    except (KeyError, IndexError, TypeError):
+        return ''
+    return ''.join(part.get('text', '') for part in parts)
+
+
+async def stream_reply(contents):
+    """Yield the reply to ``contents`` piece by piece, failing over between keys."""
+    keys = api_keys()
+    last_error = None
+    for name, trial in await keypool.ordered(list(keys)):
+        if not await keypool.acquire(name, trial):
+            last_error = {'key': name, 'error': 'busy'}
+            continue  # at its concurrency or rate limit: next key
+        started = False
+        sent = time.monotonic()
+        try:
+            async with get_client().stream(
+                'POST', _stream_url(),
+                params={'alt': 'sse'},
+                headers={'x-goog-api-key': keys[name]},
+                json={'contents': contents},
+            ) as response:
+                latency = time.monotonic() - sent
+                if response.status_code != 200:
+                    await response.aread()  # drain it so the connection is reused
+                    await keypool.record(
+                        name, response.status_code, latency,
+                        keypool.parse_retry_after(response.headers.get('retry-after')),
+                    )
+                    last_error = {'key': name, 'status': response.status_code}
+                    continue  # quota, bad key, outage: try the next key
+                async for line in response.aiter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    text = _chunk_text(json.loads(line[len('data:'):]))
+                    if text:
+                        started = True
+                        yield text
+                await keypool.record(name, 200, latency)
+                return
+        except (httpx.HTTPError, ValueError) as exc:
+            await keypool.record(name)
+            if started:
+                raise LLMError('The answer was cut off.', {'error': str(exc)}) from exc
+            last_error = {'key': name, 'error': str(exc)}
+        finally:
+            await keypool.release(name)
+    if last_error is None and keys:
+        # every breaker is open: fail fast instead of spending round trips
+        raise LLMError('All API keys are cooling down.', {
+            'retry_after': await keypool.retry_after(list(keys)),
+        })
+    raise LLMError('All API keys failed or quota exceeded.', last_error)
+
+
+async def generate(contents):
+    """The whole reply as one string."""
+    return ''.join([text async for text in stream_reply(contents)])
+
+
+_local = LocalCache(settings.LLM_CACHE_SIZE)
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def _count(event):
+    with _counters_lock:
+        _counters[event] += 1
+
+
+def cache_key(contents):
+    # whitespace differences should not cost another API call
+    normalized = [
+        [item['role'], [' '.join(part.get('text', '').split()) for part in item['parts']]]
+        for item in contents
+    ]
+    payload = json.dumps([settings.LLM_MODEL, normalized], separators=(',', ':'))
+    return 'blog:llm:' + hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def cached_reply(contents):
+    """The cached {"text", "html"} answer to ``contents``, or None."""
+    key = cache_key(contents)
+    entry = _local.get(key)
+    if entry is not None:
+        _count('local_hits')
+        return entry
+    entry = await cache.aget(key)
+    if entry is None:
+        _count('misses')
+        return None
+    _count('shared_hits')
+    _local.set(key, entry, settings.LLM_CACHE_TIMEOUT)
+    return entry
+
+
+def render(text):
+    return markdown.markdown(text)
+
+
+async def remember_reply(contents, text):
+    """Render ``text`` once and cache it; returns the {"text", "html"} entry."""
+    entry = {'text': text, 'html': render(text)}
+    key = cache_key(contents)
+    _local.set(key, entry, settings.LLM_CACHE_TIMEOUT)
+    await cache.aset(key, entry, settings.LLM_CACHE_TIMEOUT)
+    return entry
+
+
+def cache_stats():
+    with _counters_lock:
+        hits = _counters['local_hits'] + _counters['shared_hits']
+        lookups = hits + _counters['misses']
+        return {
+            'local_hits': _counters['local_hits'],
+            'shared_hits': _counters['shared_hits'],
+            'misses': _counters['misses'],
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
+
+
+def reset_cache_stats():
+    with _counters_lock:
+        _counters.clear()
@@ -0,0 +1,45 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from blog.recommender import TfidfIndex
+
+
+def synthetic_posts(count, words_per_post, vocabulary_size, seed=0):
+    """Posts whose words follow a Zipf distribution, like real prose."""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"w{rng.integers(10**9):x}" for _ in range(vocabulary_size)])
+    ranks = np.arange(1, vocabulary_size + 1)
+    weights = 1 / ranks
+    weights /= weights.sum()
+    for post_id in range(count):
+        words = rng.choice(vocabulary, size=words_per_post, p=weights)
+        yield post_id, " ".join(words)
+
+
+class Command(BaseCommand):
+    help = "Time the TF-IDF build and top-K neighbour search on synthetic posts (no database)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+        parser.add_argument("--words", type=int, default=200)
+        parser.add_argument("--vocabulary", type=int, default=50_000)
+
+    def handle(self, *args, **options):
+        for size in options["sizes"]:
+            documents = list(
+                synthetic_posts(size, options["words"], options["vocabulary"])
+            )
+            started = time.perf_counter()
+            index = TfidfIndex.build(documents)
+            built = time.perf_counter()
+            for _ in index.neighbours():
+                pass
+            searched = time.perf_counter()
+            self.stdout.write(
+                f"{size:>8} posts: vectorize {built - started:6.2f}s  "
+                f"top-K {searched - built:7.2f}s  "
+                f"total {searched - started:7.2f}s  "
+                f"({len(index.terms)} terms, {index.matrix.nnz} non-zeros)"
+            )
@@ -0,0 +1,66 @@
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from blog.retrieval import CHUNK_WORDS, build_index, embed
+
+
+def synthetic_chunks(count, topics, vocabulary_size, seed=0):
+    """Chunks about one of ``topics`` topics: half topic words, half Zipf prose."""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"w{i:x}" for i in range(vocabulary_size)])
+    weights = 1 / np.arange(1, vocabulary_size + 1)
+    weights /= weights.sum()
+    topic_words = rng.integers(vocabulary_size, size=(topics, 300))
+    half = CHUNK_WORDS // 2
+    for chunk_id in range(count):
+        words = np.concatenate([
+            vocabulary[rng.choice(topic_words[rng.integers(topics)], half)],
+            rng.choice(vocabulary, CHUNK_WORDS - half, p=weights),
+        ])
+        rng.shuffle(words)
+        yield chunk_id, 0, " ".join(words)
+
+
+class Command(BaseCommand):
+    help = "Time retrieval queries against synthetic chunk indexes of growing size (no database)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--topics", type=int, default=200)
+        parser.add_argument("--vocabulary", type=int, default=50_000)
+        parser.add_argument("-k", type=int, default=4)
+
+    def handle(self, *args, **options):
+        k = options["k"]
+        for size in options["sizes"]:
+            chunks = list(synthetic_chunks(size, options["topics"], options["vocabulary"]))
+            # each query is a dozen words of one chunk, which should come back
+            sources = np.random.default_rng(1).integers(size, size=options["queries"])
+            queries = embed([" ".join(chunks[i][2].split()[:12]) for i in sources])
+            with tempfile.TemporaryDirectory() as brute_dir, \
+                    tempfile.TemporaryDirectory() as ann_dir:
+                started = time.perf_counter()
+                brute = build_index(chunks, brute_dir, ann_min_chunks=float("inf"))
+                built = time.perf_counter() - started
+                ann = build_index(chunks, ann_dir, ann_min_chunks=0)
+                for name, index in (("brute force", brute), ("IVF", ann)):
+                    timings, found = self.run(index, queries, sources, k)
+                    self.stdout.write(
+                        f"{size:>8} chunks  {name:<11}  "
+                        f"p50 {np.median(timings):7.2f}ms  p95 {np.percentile(timings, 95):7.2f}ms  "
+                        f"source in top {k}: {found:.0%}"
+                    )
+            self.stdout.write(f"{size:>8} chunks  built in {built:.2f}s")
+
+    def run(self, index, queries, sources, k):
+        timings, found = [], 0
+        for query, source in zip(queries, sources):
+            started = time.perf_counter()
+            hits = index.search(query, k)
+            timings.append((time.perf_counter() - started) * 1000)
+            found += any(row == source for row, _ in hits)
+        return timings, found / len(sources)
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.recommender import build_recommendations
+
+
+class Command(BaseCommand):
+    help = "Rebuild the TF-IDF matrix and content-based related posts"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index = build_recommendations()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(index.post_ids)} post(s), {len(index.terms)} term(s) "
+            f"in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.retrieval import build
+
+
+class Command(BaseCommand):
+    help = "Rebuild the chunk vector index the chat retrieves post excerpts from"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index = build()
+        live = int((index.rows[:, 0] >= 0).sum())
+        kind = "brute force" if index.centroids is None else f"{len(index.centroids)} lists"
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {live} chunk(s) ({kind}) "
+            f"in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog.similarity import rebuild_similar_posts
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored similar-posts table for every published post"
+
+    def handle(self, *args, **options):
+        count = rebuild_similar_posts()
+        self.stdout.write(self.style.SUCCESS(f"Stored similar posts for {count} post(s)"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog.likes import flush
+
+
+class Command(BaseCommand):
+    help = "Write like/unlike clicks buffered in the cache (BLOG_LIKE_BUFFERING) to the database"
+
+    def handle(self, *args, **options):
+        writes = flush()
+        self.stdout.write(self.style.SUCCESS(f"Applied {writes} buffered like change(s)"))
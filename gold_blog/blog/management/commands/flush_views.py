@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog.viewcounter import flush
+
+
+class Command(BaseCommand):
+    help = "Move the view counts collected in Redis into Post.views"
+
+    def handle(self, *args, **options):
+        count = flush()
+        self.stdout.write(self.style.SUCCESS(f"Updated view counts of {count} post(s)"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from blog import keypool, llm
+
+
+class Command(BaseCommand):
+    help = "Show the circuit breaker state and counters of every LLM API key"
+
+    def handle(self, *args, **options):
+        for name, row in keypool.stats(llm.KEY_NAMES).items():
+            configured = "" if name in llm.api_keys() else " (not set)"
+            latency = row["avg_latency_ms"]
+            self.stdout.write(
+                f"{name}{configured}: {row['state']}, {row['requests']} request(s), "
+                f"{row['errors']} error(s), {row['rate_limited']} rate limited, "
+                f"{row['inflight']} in flight, avg latency "
+                + ("-" if latency is None else f"{latency:.0f}ms")
+            )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the post search index of the configured search backend"
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt search index ({type(backend).__name__})")
+        )
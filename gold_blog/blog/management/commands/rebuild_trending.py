@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog.trending import rebuild
+
+
+class Command(BaseCommand):
+    help = "Reset the trending ranking from recent comments, current likes and views"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=14, help="Comment history to replay")
+
+    def handle(self, *args, **options):
+        count = rebuild(days=options["days"])
+        self.stdout.write(self.style.SUCCESS(f"Ranked {count} post(s)"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog.comment_counts import recount
+
+
+class Command(BaseCommand):
+    help = "Recompute every post's active_comment_count from the comments table"
+
+    def handle(self, *args, **options):
+        count = recount()
+        self.stdout.write(self.style.SUCCESS(f"Recounted comments of {count} post(s)"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog.likes import recount
+
+
+class Command(BaseCommand):
+    help = "Recompute every post's like_count from the users_like table"
+
+    def handle(self, *args, **options):
+        count = recount()
+        self.stdout.write(self.style.SUCCESS(f"Recounted likes of {count} post(s)"))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.rendering import RENDER_VERSION
+
+
+class Command(BaseCommand):
+    help = "Render (or re-render) the stored markdown HTML for every post"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-render posts even if their stored HTML is up to date.",
+        )
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        posts = Post.objects.only("id", "body", "render_version").order_by("id")
+        if not options["force"]:
+            posts = posts.exclude(render_version=RENDER_VERSION)
+
+        batch = []
+        rendered = 0
+        for post in posts.iterator(chunk_size=batch_size):
+            post.render_body()
+            batch.append(post)
+            if len(batch) >= batch_size:
+                rendered += self._flush(batch)
+        rendered += self._flush(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} post(s)"))
+
+    def _flush(self, batch):
+        # bulk_update skips save(), so `updated` is not bumped by a re-render
+        Post.objects.bulk_update(
+            batch, ["body_html", "excerpts", "render_version"]
+        )
+        count = len(batch)
+        batch.clear()
+        return count
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_post_rendered_html'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='post',
+            name='excerpt_html',
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpts',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,78 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_GIN = django.contrib.postgres.indexes.GinIndex(
+    fields=['search_vector'], name='blog_post_search_gin',
+)
+TITLE_TRGM = django.contrib.postgres.indexes.GinIndex(
+    fields=['title'], name='blog_post_title_trgm', opclasses=['gin_trgm_ops'],
+)
+
+TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION blog_post_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.body, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS blog_post_search_vector_trigger ON blog_post;
+CREATE TRIGGER blog_post_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, body, search_vector ON blog_post
+    FOR EACH ROW EXECUTE FUNCTION blog_post_search_vector_update();
+
+-- fires the trigger once for every existing row
+UPDATE blog_post SET search_vector = NULL;
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS blog_post_search_vector_trigger ON blog_post;
+DROP FUNCTION IF EXISTS blog_post_search_vector_update();
+"""
+
+
+def create_search_objects(apps, schema_editor):
+    # tsvector triggers and GIN indexes only exist on postgres; the SQLite
+    # deployment keeps the (unused) column and skips the rest.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Post = apps.get_model('blog', 'Post')
+    schema_editor.add_index(Post, SEARCH_GIN)
+    schema_editor.add_index(Post, TITLE_TRGM)
+    schema_editor.execute(TRIGGER_SQL)
+
+
+def drop_search_objects(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Post = apps.get_model('blog', 'Post')
+    schema_editor.execute(DROP_TRIGGER_SQL)
+    schema_editor.remove_index(Post, TITLE_TRGM)
+    schema_editor.remove_index(Post, SEARCH_GIN)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_post_excerpts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='post', index=SEARCH_GIN),
+                migrations.AddIndex(model_name='post', index=TITLE_TRGM),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_objects, drop_search_objects),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS blog_post_fts USING fts5("
+    "title, body, tokenize = 'unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS blog_post_fts_vocab "
+    "USING fts5vocab(blog_post_fts, 'row')",
+    "INSERT INTO blog_post_fts (rowid, title, body) SELECT id, title, body FROM blog_post",
+]
+
+DROP_SQL = [
+    "DROP TABLE IF EXISTS blog_post_fts_vocab",
+    "DROP TABLE IF EXISTS blog_post_fts",
+]
+
+
+def create_fts_index(apps, schema_editor):
+    # the FTS5 inverted index only backs the SQLite search backend
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_post_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
@@ -0,0 +1,26 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_sqlite_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_entries', to='blog.post')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_in', to='blog.post')),
+            ],
+            options={
+                'ordering': ['-score'],
+                'indexes': [models.Index(fields=['post', '-score'], name='blog_simila_post_id_386e71_idx')],
+                'constraints': [models.UniqueConstraint(fields=('post', 'similar'), name='unique_similar_post')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0016_similarpost'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='similarpost',
+            name='unique_similar_post',
+        ),
+        migrations.AddField(
+            model_name='similarpost',
+            name='kind',
+            field=models.CharField(choices=[('T', 'Shared tags'), ('C', 'Similar content')], default='T', max_length=1),
+        ),
+        migrations.AddConstraint(
+            model_name='similarpost',
+            constraint=models.UniqueConstraint(fields=('post', 'kind', 'similar'), name='unique_similar_post'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_likes(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Like = Post.users_like.through
+    likes = (
+        Like.objects.filter(post_id=OuterRef('pk'))
+        .order_by().values('post_id').annotate(n=Count('id')).values('n')
+    )
+    Post.objects.update(like_count=Coalesce(Subquery(likes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0017_similarpost_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0019_post_views'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostTrend',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='blog.post')),
+                ('score', models.FloatField(default=0)),
+                ('scored_at', models.DateTimeField()),
+                ('rank', models.FloatField(db_index=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    active = (
+        Comment.objects.filter(post_id=OuterRef('pk'), active=True)
+        .order_by().values('post_id').annotate(n=Count('id')).values('n')
+    )
+    Post.objects.update(active_comment_count=Coalesce(Subquery(active), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0021_comment_post_active_created'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='active_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-active_comment_count'], name='blog_post_active__762281_idx'),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
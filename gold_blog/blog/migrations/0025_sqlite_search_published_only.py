@@ -0,0 +1,35 @@
+from django.db import migrations
+
+PUBLISHED = 'PB'
+
+
+def drop_unpublished(apps, schema_editor):
+    # the SQLite search index now holds published posts only
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "DELETE FROM blog_post_fts WHERE rowid NOT IN "
+        "(SELECT id FROM blog_post WHERE status = %s)",
+        [PUBLISHED],
+    )
+
+
+def add_unpublished(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "INSERT INTO blog_post_fts (rowid, title, body) "
+        "SELECT id, title, body FROM blog_post WHERE status != %s",
+        [PUBLISHED],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0024_viewflush'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_unpublished, add_unpublished),
+    ]
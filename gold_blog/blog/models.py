@@ -2,7 +2,20 @@ from django.db import models
 from django.urls import reverse 
 from django.utils import timezone
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.utils.safestring import mark_safe
 from taggit.managers import TaggableManager
+
+from .rendering import (
+    EXCERPT_WORDS, RENDER_VERSION, render_excerpt, render_excerpts, render_markdown,
+)
+# the fields a post's search-as-you-type suggestions are made of
+SUGGESTION_FIELDS = ('title', 'slug', 'publish', 'status')
+# denormalized counters, only ever written with F() updates or update_fields
+COUNTER_FIELDS = frozenset({'like_count', 'views', 'active_comment_count'})
+
+
 class PublishedManager(models.Manager):
     def get_queryset(self) -> models.QuerySet:
         return (
@@ -22,6 +35,13 @@ class Post(models.Model):
         related_name='blog_posts'
     )
     body = models.TextField()
+    # cached markdown output, regenerated on save when body or RENDER_VERSION changes
+    body_html = models.TextField(blank=True, editable=False)
+    # {"12": "<p>...</p>", "30": "<p>...</p>"} keyed by word count, see EXCERPT_LENGTHS
+    excerpts = models.JSONField(default=dict, blank=True, editable=False)
+    render_version = models.CharField(max_length=16, blank=True, editable=False)
+    # weighted title/body tsvector, filled in by a postgres trigger (see blog/search/postgres.py)
+    search_vector = SearchVectorField(null=True, editable=False)
     publish = models.DateTimeField(default=timezone.now)
     created = models.DateTimeField(auto_now_add = True)
     updated = models.DateTimeField(auto_now=True)
@@ -37,6 +57,14 @@ class Post(models.Model):
         ordering = ['-publish']
         indexes = [
             models.Index(fields=['-publish']),
+            models.Index(fields=['-views']),  # "most viewed" without Redis
+            models.Index(fields=['-active_comment_count']),  # "most commented"
+            # postgres only, created conditionally in migration 0014
+            GinIndex(fields=['search_vector'], name='blog_post_search_gin'),
+            GinIndex(
+                fields=['title'], name='blog_post_title_trgm',
+                opclasses=['gin_trgm_ops'],
+            ),
         ]
          
     users_like = models.ManyToManyField(
@@ -44,6 +72,12 @@ class Post(models.Model):
         related_name='posts_liked',
         blank=True
     )
+    # denormalized users_like count, kept current by blog/likes.py
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    # page views flushed from the counters in blog/viewcounter.py
+    views = models.PositiveIntegerField(default=0, editable=False)
+    # active comments, kept current by blog/comment_counts.py
+    active_comment_count = models.PositiveIntegerField(default=0, editable=False)
     def get_absolute_url(self):
         return reverse(
             "blog:post_detail", 
@@ -58,6 +92,81 @@ class Post(models.Model):
     tags = TaggableManager()
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the body we loaded so save() can tell whether it changed
+        instance._loaded_body = instance.__dict__.get('body')
+        # and its status, so unpublishing can be told apart from draft edits
+        instance._loaded_status = instance.__dict__.get('status')
+        # and what its search suggestions show (see blog/autocomplete.py)
+        instance._loaded_suggestion = instance.suggestion_state()
+        return instance
+
+    def suggestion_state(self):
+        # deferred fields read as None: a save cannot have changed them
+        return tuple(self.__dict__.get(field) for field in SUGGESTION_FIELDS)
+
+    def needs_render(self):
+        if 'body' in self.get_deferred_fields():
+            return False  # body was never loaded, so it cannot have been edited
+        return (
+            self.render_version != RENDER_VERSION
+            or self.body != getattr(self, '_loaded_body', None)
+        )
+
+    def render_body(self):
+        self.body_html = render_markdown(self.body)
+        self.excerpts = render_excerpts(self.body_html)
+        self.render_version = RENDER_VERSION
+        self._loaded_body = self.body
+
+    def save(self, *args, **kwargs):
+        if self.needs_render():
+            self.render_body()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {
+                    *update_fields, 'body_html', 'excerpts', 'render_version'
+                }
+        super().save(*args, **kwargs)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, *args, **kwargs):
+        # the counters move by F() updates (likes, view flushes, comment
+        # moderation); writing back the values loaded earlier would undo the
+        # ones made since, so an ordinary save's UPDATE leaves them out. An
+        # INSERT (a new post, or a row deleted meanwhile) still writes them.
+        if update_fields is None:
+            values = [value for value in values if value[0].attname not in COUNTER_FIELDS]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, *args, **kwargs)
+
+    @property
+    def rendered_body(self):
+        if self.render_version != RENDER_VERSION:
+            # not backfilled yet (see the render_posts command)
+            return mark_safe(render_markdown(self.body))
+        return mark_safe(self.body_html)
+
+    def get_excerpt(self, words=EXCERPT_WORDS):
+        if self.render_version == RENDER_VERSION:
+            stored = self.excerpts.get(str(words))
+            if stored is not None:
+                return mark_safe(stored)
+            # uncommon length: truncate the stored HTML instead of re-parsing markdown
+            return mark_safe(render_excerpt(self.body_html, words))
+        deferred = self.get_deferred_fields()
+        if 'body' not in deferred:
+            return mark_safe(render_excerpt(render_markdown(self.body), words))
+        # listings defer body: rather than a query per post, use an older
+        # rendering until render_posts has backfilled the row
+        if 'excerpts' not in deferred:
+            stored = self.excerpts.get(str(words))
+            if stored is not None:
+                return mark_safe(stored)
+        if 'body_html' not in deferred and self.body_html:
+            return mark_safe(render_excerpt(self.body_html, words))
+        return ''
 #creating a model for comments.
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -83,7 +192,16 @@ class Comment(models.Model):
         ordering = ['created']  # Oldest comments first
         indexes = [
             models.Index(fields=['created']),  # Optimize queries by creation time
+            # a post's active comments, newest first, in cursor batches
+            models.Index(fields=['post', 'active', 'created']),
         ]
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # so moderation can tell which way the active comment count moves
+        instance._loaded_active = instance.__dict__.get('active')
+        return instance
+
     def __str__(self):
         if self.user:
             username = self.user.get_username()
@@ -93,3 +211,105 @@ class Comment(models.Model):
 
     #makemigration
 #next go to admin.py and register the model
+
+
+class SimilarPost(models.Model):
+    # precomputed "similar posts" for the detail page, top-K per post and kind
+    # (tags: blog/similarity.py, content: blog/recommender.py)
+    class Kind(models.TextChoices):
+        TAGS = 'T', 'Shared tags'
+        CONTENT = 'C', 'Similar content'
+
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='similar_entries'
+    )
+    similar = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='recommended_in'  # Post.published.filter(recommended_in__post=post)
+    )
+    kind = models.CharField(max_length=1, choices=Kind, default=Kind.TAGS)
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['-score']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['post', 'kind', 'similar'], name='unique_similar_post'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['post', '-score']),  # one index range per detail page
+        ]
+
+    def __str__(self):
+        return f"{self.similar} is similar to {self.post} ({self.score:.2f})"
+
+
+class PostTrend(models.Model):
+    # "trending" ranking row, one per post, updated on views/likes/comments
+    # (blog/trending.py). score is the time-decayed activity as of scored_at;
+    # rank is log2(score) plus scored_at in half-lives, so ordering by rank
+    # orders by the score decayed to any common moment.
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trend'
+    )
+    score = models.FloatField(default=0)
+    scored_at = models.DateTimeField()
+    rank = models.FloatField(null=True, db_index=True)  # null: nothing left
+
+    def __str__(self):
+        return f"{self.post} trending at {self.score:.1f}"
+
+
+class ViewFlush(models.Model):
+    # a Redis view-count flush already added to Post.views (blog/viewcounter.py)
+    flush_id = models.CharField(max_length=32, unique=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"View flush {self.flush_id}"
+
+
+class Conversation(models.Model):
+    # one chat with the LLM; the session only holds its id (blog/conversations.py)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='llm_conversations'
+    )
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Conversation {self.pk} of {self.user}"
+
+
+class Turn(models.Model):
+    # one prompt and its answer; rows are only ever appended
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='turns'
+    )
+    prompt = models.TextField()
+    response = models.TextField()
+    # markdown rendered once, when the answer arrives
+    response_html = models.TextField()
+    # estimated prompt + response tokens, for context windowing
+    tokens = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created']
+        indexes = [
+            # newest turns first: the context window and history pages
+            models.Index(fields=['conversation', '-created']),
+        ]
+
+    def __str__(self):
+        return f"Turn {self.pk} in conversation {self.conversation_id}"
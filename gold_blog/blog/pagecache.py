@@ -0,0 +1,108 @@
+"""Full-page cache for the public pages that look the same to every visitor.
+
+public_page() wraps home, kiya, the feed and the sitemap. For anonymous GET/
+HEAD requests the view's content, status and headers are stored in the
+shared cache under a key built from the absolute URL (scheme, host, path and
+the query parameters the view reads) and the page version; every hit gets a
+new HttpResponse built from them.
+Every response carries an ETag (the page version) and a Last-Modified (the
+newest Post.updated among published posts), so a browser that already has
+the page gets a bodyless 304.
+
+The version is bumped only when a change is visible to readers: a published
+post created, edited, unpublished or deleted (see blog/signals.py). Draft
+edits leave the cached pages alone.
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.core.cache import cache as shared_cache
+from django.db.models import Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, urlencode
+
+from . import cache
+from .models import Post
+
+NAMESPACE = 'pages'
+PURGED_AT_KEY = 'blog:pages:purged_at'
+# fields whose change shows up on a public page
+VISIBLE_FIELDS = frozenset({'title', 'slug', 'body', 'status', 'publish'})
+
+
+def purge(deleted=False):
+    cache.invalidate(NAMESPACE)
+    if deleted:
+        # the newest post may be gone, so Last-Modified cannot come from the
+        # posts alone any more: remember when the pages last changed
+        shared_cache.set(PURGED_AT_KEY, datetime.now(timezone.utc), timeout=None)
+
+
+def last_modified():
+    def newest():
+        updated = Post.published.aggregate(newest=Max('updated'))['newest']
+        purged_at = shared_cache.get(PURGED_AT_KEY)
+        return max(filter(None, [updated, purged_at]), default=None)
+
+    return cache.cached(cache.versioned_key(NAMESPACE, 'last_modified'), newest)
+
+
+def _cache_key(request, params):
+    # only the query parameters the view reads: anything else would let
+    # made-up ?x= values fill the cache with copies of the same page
+    query = urlencode(sorted(
+        (name, value) for name, value in request.GET.lists() if name in params
+    ), doseq=True)
+    url = hashlib.md5(f'{request.build_absolute_uri(request.path)}?{query}'.encode()).hexdigest()
+    return cache.versioned_key(NAMESPACE, f'response:{url}')
+
+
+def _add_validators(response, etag, modified):
+    response['ETag'] = etag
+    if modified is not None:
+        response['Last-Modified'] = http_date(modified.timestamp())
+    # always revalidate: the conditional request is what makes this cheap
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    return response
+
+
+def public_page(view=None, *, params=()):
+    """Cache ``view`` for anonymous visitors; ``params`` are the query
+    parameters it reads (public_page(sitemap, params=['p']))."""
+    if view is None:
+        return lambda view: public_page(view, params=params)
+    params = frozenset(params)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        etag = f'"{cache.current_version(NAMESPACE)}"'
+        modified = last_modified()
+        not_modified = get_conditional_response(
+            request, etag=etag,
+            last_modified=modified and int(modified.timestamp()),
+        )
+        if not_modified is not None:
+            return not_modified
+
+        key = _cache_key(request, params)
+        stored = cache.get(key)
+        if stored is not None:
+            # a fresh response every time: middleware adds headers to it
+            content, status, headers = stored
+            return HttpResponse(content, status=status, headers=headers)
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()  # sitemap returns a TemplateResponse
+        if response.status_code != 200 or response.cookies or response.streaming:
+            return response
+        _add_validators(response, etag, modified)
+        # only what the view produced, before any middleware saw it
+        cache.set(key, (response.content, response.status_code, dict(response.items())))
+        return response
+
+    return wrapper
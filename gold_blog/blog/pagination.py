@@ -0,0 +1,129 @@
+"""Keyset (cursor) pagination for the post archive and post comments.
+
+Pages are addressed by the (publish, id) of the post at their edge instead of
+an OFFSET, so every page is a range scan on the publish index and no COUNT(*)
+is needed. Tokens are opaque to the client: base64 of direction|publish|id.
+Comment batches and LLM chat history work the same way on (created, id).
+"""
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(obj, direction, field='publish'):
+    raw = f'{direction}|{getattr(obj, field).isoformat()}|{obj.pk}'
+    return urlsafe_base64_encode(raw.encode())
+
+
+def decode_cursor(token):
+    try:
+        direction, publish, pk = force_str(urlsafe_base64_decode(token)).split('|')
+        if direction not in (FORWARD, BACKWARD):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(publish), int(pk)
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor(token) from exc
+
+
+class CursorPage:
+    """Quacks enough like a Paginator page for the list template."""
+
+    def __init__(self, object_list, has_next, has_previous, field='publish'):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.field = field
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            return encode_cursor(self.object_list[-1], FORWARD, self.field)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous():
+            return encode_cursor(self.object_list[0], BACKWARD, self.field)
+        return None
+
+
+def paginate_by_cursor(queryset, token, per_page):
+    """Return the CursorPage of ``queryset`` (newest first) addressed by ``token``.
+
+    A missing or malformed token yields the first page.
+    """
+    try:
+        direction, publish, pk = decode_cursor(token) if token else (None, None, None)
+    except InvalidCursor:
+        direction = None
+
+    if direction == BACKWARD:
+        # walk towards newer posts, then flip back to newest-first order
+        rows = list(
+            queryset
+            .filter(Q(publish__gt=publish) | Q(publish=publish, pk__gt=pk))
+            .order_by('publish', 'pk')[:per_page + 1]
+        )
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        return CursorPage(rows, has_next=True, has_previous=has_previous)
+
+    queryset = queryset.order_by('-publish', '-pk')
+    if direction == FORWARD:
+        queryset = queryset.filter(
+            Q(publish__lt=publish) | Q(publish=publish, pk__lt=pk)
+        )
+    rows = list(queryset[:per_page + 1])
+    return CursorPage(
+        rows[:per_page],
+        has_next=len(rows) > per_page,
+        has_previous=direction == FORWARD,
+    )
+
+
+def paginate_newest(queryset, token, per_page):
+    """Next batch of ``queryset`` (newest first) after the ``token`` row.
+
+    For any model with a ``created`` timestamp. Forward only: the page keeps
+    what it already shows. Backed by the (post, active, created) index for
+    comments and by (conversation, created) for chat turns.
+    """
+    try:
+        direction, created, pk = decode_cursor(token) if token else (None, None, None)
+    except InvalidCursor:
+        direction = None
+
+    queryset = queryset.order_by('-created', '-pk')
+    if direction == FORWARD:
+        queryset = queryset.filter(
+            Q(created__lt=created) | Q(created=created, pk__lt=pk)
+        )
+    rows = list(queryset[:per_page + 1])
+    return CursorPage(
+        rows[:per_page],
+        has_next=len(rows) > per_page,
+        has_previous=False,
+        field='created',
+    )
@@ -0,0 +1,356 @@
+"""Content-based related posts: TF-IDF vectors over post text.
+
+Tag overlap has nothing to say about posts with one tag or none, so the
+detail page falls back to these neighbours (SimilarPost.Kind.CONTENT).
+
+build_recommendations() vectorizes every published post into a sparse,
+L2-normalized TF-IDF matrix, finds each row's top-K cosine neighbours with
+batched sparse matrix products and stores them. The matrix, vocabulary and
+idf weights are saved to BLOG_RECOMMENDER_PATH so update_post() can re-score
+a single edited post against the existing matrix without a rebuild. The
+vocabulary and idf stay frozen between rebuilds: words first seen in an edit
+are ignored until the next build_recommendations run.
+
+Saves and deletes queue that re-scoring as a job (schedule_update(), run by
+the run_jobs worker) rather than rewriting the matrix file in the request,
+and every writer holds a lock in the shared cache while it loads, changes
+and saves the file, so concurrent edits cannot drop each other's rows.
+"""
+import math
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min
+from scipy import sparse
+
+from jobs.queue import enqueue
+
+from .models import Post, SimilarPost
+
+TOP_K = 8
+LOCK_KEY = 'blog:recommender:lock'
+BATCH_SIZE = 256
+# a term found in more than this share of posts says nothing about any of them
+MAX_DF = 0.5
+# only a post's most distinctive terms are kept: the weak tail barely moves
+# cosine scores but makes every matrix product far denser (~20x slower)
+MAX_TERMS_PER_POST = 40
+TOKEN_RE = re.compile(r"[a-z][a-z0-9+#]+")
+STOP_WORDS = frozenset("""
+    about after again also and any are because been before being between both
+    but can could did does doing down during each few for from further had has
+    have having her here hers him his how into its itself just more most not now
+    off once only other our ours out over own same she should some such than
+    that the their theirs them then there these they this those through too
+    under until very was were what when where which while who whom why will
+    with would you your yours
+""".split())
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOP_WORDS]
+
+
+def post_text(post):
+    return f"{post.title}\n{post.body}"
+
+
+def _normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms).dot(matrix).tocsr().astype(np.float32)
+
+
+def _keep_top_terms(matrix, n):
+    matrix = matrix.tocsr()
+    data, indices, indptr = [], [], [0]
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        values, cols = matrix.data[start:end], matrix.indices[start:end]
+        if len(values) > n:
+            best = np.argpartition(-values, n - 1)[:n]
+            values, cols = values[best], cols[best]
+        data.append(values)
+        indices.append(cols)
+        indptr.append(indptr[-1] + len(values))
+    if not data:
+        return matrix
+    return sparse.csr_matrix(
+        (np.concatenate(data), np.concatenate(indices), indptr), shape=matrix.shape
+    )
+
+
+def _top_k(scores, k):
+    """Best ``k`` (column, score) pairs of every row of a sparse CSR matrix."""
+    # the products are sparse: only posts sharing a kept term score above
+    # zero, so ranking the stored entries beats ranking a dense row
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        values, cols = scores.data[start:end], scores.indices[start:end]
+        if len(values) > k:
+            best = np.argpartition(-values, k - 1)[:k]
+            values, cols = values[best], cols[best]
+        order = np.argsort(-values, kind='stable')
+        yield cols[order], values[order]
+
+
+class TfidfIndex:
+    def __init__(self, post_ids, terms, idf, matrix):
+        self.post_ids = np.asarray(post_ids, dtype=np.int64)
+        self.terms = list(terms)
+        self.vocabulary = {term: col for col, term in enumerate(self.terms)}
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.matrix = matrix.tocsr()
+
+    @classmethod
+    def build(cls, documents):
+        """``documents`` is an iterable of (post_id, text)."""
+        vocabulary, post_ids, rows, cols = {}, [], [], []
+        for row, (post_id, text) in enumerate(documents):
+            post_ids.append(post_id)
+            ids = [vocabulary.setdefault(term, len(vocabulary)) for term in tokenize(text)]
+            cols.append(np.asarray(ids, dtype=np.int32))
+            rows.append(np.full(len(ids), row, dtype=np.int32))
+        n_docs = len(post_ids)
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+        cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int32)
+        counts = sparse.csr_matrix(
+            (np.ones(len(cols), dtype=np.float32), (rows, cols)),
+            shape=(n_docs, len(vocabulary)),
+        )
+        counts.sum_duplicates()
+
+        df = np.bincount(counts.indices, minlength=len(vocabulary))
+        keep = np.flatnonzero((df > 0) & (df <= max(MAX_DF * n_docs, 2)))
+        counts = counts[:, keep]
+        by_column = sorted(vocabulary, key=vocabulary.get)
+        terms = [by_column[col] for col in keep]
+        idf = np.log((1 + n_docs) / (1 + df[keep])) + 1
+
+        return cls(post_ids, terms, idf, cls._weigh(counts, idf))
+
+    @staticmethod
+    def _weigh(counts, idf):
+        counts = counts.tocsr().astype(np.float32)
+        counts.data = 1 + np.log(counts.data)  # sublinear tf
+        weighted = counts.dot(sparse.diags(idf.astype(np.float32)))
+        return _normalize_rows(_keep_top_terms(weighted, MAX_TERMS_PER_POST))
+
+    def vectorize(self, text):
+        cols = [self.vocabulary[t] for t in tokenize(text) if t in self.vocabulary]
+        counts = sparse.csr_matrix(
+            (np.ones(len(cols), dtype=np.float32), (np.zeros(len(cols), dtype=int), cols)),
+            shape=(1, len(self.terms)),
+        )
+        counts.sum_duplicates()
+        return self._weigh(counts, self.idf)
+
+    def row_of(self, post_id):
+        found = np.flatnonzero(self.post_ids == post_id)
+        return int(found[0]) if len(found) else None
+
+    def upsert(self, post_id, vector):
+        row = self.row_of(post_id)
+        if row is None:
+            self.matrix = sparse.vstack([self.matrix, vector]).tocsr()
+            self.post_ids = np.append(self.post_ids, post_id)
+            return len(self.post_ids) - 1
+        self.matrix = sparse.vstack(
+            [self.matrix[:row], vector, self.matrix[row + 1:]]
+        ).tocsr()
+        return row
+
+    def remove(self, post_id):
+        row = self.row_of(post_id)
+        if row is not None:
+            keep = np.arange(len(self.post_ids)) != row
+            self.matrix = self.matrix[keep]
+            self.post_ids = self.post_ids[keep]
+
+    def neighbours(self, rows=None, k=TOP_K, batch_size=BATCH_SIZE):
+        """Yield (post_id, [(score, other_post_id), ...]) for ``rows`` (default: all)."""
+        rows = np.arange(len(self.post_ids)) if rows is None else np.asarray(rows)
+        transposed = self.matrix.T.tocsc()
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            scores = (self.matrix[batch] @ transposed).tocsr()
+            # never your own neighbour: k + 1 candidates, then drop self
+            for row, (cols, vals) in zip(batch, _top_k(scores, k + 1)):
+                yield int(self.post_ids[row]), [
+                    (float(score), int(self.post_ids[col]))
+                    for col, score in zip(cols, vals)
+                    if col != row and score > 0
+                ][:k]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename so readers never see a half-written file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npz')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(
+                f,
+                post_ids=self.post_ids, terms=np.array(self.terms, dtype=str),
+                idf=self.idf, data=self.matrix.data, indices=self.matrix.indices,
+                indptr=self.matrix.indptr, shape=np.array(self.matrix.shape),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as f:
+            matrix = sparse.csr_matrix(
+                (f['data'], f['indices'], f['indptr']), shape=tuple(f['shape'])
+            )
+            return cls(f['post_ids'], f['terms'].tolist(), f['idf'], matrix)
+
+
+def index_path():
+    return settings.BLOG_RECOMMENDER_PATH
+
+
+def _store(rows_by_post, replace_all=False):
+    content_rows = SimilarPost.objects.filter(kind=SimilarPost.Kind.CONTENT)
+    with transaction.atomic():
+        if replace_all:
+            content_rows.delete()
+        else:
+            content_rows.filter(post_id__in=rows_by_post.keys()).delete()
+        SimilarPost.objects.bulk_create(
+            [
+                SimilarPost(
+                    post_id=post_id, similar_id=other, score=score,
+                    kind=SimilarPost.Kind.CONTENT,
+                )
+                for post_id, rows in rows_by_post.items()
+                for score, other in rows
+            ],
+            batch_size=1000,
+        )
+
+
+def build_recommendations():
+    posts = Post.published.only('id', 'title', 'body').order_by('id')
+    index = TfidfIndex.build((post.pk, post_text(post)) for post in posts.iterator())
+    with _writing():
+        _store(dict(index.neighbours()), replace_all=True)
+        index.save(index_path())
+    return index
+
+
+@contextmanager
+def _writing(wait=30):
+    # one writer at a time across processes, or two edits each save a
+    # matrix without the other's row
+    deadline = time.monotonic() + wait
+    while not cache.add(LOCK_KEY, 1, 300):
+        if time.monotonic() > deadline:
+            raise TimeoutError('another process is writing the recommender index')
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def schedule_update(post_id):
+    """Queue refresh_post() for the run_jobs worker, once the index exists.
+
+    Re-scoring loads and rewrites the whole matrix, too slow for the request
+    that saved the post. The job is part of the caller's transaction.
+    """
+    if os.path.exists(index_path()):
+        enqueue('blog.refresh_recommendations', {'post_id': post_id})
+
+
+def refresh_post(post_id):
+    """Bring one post's row and neighbours up to date with the database."""
+    post = Post.objects.only('id', 'title', 'body', 'status').filter(pk=post_id).first()
+    if post is None:
+        remove_post(post_id)
+    else:
+        update_post(post)
+
+
+def update_post(post):
+    """Re-score one saved post against the stored matrix."""
+    with _writing():
+        index = TfidfIndex.load(index_path())
+        if index is None:
+            return  # never built; build_recommendations will pick the post up
+        if post.status != Post.Status.PUBLISHED:
+            _remove(index, post.pk)
+            return
+        _update(index, post)
+
+
+def _update(index, post):
+    row = index.upsert(post.pk, index.vectorize(post_text(post)))
+    scores = (index.matrix @ index.matrix[row].T).toarray().ravel()
+    scores[row] = -1.0
+    # other posts whose lists could change: anyone who listed this post, and
+    # anyone it now scores better with than their current weakest neighbour
+    candidate_rows = np.flatnonzero(scores > 0)
+    candidate_ids = [int(post_id) for post_id in index.post_ids[candidate_rows]]
+    content_rows = SimilarPost.objects.filter(kind=SimilarPost.Kind.CONTENT)
+    weakest = {
+        post_id: (count, low)
+        for post_id, count, low in content_rows
+        .filter(post_id__in=candidate_ids)
+        .values_list('post_id')
+        .annotate(count=Count('id'), low=Min('score'))
+    }
+    affected = {row}
+    for other_row, other_id in zip(candidate_rows, candidate_ids):
+        count, low = weakest.get(other_id, (0, -math.inf))
+        if count < TOP_K or scores[other_row] > low:
+            affected.add(int(other_row))
+    listed_by = content_rows.filter(similar_id=post.pk).values_list('post_id', flat=True)
+    for other_id in listed_by:
+        other_row = index.row_of(other_id)
+        if other_row is not None:
+            affected.add(other_row)
+
+    _store(dict(index.neighbours(sorted(affected))))
+    index.save(index_path())
+
+
+def remove_post(post_id):
+    with _writing():
+        index = TfidfIndex.load(index_path())
+        if index is not None:
+            _remove(index, post_id)
+
+
+def _remove(index, post_id):
+    row = index.row_of(post_id)
+    if row is None:
+        return
+    # only posts scoring above zero with it can have listed it; a deleted
+    # post's SimilarPost rows are gone already, so ask the matrix, not them
+    scores = (index.matrix @ index.matrix[row].T).toarray().ravel()
+    scores[row] = 0.0
+    candidate_ids = [int(other) for other in index.post_ids[np.flatnonzero(scores > 0)]]
+    content_rows = SimilarPost.objects.filter(kind=SimilarPost.Kind.CONTENT)
+    full = set(
+        content_rows.filter(post_id__in=candidate_ids)
+        .exclude(similar_id=post_id)
+        .values_list('post_id')
+        .annotate(count=Count('id'))
+        .filter(count__gte=TOP_K)
+        .values_list('post_id', flat=True)
+    )
+    index.remove(post_id)
+    content_rows.filter(post_id=post_id).delete()
+    # the rest lost it from their lists (or are short anyway): score them again
+    affected = sorted(index.row_of(other) for other in candidate_ids if other not in full)
+    _store(dict(index.neighbours(affected)))
+    index.save(index_path())
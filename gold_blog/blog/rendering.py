@@ -0,0 +1,37 @@
+import hashlib
+
+import markdown
+from django.template.defaultfilters import truncatewords_html
+
+# every place that turns a post body into HTML goes through here so the
+# stored copy on Post and the template filter can never disagree.
+MARKDOWN_EXTENSIONS = ["tables"]
+# word counts we store excerpts for; listing pages use 30, search uses 12
+EXCERPT_LENGTHS = (12, 30)
+EXCERPT_WORDS = 30
+
+
+def _render_signature():
+    # changes whenever the extension set, the excerpt lengths or the Markdown
+    # package is upgraded, which marks every stored rendering as stale.
+    raw = (
+        f"{markdown.__version__}:{','.join(sorted(MARKDOWN_EXTENSIONS))}"
+        f":{','.join(map(str, EXCERPT_LENGTHS))}"
+    )
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+RENDER_VERSION = _render_signature()
+
+
+def render_markdown(text):
+    return markdown.markdown(text or "", extensions=MARKDOWN_EXTENSIONS)
+
+
+def render_excerpt(html, words=EXCERPT_WORDS):
+    return truncatewords_html(html, words)
+
+
+def render_excerpts(html):
+    # JSON object keys are strings, so store them that way from the start
+    return {str(words): render_excerpt(html, words) for words in EXCERPT_LENGTHS}
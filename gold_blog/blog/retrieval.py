@@ -0,0 +1,333 @@
+"""Retrieval for the chat: passages of our own posts that match a prompt.
+
+Published post bodies are cut into overlapping word windows (chunks) and
+each chunk, prefixed with its post title, is embedded by a hashing
+vectorizer: unigrams and bigrams hashed into DIM signed buckets, sublinear
+weights, L2-normalized. There is no vocabulary and nothing to download, so
+one edited post can be embedded on save without touching the others.
+
+The index lives in BLOG_RETRIEVAL_PATH:
+
+* vectors-<id>.f32, the chunk vectors as raw float32 rows, read through
+  np.memmap so a worker only pages in what a search touches;
+* rows.npz, the (post id, chunk number) of every row and the name of the
+  vector file. It is replaced atomically and is the only thing readers
+  trust, so a half-appended vector file is never seen.
+
+Edits are append-only: the post's old rows are marked dead (post id -1) and
+its new chunks appended. build_retrieval_index rewrites everything compactly.
+Saves and deletes queue that work as a job (schedule_update(), run by the
+run_jobs worker), like the recommender's, rather than embedding and waiting
+for the writer lock in the request.
+
+Search is brute force, one matrix-vector product over the memmap, up to
+BLOG_RETRIEVAL_ANN_MIN_CHUNKS chunks. Bigger indexes also get a coarse
+k-means quantizer (IVF): every chunk belongs to its nearest centroid and a
+query scores only the chunks of the nearest PROBE_SHARE of centroids. Hashed
+bag-of-words vectors cluster poorly, so this trades a lot of recall for
+speed (see bench_retrieval): brute force stays under ~20ms up to 100k
+chunks, which is why the default threshold is high.
+"""
+import math
+import os
+import tempfile
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from scipy.cluster.vq import kmeans2
+
+from jobs.queue import enqueue
+
+from .models import Post
+from .recommender import tokenize
+
+DIM = 512
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 30
+NPROBE = 8  # at least this many centroids are probed
+PROBE_SHARE = 0.1
+MIN_SCORE = 0.1  # below this a chunk shares little more than common words
+ROWS_FILE = 'rows.npz'
+LOCK_KEY = 'blog:retrieval:lock'
+BATCH_SIZE = 4096
+
+
+def chunk_words(text):
+    """Overlapping windows of CHUNK_WORDS words; a short text is one chunk."""
+    words = text.split()
+    if not words:
+        return []
+    step = CHUNK_WORDS - CHUNK_OVERLAP
+    return [
+        ' '.join(words[start:start + CHUNK_WORDS])
+        for start in range(0, max(len(words) - CHUNK_OVERLAP, 1), step)
+    ]
+
+
+def post_chunks(post):
+    """(chunk number, text to embed) for every chunk of ``post``."""
+    return [(n, f'{post.title}\n{chunk}') for n, chunk in enumerate(chunk_words(post.body))]
+
+
+def _features(text):
+    tokens = tokenize(text)
+    return tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+
+
+def embed(texts):
+    """L2-normalized (len(texts), DIM) float32 hashing-trick vectors."""
+    rows, hashes = [], []
+    for row, text in enumerate(texts):
+        # crc32, not hash(): str hashes change with every process
+        found = [zlib.crc32(feature.encode()) for feature in _features(text)]
+        hashes.extend(found)
+        rows.extend([row] * len(found))
+    hashes = np.asarray(hashes, dtype=np.uint32)
+    signs = np.where(hashes & 0x80000000, 1.0, -1.0)  # collisions cancel out
+    slots = np.asarray(rows, dtype=np.int64) * DIM + hashes % DIM
+    vectors = np.bincount(slots, weights=signs, minlength=len(texts) * DIM)
+    vectors = vectors.reshape(len(texts), DIM)
+    vectors = np.sign(vectors) * np.log1p(np.abs(vectors))  # sublinear tf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class ChunkIndex:
+    def __init__(self, path, rows, vector_file, centroids=None, lists=None):
+        self.path = path
+        self.rows = rows  # (n, 2) int64: post id (-1 once replaced), chunk number
+        self.vector_file = vector_file
+        self.centroids = centroids  # (nlist, DIM), only for big indexes
+        self.lists = lists  # nearest centroid of every row
+        if len(rows):
+            self.vectors = np.memmap(
+                os.path.join(path, vector_file), dtype=np.float32, mode='r',
+                shape=(len(rows), DIM),
+            )
+        else:
+            self.vectors = np.empty((0, DIM), dtype=np.float32)
+
+    def search(self, query, k):
+        """Best ``k`` live (row, score) pairs for one embedded ``query``."""
+        live = self.rows[:, 0] >= 0
+        if self.centroids is not None:
+            nprobe = max(NPROBE, math.ceil(len(self.centroids) * PROBE_SHARE))
+            probe = np.argsort(-(self.centroids @ query))[:nprobe]
+            candidates = np.flatnonzero(np.isin(self.lists, probe) & live)
+            scores = self.vectors[candidates] @ query
+        else:
+            candidates = None
+            scores = np.asarray(self.vectors @ query)
+            scores[~live] = -np.inf
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        rows = best if candidates is None else candidates[best]
+        return [(int(row), float(scores[i])) for row, i in zip(rows, best)]
+
+    def nearest_lists(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+
+def index_path():
+    return settings.BLOG_RETRIEVAL_PATH
+
+
+def _write_rows(path, rows, vector_file, centroids=None, lists=None):
+    # write then rename so readers never see a half-written file
+    fd, tmp = tempfile.mkstemp(dir=path, suffix='.npz')
+    with os.fdopen(fd, 'wb') as f:
+        arrays = {'rows': rows, 'vector_file': np.array(vector_file)}
+        if centroids is not None:
+            arrays.update(centroids=centroids, lists=lists)
+        np.savez(f, **arrays)
+    os.replace(tmp, os.path.join(path, ROWS_FILE))
+
+
+_loaded = {}
+
+
+def load(path=None):
+    """The index at ``path``, re-read only when rows.npz has changed."""
+    path = path or index_path()
+    rows_path = os.path.join(path, ROWS_FILE)
+    try:
+        stamp = os.stat(rows_path).st_mtime_ns
+    except FileNotFoundError:
+        return None  # never built
+    cached = _loaded.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with np.load(rows_path) as f:
+        index = ChunkIndex(
+            path, f['rows'], str(f['vector_file']),
+            f['centroids'] if 'centroids' in f else None,
+            f['lists'] if 'lists' in f else None,
+        )
+    _loaded[path] = (stamp, index)
+    return index
+
+
+@contextmanager
+def _writing(wait=10):
+    # one writer at a time across processes: post saves and the build command
+    deadline = time.monotonic() + wait
+    while not cache.add(LOCK_KEY, 1, 300):
+        if time.monotonic() > deadline:
+            raise TimeoutError('another process is writing the retrieval index')
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def build_index(chunks, path=None, ann_min_chunks=None):
+    """Write a fresh index of ``chunks``: (post id, chunk number, text) triples."""
+    path = path or index_path()
+    if ann_min_chunks is None:
+        ann_min_chunks = settings.BLOG_RETRIEVAL_ANN_MIN_CHUNKS
+    os.makedirs(path, exist_ok=True)
+    vector_file = f'vectors-{uuid.uuid4().hex}.f32'
+    rows = []
+    with open(os.path.join(path, vector_file), 'wb') as f:
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == BATCH_SIZE:
+                f.write(embed([text for _, _, text in batch]).tobytes())
+                rows.extend((post_id, n) for post_id, n, _ in batch)
+                batch = []
+        if batch:
+            f.write(embed([text for _, _, text in batch]).tobytes())
+            rows.extend((post_id, n) for post_id, n, _ in batch)
+    rows = np.asarray(rows, dtype=np.int64).reshape(-1, 2)
+
+    centroids = lists = None
+    if len(rows) >= max(ann_min_chunks, NPROBE):
+        index = ChunkIndex(path, rows, vector_file)
+        centroids, lists = _train_lists(index.vectors)
+    with _writing():
+        old = load(path)
+        _write_rows(path, rows, vector_file, centroids, lists)
+    if old is not None and old.vector_file != vector_file:
+        # processes still holding the old memmap keep reading it until they reload
+        os.remove(os.path.join(path, old.vector_file))
+    return load(path)
+
+
+def _train_lists(vectors, sample_size=20_000, seed=0):
+    nlist = max(int(np.sqrt(len(vectors))), NPROBE)
+    rng = np.random.default_rng(seed)
+    sample = vectors[np.sort(rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False))]
+    centroids, _ = kmeans2(np.asarray(sample), nlist, minit='++', rng=seed)
+    norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    centroids = (centroids / norms).astype(np.float32)
+    lists = np.concatenate([
+        np.argmax(vectors[start:start + BATCH_SIZE] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), BATCH_SIZE)
+    ]).astype(np.int32)
+    return centroids, lists
+
+
+def build():
+    posts = Post.published.only('id', 'title', 'body').order_by('id')
+    return build_index(
+        (post.pk, n, text) for post in posts.iterator() for n, text in post_chunks(post)
+    )
+
+
+def _replace_post(index, post_id, chunks):
+    current = index.rows[:, 0] == post_id
+    if not chunks and not current.any():
+        return
+    rows = index.rows.copy()
+    rows[current, 0] = -1
+    lists = index.lists
+    if chunks:
+        vectors = embed([text for _, text in chunks])
+        with open(os.path.join(index.path, index.vector_file), 'ab') as f:
+            # past the rows readers know about, so invisible until rows.npz changes
+            f.truncate(len(index.rows) * DIM * 4)
+            f.write(vectors.tobytes())
+        rows = np.vstack([rows, [(post_id, n) for n, _ in chunks]])
+        if index.centroids is not None:
+            lists = np.concatenate([lists, index.nearest_lists(vectors)])
+    _write_rows(index.path, rows, index.vector_file, index.centroids, lists)
+
+
+def schedule_update(post, deleted=False):
+    """Queue refresh_post() for the run_jobs worker, once the index exists.
+
+    Keyed on the post id and ``updated``, so saving the same version of a
+    post twice queues one job. The job is part of the caller's transaction.
+    """
+    if not os.path.exists(os.path.join(index_path(), ROWS_FILE)):
+        return
+    version = 'deleted' if deleted else post.updated.isoformat()
+    enqueue(
+        'blog.refresh_retrieval', {'post_id': post.pk},
+        key=f'blog.retrieval:{post.pk}:{version}',
+    )
+
+
+def refresh_post(post_id):
+    """Bring one post's chunks up to date with the database."""
+    post = Post.objects.only('id', 'title', 'body', 'status').filter(pk=post_id).first()
+    if post is None:
+        remove_post(post_id)
+    else:
+        update_post(post)
+
+
+def update_post(post):
+    """Re-embed one saved post (drop it if it is no longer published)."""
+    if load() is None:
+        return  # never built; build_retrieval_index will pick the post up
+    chunks = post_chunks(post) if post.status == Post.Status.PUBLISHED else []
+    with _writing():
+        _replace_post(load(), post.pk, chunks)
+
+
+def remove_post(post_id):
+    if load() is None:
+        return
+    with _writing():
+        _replace_post(load(), post_id, [])
+
+
+def passages(prompt, k=None):
+    """The chunks of published posts that best match ``prompt``, best first."""
+    k = settings.LLM_RETRIEVAL_CHUNKS if k is None else k
+    index = load() if k > 0 else None
+    if index is None or not len(index.rows):
+        return []
+    hits = [
+        (row, score) for row, score in index.search(embed([prompt])[0], k)
+        if score >= MIN_SCORE
+    ]
+    post_ids = {int(index.rows[row, 0]) for row, _ in hits}
+    posts = Post.published.only('id', 'title', 'slug', 'publish', 'body').in_bulk(post_ids)
+    found = []
+    for row, score in hits:
+        post_id, n = (int(value) for value in index.rows[row])
+        post = posts.get(post_id)
+        chunks = chunk_words(post.body) if post is not None else []
+        if n < len(chunks):
+            found.append({
+                'post_id': post_id,
+                'title': post.title,
+                'url': post.get_absolute_url(),
+                'text': chunks[n],
+                'score': score,
+            })
+    return found
@@ -0,0 +1,28 @@
+"""Pluggable post search.
+
+``BLOG_SEARCH_BACKEND`` may name a SearchBackend subclass by dotted path;
+left empty, the backend follows the database in use.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+BACKENDS = {
+    'postgresql': 'blog.search.postgres.PostgresSearchBackend',
+    'sqlite': 'blog.search.sqlite.SQLiteSearchBackend',
+}
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    path = getattr(settings, 'BLOG_SEARCH_BACKEND', '') or BACKENDS[connection.vendor]
+    return import_string(path)()
+
+
+def search_posts(query, queryset=None):
+    if queryset is None:
+        from ..models import Post
+        queryset = Post.published.all()
+    return get_backend().search(query, queryset)
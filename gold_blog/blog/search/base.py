@@ -0,0 +1,34 @@
+from django.db.models import Case, IntegerField, When
+
+
+class SearchBackend:
+    """Interface every post search backend implements.
+
+    ``search`` narrows a Post queryset (usually ``Post.published``) down to the
+    matches for ``query``, best match first. Backends that keep their own
+    index outside the post table are told about changes through
+    ``index_post``/``remove_post`` (wired up in blog/signals.py).
+    """
+
+    def search(self, query, queryset):
+        raise NotImplementedError
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+def filter_in_order(queryset, ids):
+    """Restrict ``queryset`` to ``ids``, keeping the order of ``ids``."""
+    if not ids:
+        return queryset.none()
+    position = Case(
+        *[When(pk=pk, then=index) for index, pk in enumerate(ids)],
+        output_field=IntegerField(),
+    )
+    return queryset.filter(pk__in=ids).order_by(position)
@@ -0,0 +1,32 @@
+"""Post search on PostgreSQL.
+
+Post.search_vector is a stored tsvector (title weighted A, body weighted B)
+maintained by a database trigger, see migration 0014. Both it and the title
+have GIN indexes, so a search is two index scans OR-ed together instead of a
+sequential scan over every post.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, Q
+
+from .base import SearchBackend
+
+SEARCH_CONFIG = 'english'
+
+
+class PostgresSearchBackend(SearchBackend):
+    # the trigger keeps search_vector current, so nothing to do on save
+
+    def search(self, query, queryset):
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        return (
+            queryset
+            # `search_vector @@ query` hits the tsvector GIN index, `title % query`
+            # hits the trigram GIN index and keeps typos in titles findable
+            .filter(Q(search_vector=search_query) | Q(title__trigram_similar=query))
+            .annotate(
+                rank=SearchRank(F('search_vector'), search_query),
+                similarity=TrigramSimilarity('title', query),
+            )
+            .annotate(score=F('rank') + F('similarity'))
+            .order_by('-score', '-publish')
+        )
@@ -0,0 +1,103 @@
+"""Post search on SQLite, backed by an FTS5 inverted index.
+
+blog_post_fts holds a tokenized copy of every published post's title and
+body keyed by post id (created in migration 0015). Drafts stay out of it, so
+the max_results best matches are all posts a reader may see. It is updated
+from Post saves/deletes rather than SQL triggers because Django rebuilds
+SQLite tables on many ALTERs, which would silently drop any trigger attached
+to blog_post.
+
+Ranking is FTS5's BM25 with titles weighted over bodies. When no post
+matches every term, misspelled terms are swapped for the closest indexed
+term by bigram overlap and the search is retried matching any term.
+"""
+import re
+
+from django.db import connection
+
+from ..models import Post
+from .base import SearchBackend, filter_in_order
+
+FTS_TABLE = 'blog_post_fts'
+VOCAB_TABLE = 'blog_post_fts_vocab'
+TOKEN_RE = re.compile(r'\w+')
+
+
+def ngrams(word, n):
+    padded = f' {word} '
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def ngram_similarity(a, b, n=2):
+    # bigrams rather than trigrams: short words with a swapped pair of letters
+    # ("djnago") still share enough of them with the intended term
+    left, right = ngrams(a, n), ngrams(b, n)
+    return len(left & right) / len(left | right)
+
+
+class SQLiteSearchBackend(SearchBackend):
+    title_weight = 10.0
+    body_weight = 1.0
+    max_results = 50
+    fuzzy_threshold = 0.35
+
+    def search(self, query, queryset):
+        terms = [term.lower() for term in TOKEN_RE.findall(query)]
+        if not terms:
+            return queryset.none()
+        ids = self._match(terms)
+        if not ids:
+            corrected = [self._closest_term(term) for term in terms]
+            corrected = [term for term in corrected if term]
+            if corrected:
+                ids = self._match(corrected, any_term=True)
+        return filter_in_order(queryset, ids)
+
+    def index_post(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+            if post.status == Post.Status.PUBLISHED:
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE} (rowid, title, body) VALUES (%s, %s, %s)',
+                    [post.pk, post.title, post.body],
+                )
+
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, body) '
+                'SELECT id, title, body FROM blog_post WHERE status = %s',
+                [Post.Status.PUBLISHED],
+            )
+
+    def _match(self, terms, any_term=False):
+        # every term is a quoted prefix query: "djan"* matches django, djangos...
+        expression = (' OR ' if any_term else ' ').join(f'"{t}"*' for t in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, %s, %s) LIMIT %s',
+                [expression, self.title_weight, self.body_weight, self.max_results],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _closest_term(self, term):
+        # only compare against indexed terms sharing the first character,
+        # which is a range scan on the vocabulary instead of a full walk
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT term FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s',
+                [term[0], chr(ord(term[0]) + 1)],
+            )
+            candidates = [row[0] for row in cursor.fetchall()]
+        best, best_score = None, self.fuzzy_threshold
+        for candidate in candidates:
+            score = ngram_similarity(term, candidate)
+            if score > best_score:
+                best, best_score = candidate, score
+        return best
@@ -0,0 +1,200 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from taggit.models import Tag
+
+from . import (
+    autocomplete, cache, comment_counts, likes, pagecache, recommender, retrieval,
+    similarity, trending, viewcounter,
+)
+from .models import SUGGESTION_FIELDS, Comment, Post
+from .search import get_backend
+
+SEARCHED_FIELDS = {'title', 'body', 'status'}  # only published posts are indexed
+
+
+@receiver(post_save, sender=Post)
+def index_post_for_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCHED_FIELDS & set(update_fields):
+        return
+    get_backend().index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_from_search(sender, instance, **kwargs):
+    get_backend().remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def suggest_post_on_save(sender, instance, created, update_fields=None, **kwargs):
+    # counter saves (views, likes, comments) leave the suggestions alone
+    if update_fields is not None and not set(SUGGESTION_FIELDS) & set(update_fields):
+        return
+    loaded = getattr(instance, '_loaded_suggestion', None)
+    instance._loaded_suggestion = instance.suggestion_state()
+    if not created and loaded == instance._loaded_suggestion:
+        return
+    was_published = loaded is not None and loaded[-1] == Post.Status.PUBLISHED
+    if not was_published and instance.status != Post.Status.PUBLISHED:
+        return  # a draft was and is invisible
+    tags = []
+    if not created and was_published != (instance.status == Post.Status.PUBLISHED):
+        # its tags may have gained or lost their only published post
+        tags = list(instance.tags.values_list('id', flat=True))
+    autocomplete.record(posts=[instance.pk], tags=tags)
+
+
+@receiver(pre_delete, sender=Post)
+def remember_suggested_tags(sender, instance, **kwargs):
+    if instance.status == Post.Status.PUBLISHED:
+        instance._suggested_tags = list(instance.tags.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def drop_post_suggestions(sender, instance, **kwargs):
+    if instance.status == Post.Status.PUBLISHED:
+        autocomplete.record(posts=[instance.pk], tags=getattr(instance, '_suggested_tags', ()))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def suggest_tag(sender, instance, **kwargs):
+    autocomplete.record(tags=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def suggest_post_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        autocomplete.record(tags=[instance.pk])
+    elif action == 'post_clear':
+        # the cleared tag ids are not passed along
+        transaction.on_commit(autocomplete.invalidate)
+    elif instance.status == Post.Status.PUBLISHED:
+        autocomplete.record(tags=pk_set)
+
+
+@receiver(post_save, sender=Post)
+def refresh_similar_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    similarity.update_similar_posts(instance)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def refresh_similar_on_tags(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        similarity.update_similar_posts(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def remember_similar_listings(sender, instance, **kwargs):
+    # the cascade removes the rows we would need to find these afterwards
+    instance._listed_by = similarity.posts_listing(instance)
+
+
+@receiver(post_delete, sender=Post)
+def refresh_similar_on_delete(sender, instance, **kwargs):
+    similarity.refresh_similar_posts(getattr(instance, '_listed_by', ()))
+
+
+@receiver(post_save, sender=Post)
+def refresh_recommendations_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'title', 'body', 'status'} & set(update_fields):
+        return
+    recommender.schedule_update(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def drop_recommendations_on_delete(sender, instance, **kwargs):
+    recommender.schedule_update(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def reindex_chunks_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'title', 'body', 'status'} & set(update_fields):
+        return
+    retrieval.schedule_update(instance)
+
+
+@receiver(post_delete, sender=Post)
+def drop_chunks_on_delete(sender, instance, **kwargs):
+    retrieval.schedule_update(instance, deleted=True)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_sidebar(sender, **kwargs):
+    cache.invalidate()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_similar_posts(sender, **kwargs):
+    # runs after the similarity/recommender receivers above have stored rows
+    cache.invalidate('similar')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    cache.invalidate('tags')
+
+
+@receiver(post_save, sender=Post)
+def purge_public_pages_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not pagecache.VISIBLE_FIELDS & set(update_fields):
+        return
+    was_published = getattr(instance, '_loaded_status', None) == Post.Status.PUBLISHED
+    instance._loaded_status = instance.status
+    # draft edits are invisible to readers; publishing or unpublishing is not
+    if was_published or instance.status == Post.Status.PUBLISHED:
+        pagecache.purge()
+
+
+@receiver(post_delete, sender=Post)
+def purge_public_pages_on_delete(sender, instance, **kwargs):
+    if instance.status == Post.Status.PUBLISHED:
+        pagecache.purge(deleted=True)
+
+
+@receiver(m2m_changed, sender=Post.users_like.through)
+def recount_likes(sender, instance, action, reverse, pk_set, **kwargs):
+    # blog/likes.py keeps like_count with F() updates; this covers writes made
+    # through users_like/posts_liked (admin, shell) instead
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        likes.recount([instance.pk])
+    elif action == 'post_clear':
+        likes.recount()  # the cleared post ids are not passed along
+    else:
+        likes.recount(pk_set)
+
+
+@receiver(post_delete, sender=Post)
+def drop_from_view_ranking(sender, instance, **kwargs):
+    viewcounter.get_counter().forget(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_trends(sender, instance, created, **kwargs):
+    if created and instance.active:
+        trending.record({instance.post_id: trending.COMMENT_WEIGHT}, at=instance.created)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment_on_save(sender, instance, created, **kwargs):
+    was_active = False if created else getattr(instance, '_loaded_active', instance.active)
+    instance._loaded_active = instance.active
+    comment_counts.adjust(instance.post_id, int(instance.active) - int(was_active))
+
+
+@receiver(post_delete, sender=Comment)
+def count_comment_on_delete(sender, instance, **kwargs):
+    if instance.active:
+        comment_counts.adjust(instance.post_id, -1)
@@ -0,0 +1,122 @@
+"""Materialized "similar posts".
+
+Similarity between two published posts is the Jaccard index of their tag
+sets. The top TOP_K neighbours of every post are stored in SimilarPost so
+the detail page reads them with one indexed query instead of grouping over
+the taggit table on every view.
+
+rebuild_similar_posts() recomputes everything (build_similar_posts command);
+update_similar_posts() only touches the posts whose neighbour lists can
+change when one post's tags or status change (wired up in blog/signals.py).
+"""
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from taggit.models import TaggedItem
+
+from .models import Post, SimilarPost
+
+TOP_K = 8
+
+
+def _tagged_items(post_ids=None, tag_ids=None):
+    items = TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(Post),
+        object_id__in=Post.published.values('id'),
+    )
+    if post_ids is not None:
+        items = items.filter(object_id__in=post_ids)
+    if tag_ids is not None:
+        items = items.filter(tag_id__in=tag_ids)
+    return items.values_list('object_id', 'tag_id')
+
+
+def _tag_sets(post_ids=None):
+    tag_sets = defaultdict(set)
+    for post_id, tag_id in _tagged_items(post_ids=post_ids):
+        tag_sets[post_id].add(tag_id)
+    return tag_sets
+
+
+def jaccard(a, b):
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def neighbours(post_id, tag_sets, candidates):
+    tags = tag_sets.get(post_id, set())
+    scored = [
+        (jaccard(tags, tag_sets[other]), other)
+        for other in candidates
+        if other != post_id
+    ]
+    scored = [(score, other) for score, other in scored if score > 0]
+    scored.sort(reverse=True)
+    return scored[:TOP_K]
+
+
+def _store(rows_by_post):
+    with transaction.atomic():
+        tag_rows = SimilarPost.objects.filter(kind=SimilarPost.Kind.TAGS)
+        tag_rows.filter(post_id__in=rows_by_post.keys()).delete()
+        SimilarPost.objects.bulk_create([
+            SimilarPost(
+                post_id=post_id, similar_id=other, score=score,
+                kind=SimilarPost.Kind.TAGS,
+            )
+            for post_id, rows in rows_by_post.items()
+            for score, other in rows
+        ])
+
+
+def _rows_for(post_ids, tag_sets):
+    posts_by_tag = defaultdict(set)
+    for post_id, tags in tag_sets.items():
+        for tag_id in tags:
+            posts_by_tag[tag_id].add(post_id)
+    rows_by_post = {}
+    for post_id in post_ids:
+        # only posts sharing at least one tag can score above zero
+        tags = tag_sets.get(post_id, set())
+        candidates = set().union(*(posts_by_tag[tag_id] for tag_id in tags))
+        rows_by_post[post_id] = neighbours(post_id, tag_sets, candidates)
+    return rows_by_post
+
+
+def rebuild_similar_posts():
+    tag_sets = _tag_sets()
+    rows_by_post = _rows_for(tag_sets.keys(), tag_sets)
+    with transaction.atomic():
+        SimilarPost.objects.filter(kind=SimilarPost.Kind.TAGS).delete()
+        _store(rows_by_post)
+    return len(rows_by_post)
+
+
+def refresh_similar_posts(post_ids):
+    """Recompute the stored neighbours of ``post_ids`` only."""
+    post_ids = set(post_ids)
+    if not post_ids:
+        return
+    own_tags = _tag_sets(post_ids=post_ids)
+    shared = set().union(*own_tags.values()) if own_tags else set()
+    pool = {other for other, _ in _tagged_items(tag_ids=shared)}
+    # full tag sets of every candidate, for the Jaccard denominators
+    tag_sets = _tag_sets(post_ids=pool | post_ids)
+    _store(_rows_for(post_ids, tag_sets))
+
+
+def posts_listing(post):
+    return set(
+        SimilarPost.objects.filter(similar=post, kind=SimilarPost.Kind.TAGS)
+        .values_list('post_id', flat=True)
+    )
+
+
+def update_similar_posts(post):
+    """Refresh every neighbour list that can change when ``post`` changes."""
+    tags = _tag_sets(post_ids=[post.pk]).get(post.pk, set())
+    # the post itself, everyone sharing a tag with it now, and everyone who
+    # listed it before (it may have lost tags or been unpublished)
+    sharing = {post_id for post_id, _ in _tagged_items(tag_ids=tags)}
+    refresh_similar_posts({post.pk} | sharing | posts_listing(post))
@@ -0,0 +1,15 @@
+from jobs.queue import task
+
+from . import recommender, retrieval
+
+
+@task('blog.refresh_recommendations')
+def refresh_recommendations(post_id):
+    # reads the post as it is now, so a stale or repeated job does no harm
+    recommender.refresh_post(post_id)
+
+
+@task('blog.refresh_retrieval')
+def refresh_retrieval(post_id):
+    # like refresh_recommendations: reads the post as it is now
+    retrieval.refresh_post(post_id)
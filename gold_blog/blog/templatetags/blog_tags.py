@@ -1,26 +1,52 @@
 from django import template
-from django.db.models import Count
+from .. import cache, trending, viewcounter
 from ..models import Post
+from ..rendering import EXCERPT_WORDS, render_markdown
 
-import markdown
 from django.utils.safestring import mark_safe
 
 register = template.Library()
 @register.inclusion_tag('blog/post/latest_posts.html')
 def show_latest_posts(count=5):
-    latest_posts = Post.published.order_by('-publish')[:count]
+    # sidebar widgets render on every page: cached, see blog/cache.py
+    latest_posts = cache.get_or_build(f'latest:{count}', lambda: list(
+        Post.published.only('id', 'title', 'slug', 'publish')
+        .order_by('-publish')[:count]
+    ))
     return {'latest_posts': latest_posts}
 
 @register.simple_tag
 def total_posts():
-    return Post.published.count()
+    return cache.get_or_build('total', Post.published.count)
 
 @register.simple_tag
 def get_most_commented_posts(count = 5):
-    return Post.published.annotate(
-        total_comments = Count('comments')
-    ).order_by('-total_comments')[:count]
+    return cache.get_or_build(f'most_commented:{count}', lambda: list(
+        # active_comment_count is denormalized and indexed: no GROUP BY
+        Post.published.only('id', 'title', 'slug', 'publish', 'active_comment_count')
+        .order_by('-active_comment_count')[:count]
+    ))
     
+@register.simple_tag
+def get_most_viewed_posts(count=5):
+    # view flushes don't bump the sidebar version (views change all the
+    # time): between post edits, BLOG_SIDEBAR_CACHE_TIMEOUT refreshes it
+    return cache.get_or_build(
+        f'most_viewed:{count}', lambda: viewcounter.most_viewed(count)
+    )
+
+@register.simple_tag
+def get_trending_posts(count=5):
+    return cache.get_or_build(f'trending:{count}', lambda: trending.trending(count))
+
 @register.filter(name='markdown')
 def markdown_format(text):
-    return mark_safe(markdown.markdown(text, extensions=["tables"]))
+    if isinstance(text, Post):
+        # posts carry their own pre-rendered copy
+        return text.rendered_body
+    return mark_safe(render_markdown(text))
+
+
+@register.filter(name='excerpt')
+def post_excerpt(post, words=EXCERPT_WORDS):
+    return post.get_excerpt(int(words))
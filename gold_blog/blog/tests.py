@@ -1,3 +1,1482 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models.signals import post_save
+from django.template import Context, Template
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    autocomplete, cache as blog_cache, conversations, keypool, likes, llm, retrieval,
+    trending, viewcounter, views as blog_views,
+)
+from .checks import check_shared_cache
+from .models import Comment, Conversation, Post, PostTrend, SimilarPost, Turn
+from .pagination import paginate_by_cursor
+from .recommender import TOP_K, TfidfIndex, build_recommendations
+from .rendering import RENDER_VERSION, render_markdown
+from .search import search_posts
+from .search.sqlite import SQLiteSearchBackend
+from .similarity import rebuild_similar_posts
+from jobs.models import Job
+from jobs.queue import work
+
+
+# the manifest storage needs collectstatic, which the test run doesn't do
+TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+def make_posts(author, count, tags_per_post, prefix='post'):
+    posts = []
+    for i in range(count):
+        post = Post.objects.create(
+            title=f'{prefix} {i}',
+            slug=f'{prefix}-{i}',
+            author=author,
+            body=f'Body of **{prefix} {i}**',
+            status=Post.Status.PUBLISHED,
+        )
+        post.tags.add(*[f'tag{t}' for t in range(tags_per_post)])
+        posts.append(post)
+    return posts
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class StoredRenderingTests(TestCase):
+    def setUp(self):
+        default_cache.clear()
+        blog_cache.local.clear()
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.post, = make_posts(self.user, 1, tags_per_post=0)
+
+    def test_create_stores_html_and_excerpts(self):
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.body_html, '<p>Body of <strong>post 0</strong></p>')
+        self.assertEqual(set(post.excerpts), {'12', '30'})
+        self.assertEqual(post.excerpts['30'], post.body_html)
+        self.assertEqual(post.render_version, RENDER_VERSION)
+
+    def test_renders_again_only_when_body_or_signature_change(self):
+        post = Post.objects.get(pk=self.post.pk)
+        with mock.patch('blog.models.render_markdown', wraps=render_markdown) as render:
+            post.title = 'renamed'
+            post.save()
+            render.assert_not_called()
+            post.body = 'new *body*'
+            post.save()
+            self.assertEqual(render.call_count, 1)
+            with mock.patch('blog.models.RENDER_VERSION', 'upgraded'):
+                Post.objects.get(pk=post.pk).save()
+            self.assertEqual(render.call_count, 2)
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, '<p>new <em>body</em></p>')
+        self.assertEqual(post.render_version, 'upgraded')
+
+    def test_render_posts_backfills_stale_rows(self):
+        make_posts(self.user, 2, tags_per_post=0, prefix='more')
+        Post.objects.exclude(pk=self.post.pk).update(
+            body_html='', excerpts={}, render_version='old',
+        )
+        out = StringIO()
+        call_command('render_posts', stdout=out)
+        self.assertIn('Rendered 2 post(s)', out.getvalue())
+        post = Post.objects.get(slug='more-1')
+        self.assertEqual(post.body_html, '<p>Body of <strong>more 1</strong></p>')
+        self.assertEqual(post.excerpts['12'], post.body_html)
+        self.assertEqual(post.render_version, RENDER_VERSION)
+        call_command('render_posts', stdout=out)
+        self.assertIn('Rendered 0 post(s)', out.getvalue())
+
+    def test_detail_page_serves_the_stored_html(self):
+        Post.objects.filter(pk=self.post.pk).update(body_html='<p>stored copy</p>')
+        self.client.force_login(self.user)
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertContains(response, '<p>stored copy</p>')
+        self.assertNotContains(response, '<strong>post 0</strong>')
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class PostListQueryCountTests(TestCase):
+    """The listing must cost the same number of queries however big the page is."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='reader', password='secret'
+        )
+        self.client.force_login(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_post_list_query_count_is_constant(self):
+        make_posts(self.user, 2, tags_per_post=1, prefix='small')
+        with mock.patch('blog.views.POSTS_PER_PAGE', 2):
+            small = self.count_queries(reverse('blog:post_list'))
+
+        make_posts(self.user, 10, tags_per_post=5, prefix='large')
+        with mock.patch('blog.views.POSTS_PER_PAGE', 12):
+            large = self.count_queries(reverse('blog:post_list'))
+
+        self.assertEqual(small, large)
+
+    def test_tag_list_query_count_is_constant(self):
+        make_posts(self.user, 2, tags_per_post=1, prefix='small')
+        url = reverse('blog:post_list_by_tag', args=['tag0'])
+        with mock.patch('blog.views.POSTS_PER_PAGE', 2):
+            small = self.count_queries(url)
+
+        make_posts(self.user, 10, tags_per_post=5, prefix='large')
+        with mock.patch('blog.views.POSTS_PER_PAGE', 12):
+            large = self.count_queries(url)
+
+        self.assertEqual(small, large)
+
+    def test_stale_excerpts_do_not_load_bodies(self):
+        make_posts(self.user, 2, tags_per_post=1)
+        # as if RENDER_VERSION changed and render_posts has not run yet
+        Post.objects.update(render_version='old')
+        posts = list(Post.published.defer('body', 'body_html', 'search_vector'))
+        with self.assertNumQueries(0):
+            excerpts = [post.get_excerpt() for post in posts]
+        self.assertIn('<strong>post 1', excerpts[0])  # the older rendering
+        Post.objects.update(excerpts={})
+        posts = list(Post.published.defer('body', 'body_html', 'search_vector'))
+        with self.assertNumQueries(0):
+            self.assertEqual([post.get_excerpt() for post in posts], ['', ''])
+        post = Post.published.get(pk=posts[0].pk)
+        self.assertIn('<strong>post', post.get_excerpt())
+
+    def test_markdown_upgrade_keeps_listing_excerpts(self):
+        make_posts(self.user, 2, tags_per_post=1)
+        with mock.patch('blog.models.RENDER_VERSION', 'upgraded'):
+            response = self.client.get(reverse('blog:post_list'))
+        self.assertContains(response, '<strong>post 0</strong>')
+        self.assertContains(response, '<strong>post 1</strong>')
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.posts = make_posts(self.user, 5, tags_per_post=0)
+
+    def test_walks_forward_and_back(self):
+        newest_first = list(Post.published.order_by('-publish', '-pk'))
+        first = paginate_by_cursor(Post.published.all(), None, 2)
+        self.assertEqual(list(first), newest_first[:2])
+        self.assertFalse(first.has_previous())
+
+        second = paginate_by_cursor(Post.published.all(), first.next_cursor, 2)
+        self.assertEqual(list(second), newest_first[2:4])
+        third = paginate_by_cursor(Post.published.all(), second.next_cursor, 2)
+        self.assertEqual(list(third), newest_first[4:])
+        self.assertFalse(third.has_next())
+
+        back = paginate_by_cursor(Post.published.all(), third.previous_cursor, 2)
+        self.assertEqual(list(back), newest_first[2:4])
+        self.assertTrue(back.has_previous())
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        page = paginate_by_cursor(Post.published.all(), 'not-a-cursor', 2)
+        self.assertEqual(len(page), 2)
+        self.assertFalse(page.has_previous())
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'needs SQLite FTS5')
+@override_settings(STORAGES=TEST_STORAGES)
+class SQLiteSearchTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.django_post = Post.objects.create(
+            title='Query optimisation in Django', slug='django', author=self.user,
+            body='Use select_related to avoid extra queries.',
+            status=Post.Status.PUBLISHED,
+        )
+        self.sql_post = Post.objects.create(
+            title='Learning SQL', slug='sql', author=self.user,
+            body='Indexes make joins fast.', status=Post.Status.PUBLISHED,
+        )
+
+    def test_matches_body_and_title(self):
+        self.assertEqual(list(search_posts('indexes')), [self.sql_post])
+        self.assertEqual(list(search_posts('django queries')), [self.django_post])
+
+    def test_tolerates_typos(self):
+        self.assertEqual(list(search_posts('djnago')), [self.django_post])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.sql_post.body = 'Window functions explained.'
+        self.sql_post.save()
+        self.assertEqual(list(search_posts('window')), [self.sql_post])
+        self.sql_post.delete()
+        self.assertEqual(list(search_posts('window')), [])
+
+    def test_search_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('blog:post_search'), {'query': 'sql'})
+        self.assertContains(response, 'Learning SQL')
+
+    def test_drafts_do_not_crowd_out_published_posts(self):
+        for i in range(3):
+            Post.objects.create(
+                title=f'Indexes draft {i}', slug=f'draft-{i}', author=self.user,
+                body='Indexes, indexes, indexes.',
+            )
+        with mock.patch.object(SQLiteSearchBackend, 'max_results', 2):
+            self.assertEqual(list(search_posts('indexes')), [self.sql_post])
+        self.sql_post.status = Post.Status.DRAFT
+        self.sql_post.save()
+        self.assertEqual(list(search_posts('indexes', Post.objects.all())), [])
+        self.sql_post.status = Post.Status.PUBLISHED
+        self.sql_post.save()
+        self.assertEqual(list(search_posts('indexes')), [self.sql_post])
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL')
+@override_settings(STORAGES=TEST_STORAGES)
+class PostgresSearchTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.bread = Post.objects.create(
+            title='Sourdough', slug='sourdough', author=self.user,
+            body='A starter, flour and water.', status=Post.Status.PUBLISHED,
+        )
+        self.notes = Post.objects.create(
+            title='Weekend notes', slug='notes', author=self.user,
+            body='She was baking breads and a sourdough loaf.',
+            status=Post.Status.PUBLISHED,
+        )
+
+    def test_title_matches_rank_above_body_matches(self):
+        self.assertEqual(list(search_posts('sourdough')), [self.bread, self.notes])
+
+    def test_stems_words(self):
+        self.assertEqual(list(search_posts('baked bread')), [self.notes])
+
+    def test_falls_back_to_title_trigrams_for_typos(self):
+        self.assertEqual(list(search_posts('sourdouhg')), [self.bread])
+
+    def test_trigger_follows_edits_and_leaves_drafts_out(self):
+        self.notes.body = 'Pizza dough, cold proofed.'
+        self.notes.save()
+        self.assertEqual(list(search_posts('pizza')), [self.notes])
+        self.notes.status = Post.Status.DRAFT
+        self.notes.save()
+        self.assertEqual(list(search_posts('pizza')), [])
+
+    def test_gin_indexes_exist(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Post._meta.db_table)
+        for name in ('blog_post_search_gin', 'blog_post_title_trgm'):
+            self.assertEqual(constraints[name]['type'], 'gin')
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.post = Post.objects.create(
+            title='Django ORM tips', slug='orm', author=self.user,
+            body='...', status=Post.Status.PUBLISHED,
+        )
+        self.post.tags.add('databases')
+        # other tests' posts were rolled back without telling the index
+        autocomplete.invalidate()
+
+    def labels(self, prefix):
+        return [s['label'] for s in autocomplete.suggest(prefix)]
+
+    def test_matches_title_words_and_tags(self):
+        self.assertEqual(self.labels('dja'), ['Django ORM tips'])
+        self.assertEqual(self.labels('orm'), ['Django ORM tips'])
+        self.assertEqual(self.labels('data'), ['databases'])
+        self.assertEqual(self.labels('zzz'), [])
+
+    def test_changes_are_applied_without_a_rebuild(self):
+        self.assertEqual(self.labels('flask'), [])
+        with mock.patch('blog.autocomplete.build_index', side_effect=AssertionError):
+            with self.captureOnCommitCallbacks(execute=True):
+                flask = Post.objects.create(
+                    title='Flask for beginners', slug='flask', author=self.user,
+                    body='...', status=Post.Status.PUBLISHED,
+                )
+                flask.tags.add('web')
+            self.assertEqual(self.labels('flask'), ['Flask for beginners'])
+            self.assertEqual(self.labels('we'), ['web'])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.post.title = 'Django queryset tips'
+                self.post.save()
+            self.assertEqual(self.labels('orm'), [])
+            self.assertEqual(self.labels('query'), ['Django queryset tips'])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.post.status = Post.Status.DRAFT
+                self.post.save()
+            self.assertEqual(self.labels('dja'), [])
+            self.assertEqual(self.labels('data'), [])  # its only post is a draft now
+
+            with self.captureOnCommitCallbacks(execute=True):
+                flask.delete()
+            self.assertEqual(self.labels('flask'), [])
+            self.assertEqual(self.labels('we'), [])
+
+    def test_counter_saves_record_nothing(self):
+        version = autocomplete.current_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.get(pk=self.post.pk).save()  # as render_posts does
+            post = Post.objects.only('id', 'views').get(pk=self.post.pk)
+            post.views = 5
+            post.save(update_fields=['views'])
+        self.assertEqual(autocomplete.current_version(), version)
+
+    def test_falls_back_to_a_rebuild_when_the_log_is_gone(self):
+        self.labels('dja')
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(
+                title='Flask for beginners', slug='flask', author=self.user,
+                body='...', status=Post.Status.PUBLISHED,
+            )
+        default_cache.delete(autocomplete._change_key(autocomplete.current_version()))
+        with mock.patch('blog.autocomplete.build_index', wraps=autocomplete.build_index) as build:
+            self.assertEqual(self.labels('flask'), ['Flask for beginners'])
+        build.assert_called_once()
+
+    def test_endpoint(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('blog:post_suggest'), {'q': 'Dj'})
+        self.assertEqual(response.json()['suggestions'][0]['label'], 'Django ORM tips')
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+
+class SimilarPostTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='writer')
+
+    def post(self, slug, *tags):
+        post = Post.objects.create(
+            title=slug, slug=slug, author=self.user, body='...',
+            status=Post.Status.PUBLISHED,
+        )
+        post.tags.add(*tags)
+        return post
+
+    def similar(self, post):
+        return list(
+            Post.published.filter(recommended_in__post=post)
+            .order_by('-recommended_in__score')
+        )
+
+    def test_neighbours_follow_tag_changes(self):
+        a = self.post('a', 'python', 'django')
+        b = self.post('b', 'python', 'django')
+        c = self.post('c', 'python')
+        self.assertEqual(self.similar(a), [b, c])
+        self.assertCountEqual(self.similar(c), [a, b])
+
+        b.tags.remove('python', 'django')
+        self.assertEqual(self.similar(a), [c])
+
+        c.delete()
+        self.assertEqual(self.similar(a), [])
+
+    def test_rebuild_matches_incremental(self):
+        a = self.post('a', 'x', 'y')
+        b = self.post('b', 'y')
+        incremental = self.similar(a), self.similar(b)
+        rebuild_similar_posts()
+        self.assertEqual((self.similar(a), self.similar(b)), incremental)
+
+
+class RecommenderTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        path = os.path.join(self.tmp.name, 'recommender.npz')
+        self.enterContext(override_settings(BLOG_RECOMMENDER_PATH=path))
+        self.user = get_user_model().objects.create_user(username='writer')
+
+    def post(self, slug, body):
+        return Post.objects.create(
+            title=slug, slug=slug, author=self.user, body=body,
+            status=Post.Status.PUBLISHED,
+        )
+
+    def content_neighbours(self, post):
+        return list(
+            SimilarPost.objects.filter(post=post, kind=SimilarPost.Kind.CONTENT)
+            .values_list('similar__slug', flat=True)
+        )
+
+    def test_build_and_incremental_update(self):
+        sql = self.post('sql', 'postgres indexes vacuum queries planner')
+        self.post('cooking', 'pasta tomato basil garlic oven')
+        self.post('baking', 'bread oven flour yeast dough')
+        build_recommendations()
+        self.assertEqual(self.content_neighbours(sql), [])
+        self.assertEqual(self.content_neighbours(Post.objects.get(slug='cooking')), ['baking'])
+
+        # a new post is scored against the stored matrix without a rebuild,
+        # by the job worker rather than the request that saved it
+        tuning = self.post('tuning', 'postgres planner indexes')
+        self.assertEqual(self.content_neighbours(tuning), [])
+        self.assertEqual(work(), (1, 0))
+        self.assertEqual(self.content_neighbours(tuning), ['sql'])
+        self.assertEqual(self.content_neighbours(sql), ['tuning'])
+
+        tuning_id = tuning.pk
+        tuning.delete()
+        self.assertEqual(work(), (1, 0))
+        index = TfidfIndex.load(settings.BLOG_RECOMMENDER_PATH)
+        self.assertIsNone(index.row_of(tuning_id))
+
+    def test_removed_posts_leave_other_lists_refilled(self):
+        # the hub shares one word with each of ten posts, so TOP_K of them
+        # make its list and two wait for a place
+        words = [f'word{i}' for i in range(10)]
+        hub = self.post('hub', ' '.join(words))
+        for i, word in enumerate(words):
+            self.post(f'p{i}', f'{word} other{i}')
+        build_recommendations()
+        listed = self.content_neighbours(hub)
+        self.assertEqual(len(listed), TOP_K)
+
+        Post.objects.get(slug=listed[0]).delete()
+        unpublished = Post.objects.get(slug=listed[1])
+        unpublished.status = Post.Status.DRAFT
+        unpublished.save()
+        self.assertEqual(work(), (2, 0))
+        now = self.content_neighbours(hub)
+        self.assertEqual(len(now), TOP_K)
+        self.assertNotIn(listed[0], now)
+        self.assertNotIn(listed[1], now)
+
+    def test_nothing_is_queued_before_the_first_build(self):
+        self.post('sql', 'postgres indexes vacuum queries planner')
+        self.assertFalse(Job.objects.exists())
+
+
+class RetrievalTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.enterContext(override_settings(BLOG_RETRIEVAL_PATH=self.tmp.name))
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.bread = self.post('bread', 'sourdough starter flour water hydration crumb crust oven')
+        self.kimchi = self.post('kimchi', 'napa cabbage chili flakes garlic brine fermentation jar')
+
+    def post(self, slug, body):
+        return Post.objects.create(
+            title=slug, slug=slug, author=self.user, body=body,
+            status=Post.Status.PUBLISHED,
+        )
+
+    def titles(self, prompt):
+        return [passage['title'] for passage in retrieval.passages(prompt)]
+
+    def test_nothing_is_retrieved_before_the_index_is_built(self):
+        self.assertEqual(retrieval.passages('sourdough starter'), [])
+
+    def test_build_then_reindex_on_save_and_delete(self):
+        call_command('build_retrieval_index', stdout=StringIO())
+        self.assertEqual(self.titles('how do I feed a sourdough starter?'), ['bread'])
+        self.assertEqual(retrieval.passages('chili cabbage')[0]['url'], self.kimchi.get_absolute_url())
+
+        self.kimchi.body = 'ramen broth noodles miso scallion'
+        self.kimchi.save()
+        # queued for the job worker rather than reindexed in the request
+        job = Job.objects.get(name='blog.refresh_retrieval')
+        self.assertEqual(job.payload, {'post_id': self.kimchi.pk})
+        self.assertEqual(self.titles('napa cabbage brine'), ['kimchi'])
+        self.assertEqual(work(), (1, 0))
+        self.assertEqual(self.titles('miso ramen broth'), ['kimchi'])
+        self.assertEqual(self.titles('napa cabbage brine'), [])  # old chunks are dead
+
+        self.bread.status = Post.Status.DRAFT
+        self.bread.save()
+        self.kimchi.delete()
+        self.assertEqual(work(), (2, 0))
+        self.assertEqual(self.titles('sourdough starter'), [])
+        self.assertEqual(self.titles('miso ramen broth'), [])
+        index = retrieval.load()
+        self.assertFalse((index.rows[:, 0] >= 0).any())
+
+        # a rebuild drops the dead rows and the old vector file
+        self.post('ramen', 'ramen broth noodles miso')
+        call_command('build_retrieval_index', stdout=StringIO())
+        self.assertEqual(len(retrieval.load().rows), 1)
+        self.assertEqual(len([f for f in os.listdir(self.tmp.name) if f.endswith('.f32')]), 1)
+
+    def test_same_version_is_queued_once(self):
+        call_command('build_retrieval_index', stdout=StringIO())
+        retrieval.schedule_update(self.bread)
+        retrieval.schedule_update(self.bread)
+        retrieval.schedule_update(self.bread, deleted=True)
+        self.assertEqual(Job.objects.filter(name='blog.refresh_retrieval').count(), 2)
+
+    def test_long_posts_are_chunked(self):
+        words = [f'word{i}' for i in range(300)]
+        chunks = retrieval.chunk_words(' '.join(words))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[1].split()[0], f'word{retrieval.CHUNK_WORDS - retrieval.CHUNK_OVERLAP}')
+        self.assertEqual(chunks[-1].split()[-1], 'word299')
+
+    def test_approximate_index_finds_exact_matches(self):
+        texts = [f'topic{i} alpha{i % 7} beta{i % 11} gamma{i % 13}' for i in range(400)]
+        index = retrieval.build_index(
+            [(i, 0, text) for i, text in enumerate(texts)], self.tmp.name, ann_min_chunks=0,
+        )
+        self.assertIsNotNone(index.centroids)
+        for i in (0, 123, 399):
+            (row, score), = index.search(retrieval.embed([texts[i]])[0], 1)
+            self.assertEqual((row, round(score, 4)), (i, 1.0))
+
+    def test_passages_go_before_the_prompt(self):
+        passage = {'title': 'bread', 'url': '/bread/', 'text': 'starter', 'score': 0.5}
+        contents = llm.build_contents([], 'what flour?', [passage])
+        parts = contents[-1]['parts']
+        self.assertEqual(parts[-1], {'text': 'what flour?'})
+        self.assertIn('From "bread" (/bread/):\nstarter', parts[0]['text'])
+
+
+class SidebarCacheTests(TestCase):
+    template = Template(
+        '{% load blog_tags %}{% total_posts %}|{% show_latest_posts 3 %}|'
+        '{% get_most_commented_posts 3 as most %}{% for p in most %}{{ p.title }},{% endfor %}'
+    )
+
+    def setUp(self):
+        default_cache.clear()
+        blog_cache.local.clear()
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.posts = make_posts(self.user, 3, tags_per_post=0)
+
+    def render(self):
+        return self.template.render(Context())
+
+    def test_warm_sidebar_costs_no_queries(self):
+        cold = self.render()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(), cold)
+
+    def test_comments_and_posts_invalidate(self):
+        self.render()
+        Comment.objects.create(post=self.posts[2], user=self.user, body='hi')
+        self.assertIn(f'|{self.posts[2].title},', self.render())
+
+        make_posts(self.user, 1, tags_per_post=0, prefix='fresh')
+        self.assertTrue(self.render().startswith('4|'))
+
+    def test_stale_entry_served_while_another_request_rebuilds(self):
+        blog_cache.get_or_build('answer', lambda: 1, timeout=0)  # stale at once
+        key = f'blog:sidebar:{blog_cache.current_version()}:answer'
+        default_cache.add(f'{key}:lock', 1)  # someone else is rebuilding
+        self.assertEqual(blog_cache.get_or_build('answer', lambda: 2), 1)
+        default_cache.delete(f'{key}:lock')
+        self.assertEqual(blog_cache.get_or_build('answer', lambda: 2), 2)
+
+    def test_cold_fallback_leaves_the_other_lock_alone(self):
+        key = f'blog:sidebar:{blog_cache.current_version()}:cold'
+        default_cache.add(f'{key}:lock', 1)  # a slow rebuild that never lands
+        with mock.patch('blog.cache.WAIT_STEPS', 2), mock.patch('blog.cache.WAIT_STEP', 0):
+            self.assertEqual(blog_cache.get_or_build('cold', lambda: 3), 3)
+        self.assertIsNotNone(default_cache.get(f'{key}:lock'))
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def ids(self):
+        return [message.id for message in check_shared_cache(None)]
+
+    def test_warns_without_redis_unless_debugging(self):
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(DEBUG=False):
+            self.assertEqual(self.ids(), ['blog.W001'])
+            with override_settings(CACHES=redis):
+                self.assertEqual(self.ids(), [])
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.ids(), [])
+
+
+class TwoLevelCacheTests(TestCase):
+    def setUp(self):
+        default_cache.clear()
+        blog_cache.local.clear()
+        blog_cache.reset_stats()
+
+    def exercise_both_levels(self):
+        builds = []
+        build = lambda: builds.append(1) or {'answer': 42}
+        self.assertEqual(blog_cache.cached('hot', build), {'answer': 42})
+        self.assertEqual(blog_cache.cached('hot', build), {'answer': 42})
+        blog_cache.local.clear()  # as seen from another worker
+        self.assertEqual(blog_cache.cached('hot', build), {'answer': 42})
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(
+            blog_cache.stats(), {'local_hits': 1, 'shared_hits': 1, 'misses': 1}
+        )
+        blog_cache.delete('hot')
+        self.assertIsNone(blog_cache.get('hot'))
+
+    def test_locmem(self):
+        self.exercise_both_levels()
+
+    def test_file_based(self):
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}):
+                self.exercise_both_levels()
+
+    @unittest.skipUnless(os.environ.get('TEST_REDIS_URL'), 'set TEST_REDIS_URL to run')
+    def test_redis(self):
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['TEST_REDIS_URL'],
+            'KEY_PREFIX': 'foodie-test',
+        }}):
+            default_cache.clear()
+            self.exercise_both_levels()
+
+    def test_lru_evicts_least_recently_used(self):
+        lru = blog_cache.LocalCache(maxsize=2)
+        lru.set('a', 1, 60)
+        lru.set('b', 2, 60)
+        lru.get('a')
+        lru.set('c', 3, 60)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+
+    def test_similar_posts_cached_until_posts_change(self):
+        user = get_user_model().objects.create_user(username='writer')
+        first, second = make_posts(user, 2, tags_per_post=1)
+
+        def render():
+            # what post_detail does for its "similar posts" block
+            return blog_cache.cached(
+                blog_cache.versioned_key('similar', first.id),
+                lambda: blog_views.similar_posts_for(first),
+            )
+
+        self.assertEqual(render(), [second])
+        with self.assertNumQueries(0):
+            self.assertEqual(render(), [second])
+        blog_cache.local.clear()  # another worker reads the shared copy
+        with self.assertNumQueries(0):
+            self.assertEqual(render(), [second])
+
+        second.tags.clear()
+        self.assertEqual(render(), [])
+        third, = make_posts(user, 1, tags_per_post=1, prefix='third')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(render(), [third])
+        self.assertGreater(len(queries), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(render(), [third])
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class PublicPageCacheTests(TestCase):
+    def setUp(self):
+        default_cache.clear()
+        blog_cache.local.clear()
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.post, = make_posts(self.user, 1, tags_per_post=0)
+
+    def test_pages_are_served_from_cache(self):
+        for url in ['/', reverse('blog:kiya'), reverse('blog:post_feed'), '/sitemap.xml']:
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                with self.assertNumQueries(0):
+                    second = self.client.get(url)
+                self.assertEqual(second.content, first.content)
+                self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_each_hit_gets_its_own_response(self):
+        first = self.client.get('/')
+        second = self.client.get('/')
+        self.assertIsNot(second, first)
+        second['X-Probe'] = 'changed by middleware'
+        self.assertNotIn('X-Probe', self.client.get('/'))
+
+    def test_unread_query_parameters_share_one_entry(self):
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/', {'x': 'anything'}).status_code, 200)
+        for i in range(3):
+            self.client.get('/', {'x': i})
+        self.assertEqual(len([k for k in default_cache._cache if ':response:' in k]), 1)
+
+    def test_sitemap_pages_are_cached_apart(self):
+        self.assertEqual(self.client.get('/sitemap.xml').status_code, 200)
+        self.assertEqual(self.client.get('/sitemap.xml', {'p': 2}).status_code, 404)
+
+    def test_conditional_requests_get_304(self):
+        response = self.client.get(reverse('blog:post_feed'))
+        self.assertIn('Last-Modified', response)
+        again = self.client.get(
+            reverse('blog:post_feed'), HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(again.status_code, 304)
+        again = self.client.get(
+            reverse('blog:post_feed'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(again.status_code, 304)
+
+    def test_purged_by_published_changes_only(self):
+        etag = self.client.get(reverse('blog:post_feed'))['ETag']
+        Post.objects.create(
+            title='Draft', slug='draft', author=self.user, body='...',
+        )
+        self.assertEqual(self.client.get(reverse('blog:post_feed'))['ETag'], etag)
+
+        self.post.title = 'Renamed'
+        self.post.save()
+        response = self.client.get(reverse('blog:post_feed'))
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Renamed')
+
+        self.post.status = Post.Status.DRAFT
+        self.post.save()
+        self.assertNotContains(self.client.get(reverse('blog:post_feed')), 'Renamed')
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class PostDetailConditionalTests(TestCase):
+    def setUp(self):
+        default_cache.clear()
+        blog_cache.local.clear()
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.post, = make_posts(self.user, 1, tags_per_post=0)
+        self.url = self.post.get_absolute_url()
+        self.client.force_login(self.user)
+
+    def etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_unchanged_page_is_304_after_one_query(self):
+        etag = self.etag()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # session + user for login_required, then the annotated post
+        self.assertEqual(len(queries), 3)
+
+    def test_comments_and_likes_change_the_etag(self):
+        etag = self.etag()
+        comment = Comment.objects.create(post=self.post, user=self.user, body='hi')
+        self.assertNotEqual(self.etag(), etag)
+
+        etag = self.etag()
+        comment.active = False
+        comment.save()
+        self.assertNotEqual(self.etag(), etag)
+
+        etag = self.etag()
+        self.post.users_like.add(self.user)
+        liked = self.client.get(self.url)
+        self.assertNotEqual(liked['ETag'], etag)
+        self.assertContains(liked, 'unlike')
+
+    def test_logging_in_again_changes_the_etag(self):
+        etag = self.etag()
+        self.client.logout()
+        self.client.force_login(self.user)  # new session and CSRF secret
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        csrf = Client(enforce_csrf_checks=True)
+        csrf.force_login(self.user)
+        page = csrf.get(self.url)
+        self.assertEqual(csrf.get(self.url, HTTP_IF_NONE_MATCH=page['ETag']).status_code, 304)
+        token = page.context['csrf_token']
+        csrf.logout()
+        csrf.force_login(self.user)
+        # the old page is not reused, and its token is indeed dead
+        self.assertEqual(csrf.get(self.url, HTTP_IF_NONE_MATCH=page['ETag']).status_code, 200)
+        stale = csrf.post(
+            reverse('blog:post_comment', args=[self.post.id]),
+            {'body': 'hi', 'csrfmiddlewaretoken': str(token)},
+        )
+        self.assertEqual(stale.status_code, 403)
+
+    def test_flushed_views_change_the_etag(self):
+        etag = self.etag()
+        viewcounter.apply_deltas({self.post.id: 5})
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_anonymous_still_redirected_to_login(self):
+        self.client.logout()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 302)
+
+
+class LikeTests(TestCase):
+    def setUp(self):
+        default_cache.clear()
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.post, = make_posts(self.user, 1, tags_per_post=0)
+        self.client.force_login(self.user)
+
+    def click(self, action):
+        response = self.client.post(reverse('blog:like'), {'id': self.post.id, 'action': action})
+        return response.json()['total_likes']
+
+    def like_count(self):
+        self.post.refresh_from_db(fields=['like_count'])
+        return self.post.like_count
+
+    def test_like_count_follows_clicks(self):
+        self.assertEqual(self.click('like'), 1)
+        self.assertEqual(self.click('like'), 1)  # liking twice counts once
+        self.assertTrue(likes.has_liked(self.post.id, self.user.id))
+        self.assertEqual(self.click('unlike'), 0)
+        self.assertEqual(self.like_count(), 0)
+
+    def test_m2m_writes_and_reconcile(self):
+        other = get_user_model().objects.create_user(username='reader')
+        self.post.users_like.add(self.user, other)
+        self.assertEqual(self.like_count(), 2)
+        other.posts_liked.remove(self.post)
+        self.assertEqual(self.like_count(), 1)
+
+        Post.objects.filter(pk=self.post.pk).update(like_count=7)
+        call_command('reconcile_like_counts', stdout=StringIO())
+        self.assertEqual(self.like_count(), 1)
+
+    @override_settings(BLOG_LIKE_BUFFERING=True)
+    def test_buffered_clicks_are_coalesced(self):
+        for action in ['like', 'unlike', 'like']:
+            total = self.click(action)
+        self.assertEqual(total, 1)  # shown right away...
+        self.assertFalse(likes.has_liked(self.post.id, self.user.id))  # ...written later
+        self.assertEqual(self.like_count(), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(likes.flush(), 1)
+        writes = [q for q in queries if q['sql'].startswith('INSERT INTO "blog_post_users_like"')]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(likes.has_liked(self.post.id, self.user.id))
+        self.assertEqual(self.like_count(), 1)
+        self.assertEqual(likes.pending_delta(self.post.id), 0)
+        self.assertEqual(likes.flush(), 0)
+
+    def test_buffered_state_is_dropped_once_flushed(self):
+        likes.toggle(self.post.id, self.user.id, True, buffered=True)
+        self.assertTrue(likes.buffered_state(self.post.id, self.user.id, False))
+        likes.flush()
+        self.assertIsNone(likes.buffered_state(self.post.id, self.user.id, None))
+        # an admin edit after the flush is what the next click compares with
+        self.post.users_like.remove(self.user)
+        self.assertTrue(likes.toggle(self.post.id, self.user.id, True, buffered=True))
+        self.assertEqual(likes.pending_delta(self.post.id), 1)
+
+    def test_click_made_during_a_flush_stays_buffered(self):
+        likes.toggle(self.post.id, self.user.id, True, buffered=True)
+        real_toggle = likes.toggle
+
+        def click_meanwhile(post_id, user_id, liked, buffered=False):
+            written = real_toggle(post_id, user_id, liked, buffered)
+            real_toggle(post_id, user_id, False, buffered=True)
+            return written
+
+        with mock.patch('blog.likes.toggle', side_effect=click_meanwhile):
+            likes.flush()
+        self.assertFalse(likes.buffered_state(self.post.id, self.user.id, True))
+        self.assertEqual(likes.flush(), 1)
+        self.assertFalse(likes.has_liked(self.post.id, self.user.id))
+        self.assertEqual(self.like_count(), 0)
+
+    def test_concurrent_clicks_count_once(self):
+        key = likes._lock_key(self.post.id, self.user.id)
+        default_cache.add(key, 1)  # the same viewer's first click, mid-flight
+        with mock.patch('blog.likes.LOCK_TRIES', 2):
+            self.assertFalse(likes.toggle(self.post.id, self.user.id, True, buffered=True))
+        self.assertEqual(likes.pending_delta(self.post.id), 0)
+        default_cache.delete(key)
+        self.assertTrue(likes.toggle(self.post.id, self.user.id, True, buffered=True))
+        self.assertFalse(likes.toggle(self.post.id, self.user.id, True, buffered=True))
+        self.assertEqual(likes.pending_delta(self.post.id), 1)
+
+    def test_evicted_counter_does_not_lose_pending_clicks(self):
+        other = get_user_model().objects.create_user(username='other')
+        likes.toggle(self.post.id, self.user.id, True, buffered=True)
+        likes.flush()
+        likes.toggle(self.post.id, other.id, True, buffered=True)
+        default_cache.delete(likes.SEQ_KEY)  # evicted before the next flush
+        with mock.patch('blog.likes.SCAN_SIZE', 2):
+            likes.toggle(self.post.id, self.user.id, False, buffered=True)
+        self.assertEqual(likes.pending_delta(self.post.id), 0)
+        self.assertEqual(likes.flush(), 2)
+        self.assertEqual(likes.pending_delta(self.post.id), 0)
+        self.assertEqual(self.like_count(), 1)
+        self.assertTrue(likes.has_liked(self.post.id, other.id))
+
+    def test_save_of_a_deleted_row_inserts_it_again(self):
+        post = Post.objects.get(pk=self.post.pk)
+        likes.like(self.post.id, self.user.id)
+        Post.objects.filter(pk=post.pk).delete()
+        post.title = 'Restored'
+        post.save()
+        self.assertEqual(Post.objects.get(pk=post.pk).title, 'Restored')
+
+    def test_full_save_sends_no_update_fields(self):
+        seen = []
+
+        def receiver(sender, update_fields, **kwargs):
+            seen.append(update_fields)
+
+        post_save.connect(receiver, sender=Post)
+        self.addCleanup(post_save.disconnect, receiver, sender=Post)
+        post = Post.objects.get(pk=self.post.pk)
+        post.save()
+        post.save(update_fields=['title'])
+        self.assertEqual(seen, [None, frozenset({'title'})])
+
+    def test_full_save_keeps_concurrent_counter_updates(self):
+        post = Post.objects.get(pk=self.post.pk)  # as the admin form loads it
+        likes.like(self.post.id, self.user.id)
+        viewcounter.apply_deltas({self.post.id: 3})
+        Comment.objects.create(post=self.post, user=self.user, body='hi')
+        post.title = 'Edited'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(
+            (post.title, post.like_count, post.views, post.active_comment_count),
+            ('Edited', 1, 3, 1),
+        )
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class ViewCounterTests(TestCase):
+    def setUp(self):
+        default_cache.clear()
+        blog_cache.local.clear()
+        counter = viewcounter.LocalViewCounter(interval=0)  # flushed by hand
+        self.enterContext(mock.patch.object(viewcounter, '_counter', counter))
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.posts = make_posts(self.user, 3, tags_per_post=0)
+        self.client.force_login(self.user)
+
+    def test_views_are_counted_in_memory_then_flushed_in_one_update(self):
+        for post, views in zip(self.posts, [1, 3, 0]):
+            for _ in range(views):
+                response = self.client.get(post.get_absolute_url())
+        self.assertContains(response, '3 views')
+        self.assertEqual(Post.objects.get(pk=self.posts[1].pk).views, 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(viewcounter.flush(), 2)
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "blog_post" ')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            list(Post.objects.order_by('id').values_list('views', flat=True)), [1, 3, 0]
+        )
+        self.assertEqual(viewcounter.flush(), 0)
+
+    def test_most_viewed_ranking(self):
+        viewcounter.apply_deltas({self.posts[0].pk: 2, self.posts[2].pk: 5})
+        self.assertEqual(viewcounter.most_viewed(), [self.posts[2], self.posts[0]])
+        self.assertEqual(viewcounter.most_viewed(1), [self.posts[2]])
+
+    def test_numbered_deltas_are_applied_once(self):
+        post = self.posts[0]
+        self.assertEqual(viewcounter.apply_deltas({post.pk: 4}, 'flush-1'), 1)
+        self.assertEqual(viewcounter.apply_deltas({post.pk: 4}, 'flush-1'), 0)
+        self.assertEqual(viewcounter.apply_deltas({post.pk: 1}, 'flush-2'), 1)
+        self.assertEqual(Post.objects.get(pk=post.pk).views, 5)
+
+    @unittest.skipUnless(os.environ.get('TEST_REDIS_URL'), 'set TEST_REDIS_URL to run')
+    def test_redis_flush_that_dies_is_not_applied_twice(self):
+        counter = viewcounter.RedisViewCounter(os.environ['TEST_REDIS_URL'])
+        counter.redis.delete(
+            viewcounter.PENDING_KEY, viewcounter.FLUSHING_KEY, viewcounter.FLUSH_ID_KEY,
+            viewcounter.RANKING_KEY,
+        )
+        counter.hit(self.posts[0].pk)
+        with mock.patch.object(counter.redis, 'delete', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                counter.flush()  # the UPDATE committed, the clean-up did not
+        self.assertEqual(counter.flush(), 0)
+        self.assertFalse(counter.redis.exists(viewcounter.FLUSHING_KEY))
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).views, 1)
+
+    @unittest.skipUnless(os.environ.get('TEST_REDIS_URL'), 'set TEST_REDIS_URL to run')
+    def test_redis_counter(self):
+        counter = viewcounter.RedisViewCounter(os.environ['TEST_REDIS_URL'])
+        counter.redis.delete(
+            viewcounter.PENDING_KEY, viewcounter.FLUSHING_KEY, viewcounter.FLUSH_ID_KEY,
+            viewcounter.RANKING_KEY,
+        )
+        self.enterContext(mock.patch.object(viewcounter, '_counter', counter))
+        for post in [self.posts[0], self.posts[1], self.posts[1]]:
+            viewcounter.hit(post.pk)
+        self.assertEqual(viewcounter.total_views(self.posts[1]), 2)
+        self.assertEqual(viewcounter.flush(), 2)
+        self.assertEqual(Post.objects.get(pk=self.posts[1].pk).views, 2)
+        self.assertEqual(viewcounter.most_viewed(), [self.posts[1], self.posts[0]])
+
+
+@override_settings(BLOG_TRENDING_HALF_LIFE=24)
+class TrendingTests(TestCase):
+    def setUp(self):
+        default_cache.clear()
+        blog_cache.local.clear()
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.old, self.new = make_posts(self.user, 2, tags_per_post=0)
+
+    def test_scores_halve_every_half_life(self):
+        now = timezone.now()
+        trending.record({self.old.pk: 8}, at=now - timedelta(hours=48))
+        trending.record({self.new.pk: 3}, at=now)
+        with self.assertNumQueries(1):
+            posts = trending.trending()
+        self.assertEqual(posts, [self.new, self.old])
+        self.assertAlmostEqual(posts[1].trend_score, 2.0, places=2)
+
+        trending.record({self.old.pk: 2}, at=now)  # 2 decayed + 2
+        self.assertEqual(trending.trending(), [self.old, self.new])
+        self.assertAlmostEqual(PostTrend.objects.get(post=self.old).score, 4.0, places=2)
+
+    def test_events_feed_the_ranking(self):
+        Comment.objects.create(post=self.old, user=self.user, body='hi')
+        likes.like(self.new.pk, self.user.pk)
+        viewcounter.apply_deltas({self.new.pk: 4})
+        self.assertEqual(trending.trending(), [self.new, self.old])
+        likes.unlike(self.new.pk, self.user.pk)
+        self.assertEqual(trending.trending(), [self.old, self.new])
+
+    def test_rebuild_matches_the_recorded_scores(self):
+        Comment.objects.create(post=self.old, user=self.user, body='hi')
+        likes.like(self.new.pk, self.user.pk)
+        viewcounter.apply_deltas({self.new.pk: 4, self.old.pk: 2})
+        recorded = dict(PostTrend.objects.values_list('post_id', 'score'))
+        self.assertEqual(trending.rebuild(), 2)
+        rebuilt = dict(PostTrend.objects.values_list('post_id', 'score'))
+        self.assertEqual(rebuilt.keys(), recorded.keys())
+        for post_id, score in recorded.items():
+            self.assertAlmostEqual(rebuilt[post_id], score, places=3)
+
+    def test_endpoint(self):
+        trending.record({self.new.pk: 1})
+        data = self.client.get(reverse('blog:trending_posts'), {'count': 3}).json()
+        self.assertEqual([p['id'] for p in data['posts']], [self.new.pk])
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class CommentBatchTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.post, = make_posts(self.user, 1, tags_per_post=0)
+        for i in range(7):
+            Comment.objects.create(post=self.post, user=self.user, body=f'comment {i}')
+        Comment.objects.create(post=self.post, user=self.user, body='hidden', active=False)
+        self.client.force_login(self.user)
+
+    def test_detail_renders_first_batch_then_endpoint_pages(self):
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertContains(response, 'comment 6')
+        self.assertNotContains(response, 'comment 3')
+        cursor = response.context['comments'].next_cursor
+
+        seen = []
+        url = reverse('blog:post_comments', args=[self.post.id])
+        while cursor:
+            data = self.client.get(url, {'cursor': cursor}).json()
+            seen += [c['body'] for c in data['comments']]
+            self.assertIn('@writer', data['html'])
+            cursor = data['next_cursor']
+        self.assertEqual(seen, [f'comment {i}' for i in range(3, -1, -1)])
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class CommentCountTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='admin', is_staff=True, is_superuser=True
+        )
+        self.post, = make_posts(self.user, 1, tags_per_post=0)
+
+    def count(self):
+        self.post.refresh_from_db(fields=['active_comment_count'])
+        return self.post.active_comment_count
+
+    def test_counter_follows_comments_and_moderation(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('blog:post_comment', args=[self.post.id]), {'body': 'hi'})
+        comment = Comment.objects.create(post=self.post, user=self.user, body='second')
+        self.assertEqual(self.count(), 2)
+
+        comment.active = False
+        comment.save()
+        self.assertEqual(self.count(), 1)
+        comment.save()  # still inactive
+        self.assertEqual(self.count(), 1)
+        comment.delete()
+        self.assertEqual(self.count(), 1)
+
+        changelist = reverse('admin:blog_comment_changelist')
+        ids = list(Comment.objects.values_list('id', flat=True))
+        self.client.post(changelist, {'action': 'deactivate_comments', '_selected_action': ids})
+        self.assertEqual(self.count(), 0)
+        self.client.post(changelist, {'action': 'activate_comments', '_selected_action': ids})
+        self.assertEqual(self.count(), 1)
+
+        # from a changelist filtered on active, which the update empties
+        self.client.post(
+            changelist + '?active__exact=1',
+            {'action': 'deactivate_comments', '_selected_action': ids},
+        )
+        self.assertEqual(self.count(), 0)
+        self.client.post(
+            changelist + '?active__exact=0',
+            {'action': 'activate_comments', '_selected_action': ids},
+        )
+        self.assertEqual(self.count(), 1)
+
+        Post.objects.filter(pk=self.post.pk).update(active_comment_count=9)
+        call_command('reconcile_comment_counts', stdout=StringIO())
+        self.assertEqual(self.count(), 1)
+
+
+class StubGemini(BaseHTTPRequestHandler):
+    """Local stand-in for the Gemini SSE API.
+
+    Key "bad" is rate limited, "flaky" fails with a 500, any other answers.
+    """
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse shows
+    connections = set()
+    requests = 0
+    keys = []  # the key of every request, in order
+    payload = None  # JSON body of the last request
+
+    def do_POST(self):
+        StubGemini.payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        StubGemini.connections.add(self.client_address)
+        StubGemini.requests += 1
+        StubGemini.keys.append(self.headers['x-goog-api-key'])
+        headers = {}
+        if self.headers['x-goog-api-key'] == 'bad':
+            body, status = b'{"error": "quota"}', 429
+            headers['Retry-After'] = '120'
+        elif self.headers['x-goog-api-key'] == 'flaky':
+            body, status = b'{"error": "internal"}', 500
+        else:
+            chunks = [{'candidates': [{'content': {'parts': [{'text': t}]}}]}
+                      for t in ['Hello', ' **world**']]
+            body = ''.join(f'data: {json.dumps(c)}\r\n\r\n' for c in chunks).encode()
+            status = 200
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LLMStreamTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGemini)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+
+    def setUp(self):
+        StubGemini.connections.clear()
+        StubGemini.requests = 0
+        StubGemini.keys = []
+        default_cache.clear()
+        llm._local.clear()
+        llm.reset_cache_stats()
+        base = f'http://127.0.0.1:{self.server.server_port}'
+        self.enterContext(override_settings(LLM_API_BASE=base))
+        keys = {name: '' for name in llm.KEY_NAMES}
+        keys.update(GEMINI_API_KEY_1='bad', GEMINI_API_KEY_2='good')
+        self.enterContext(mock.patch.dict(os.environ, keys))
+        self.user = get_user_model().objects.create_user(username='writer')
+
+    async def test_streams_tokens_and_fails_over(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('blog:llm_stream'), {'prompt': 'hi'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('data: {"delta": "Hello"}', body)
+        self.assertIn('event: done\ndata: {"html": "<p>Hello <strong>world</strong></p>"}', body)
+
+        response = await self.async_client.post(reverse('blog:llm_generate'), {'prompt': 'again'})
+        self.assertEqual(response.json()['generated'], '<p>Hello <strong>world</strong></p>')
+        # four API calls (bad + good key, twice) over one pooled connection
+        self.assertEqual(len(StubGemini.connections), 1)
+
+    async def test_all_keys_failing(self):
+        with mock.patch.dict(os.environ, {'GEMINI_API_KEY_2': 'bad'}):
+            await self.async_client.aforce_login(self.user)
+            response = await self.async_client.post(reverse('blog:llm_stream'), {'prompt': 'hi'})
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+            self.assertIn('event: error', body)
+            self.assertIn('All API keys failed', body)
+            self.assertEqual(StubGemini.requests, 2)
+
+            # both breakers are open now: fail at once, without a request
+            response = await self.async_client.post(reverse('blog:llm_generate'), {'prompt': 'hi'})
+        self.assertEqual(response.json()['error'], 'All API keys are cooling down.')
+        self.assertAlmostEqual(response.json()['details']['retry_after'], 120, delta=2)
+        self.assertEqual(StubGemini.requests, 2)
+
+    async def test_repeated_question_is_answered_from_cache(self):
+        self.enterContext(mock.patch.dict(os.environ, {'GEMINI_API_KEY_1': 'good'}))
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('blog:llm_generate'), {'prompt': 'hi there'})
+        self.assertEqual(StubGemini.requests, 1)
+
+        # another reader, same (empty) history, same prompt modulo whitespace
+        other = await get_user_model().objects.acreate(username='reader')
+        await self.async_client.aforce_login(other)
+        response = await self.async_client.post(reverse('blog:llm_stream'), {'prompt': ' hi\n there '})
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('data: {"delta": "Hello **world**"}', body)
+        self.assertIn('"html": "<p>Hello <strong>world</strong></p>"', body)
+        self.assertEqual(StubGemini.requests, 1)
+
+        # the shared cache answers a process whose LRU does not have it
+        llm._local.clear()
+        third = await get_user_model().objects.acreate(username='cook')
+        await self.async_client.aforce_login(third)
+        response = await self.async_client.post(reverse('blog:llm_generate'), {'prompt': 'hi there'})
+        self.assertEqual(response.json()['generated'], '<p>Hello <strong>world</strong></p>')
+        self.assertEqual(StubGemini.requests, 1)
+
+        # a follow-up carries history, so it is a different question
+        await self.async_client.post(reverse('blog:llm_generate'), {'prompt': 'hi there'})
+        self.assertEqual(StubGemini.requests, 2)
+        stats = llm.cache_stats()
+        self.assertEqual((stats['local_hits'], stats['shared_hits'], stats['misses']), (1, 1, 2))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    async def test_unhealthy_keys_are_skipped_and_healthy_ones_rotate(self):
+        self.enterContext(mock.patch.dict(os.environ, {
+            'GEMINI_API_KEY_1': 'bad', 'GEMINI_API_KEY_2': 'good',
+            'GEMINI_API_KEY_3': 'flaky', 'GEMINI_API_KEY_4': 'fine',
+        }))
+        self.enterContext(override_settings(LLM_KEY_FAILURE_THRESHOLD=1))
+        await self.async_client.aforce_login(self.user)
+        for i in range(6):
+            response = await self.async_client.post(reverse('blog:llm_generate'), {'prompt': f'q{i}'})
+            self.assertIn('generated', response.json())
+        # each failing key was tried once, then rested; the good ones took turns
+        self.assertEqual(StubGemini.keys.count('bad'), 1)
+        self.assertEqual(StubGemini.keys.count('flaky'), 1)
+        self.assertEqual((StubGemini.keys.count('good'), StubGemini.keys.count('fine')), (3, 3))
+
+        stats = await sync_to_async(keypool.stats)(llm.KEY_NAMES)
+        self.assertEqual(stats['GEMINI_API_KEY_1']['state'], 'open')
+        self.assertEqual(stats['GEMINI_API_KEY_1']['rate_limited'], 1)
+        self.assertEqual(stats['GEMINI_API_KEY_3']['errors'], 1)
+        self.assertEqual(stats['GEMINI_API_KEY_2']['requests'], 3)
+        self.assertIsNotNone(stats['GEMINI_API_KEY_2']['avg_latency_ms'])
+        out = StringIO()
+        await sync_to_async(call_command)('llm_key_stats', stdout=out)
+        self.assertIn('GEMINI_API_KEY_1: open, 1 request(s), 1 error(s), 1 rate limited', out.getvalue())
+
+    @override_settings(LLM_KEY_FAILURE_THRESHOLD=2, LLM_KEY_COOLDOWN=0.2)
+    async def test_circuit_breaker_half_opens_after_cooldown(self):
+        names = ['A', 'B']
+        await keypool.record('A', 500)
+        self.assertEqual(await keypool.ordered(names), [('B', False), ('A', False)])
+        await keypool.record('A', None)  # second failure in a row: open
+        self.assertEqual([name for name, _ in await keypool.ordered(names)], ['B'])
+
+        await asyncio.sleep(0.25)
+        self.assertEqual((await keypool.ordered(names))[-1], ('A', True))
+        self.assertTrue(await keypool.acquire('A', trial=True))
+        self.assertFalse(await keypool.acquire('A', trial=True))  # one trial at a time
+        await keypool.record('A', 500)
+        await keypool.release('A')
+        await asyncio.sleep(0.25)  # the second trip rests it twice as long
+        self.assertNotIn('A', [name for name, _ in await keypool.ordered(names)])
+
+        await asyncio.sleep(0.2)
+        self.assertTrue(await keypool.acquire('A', trial=True))
+        await keypool.record('A', 200)
+        await keypool.release('A')
+        self.assertIn(('A', False), await keypool.ordered(names))
+
+    @override_settings(LLM_KEY_MAX_CONCURRENCY=1, LLM_KEY_RATE=60, LLM_KEY_BURST=2)
+    async def test_concurrency_and_rate_limits(self):
+        self.assertTrue(await keypool.acquire('A'))
+        self.assertFalse(await keypool.acquire('A'))  # one in flight already
+        await keypool.release('A')
+        self.assertTrue(await keypool.acquire('A'))
+        await keypool.release('A')
+        self.assertFalse(await keypool.acquire('A'))  # burst of two used up
+        self.assertTrue(await keypool.acquire('B'))  # buckets are per key
+        await keypool.release('B')
+        stats = await sync_to_async(keypool.stats)(['A', 'B'])
+        self.assertEqual((stats['A']['inflight'], stats['B']['inflight']), (0, 0))
+
+    @override_settings(LLM_KEY_MAX_CONCURRENCY=5, LLM_KEY_RATE=0)
+    async def test_inflight_count_expires_after_the_last_request(self):
+        with mock.patch.object(keypool, 'INFLIGHT_TIMEOUT', 0.3):
+            self.assertTrue(await keypool.acquire('A'))
+            await asyncio.sleep(0.2)
+            self.assertTrue(await keypool.acquire('A'))
+            await asyncio.sleep(0.2)  # past the first request's timeout
+            stats = await sync_to_async(keypool.stats)(['A'])
+            self.assertEqual(stats['A']['inflight'], 2)
+            await asyncio.sleep(0.2)  # the worker died: its slots free themselves
+            stats = await sync_to_async(keypool.stats)(['A'])
+            self.assertEqual(stats['A']['inflight'], 0)
+
+    def test_cache_key_normalization(self):
+        key = llm.cache_key(llm.build_contents([], 'hi  there'))
+        self.assertEqual(key, llm.cache_key(llm.build_contents([], '\thi there\n')))
+        self.assertNotEqual(key, llm.cache_key(llm.build_contents([], 'hi')))
+        with override_settings(LLM_MODEL='other-model'):
+            self.assertNotEqual(key, llm.cache_key(llm.build_contents([], 'hi there')))
+
+
+    async def test_prompt_carries_retrieved_passages(self):
+        with tempfile.TemporaryDirectory() as path:
+            with override_settings(BLOG_RETRIEVAL_PATH=path):
+                await Post.objects.acreate(
+                    title='Rye bread', slug='rye', author=self.user,
+                    body='rye sourdough caraway dense crumb', status=Post.Status.PUBLISHED,
+                )
+                await sync_to_async(retrieval.build)()
+                await self.async_client.aforce_login(self.user)
+                await self.async_client.post(reverse('blog:llm_generate'), {'prompt': 'rye sourdough tips'})
+        parts = StubGemini.payload['contents'][-1]['parts']
+        self.assertIn('From "Rye bread"', parts[0]['text'])
+        self.assertEqual(parts[-1], {'text': 'rye sourdough tips'})
+
+    async def test_turns_are_stored_outside_the_session(self):
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.post(reverse('blog:llm_generate'), {'prompt': 'hi'})
+        await self.async_client.post(reverse('blog:llm_generate'), {'prompt': 'and then?'})
+        session = await self.async_client.asession()
+        conversation = await Conversation.objects.aget(user=self.user)
+        self.assertEqual(await session.aget(conversations.SESSION_KEY), conversation.pk)
+        self.assertNotIn(conversations.LEGACY_SESSION_KEY, await session.akeys())
+        turns = [turn async for turn in conversation.turns.order_by('created', 'pk')]
+        self.assertEqual([turn.prompt for turn in turns], ['hi', 'and then?'])
+        self.assertEqual(turns[1].response_html, '<p>Hello <strong>world</strong></p>')
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class ConversationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='writer')
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    def add_turns(self, count, size=40):
+        for i in range(count):
+            conversations.append(self.conversation, f'question {i}', 'x' * size)
+
+    def test_context_window_follows_the_token_budget(self):
+        self.add_turns(5)  # 3 + 10 estimated tokens each
+        with override_settings(LLM_CONTEXT_TOKENS=40):
+            window = conversations.context(self.conversation, 'next?')
+        self.assertEqual([item['prompt'] for item in window], ['question 3', 'question 4'])
+        # one long answer can use up the whole budget
+        conversations.append(self.conversation, 'essay', 'x' * 400)
+        with override_settings(LLM_CONTEXT_TOKENS=40):
+            self.assertEqual(conversations.context(self.conversation, 'next?'), [])
+
+    def test_retrieved_passages_come_out_of_the_budget(self):
+        self.add_turns(5)
+        passages = [{'title': 'Rye bread', 'url': '/rye/', 'text': 'rye ' * 50}]
+        reserved = conversations.estimate_tokens(llm.passages_text(passages))
+        with override_settings(LLM_CONTEXT_TOKENS=2 + 2 * 13 + reserved):
+            window = conversations.context(self.conversation, 'next?', passages)
+            self.assertEqual([item['prompt'] for item in window], ['question 3', 'question 4'])
+            self.assertEqual(len(conversations.context(self.conversation, 'next?')), 5)
+
+    def test_page_shows_newest_turns_and_pages_back(self):
+        self.add_turns(12)
+        self.client.force_login(self.user)
+        session = self.client.session
+        session[conversations.SESSION_KEY] = self.conversation.pk
+        session.save()
+
+        with mock.patch.object(llm, 'render') as render:
+            response = self.client.get(reverse('blog:llm_page'))
+        render.assert_not_called()  # answers were rendered when stored
+        history = response.context['llm_history']
+        self.assertEqual(
+            [turn['prompt'] for turn in history['turns']],
+            [f'question {i}' for i in range(2, 12)],
+        )
+        response = self.client.get(reverse('blog:llm_history'), {'cursor': history['next_cursor']})
+        data = response.json()
+        self.assertEqual([turn['prompt'] for turn in data['turns']], ['question 0', 'question 1'])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_legacy_session_history_is_imported(self):
+        self.client.force_login(self.user)
+        session = self.client.session
+        session[conversations.LEGACY_SESSION_KEY] = [{'prompt': 'old', 'response': '*hi*'}]
+        session.save()
+        response = self.client.get(reverse('blog:llm_page'))
+        self.assertEqual(
+            response.context['llm_history']['turns'][0]['response'], '<p><em>hi</em></p>'
+        )
+        session = self.client.session
+        self.assertNotIn(conversations.LEGACY_SESSION_KEY, session)
+        self.assertEqual(Turn.objects.get().conversation_id, session[conversations.SESSION_KEY])
+
+    def test_conversation_of_another_user_is_not_used(self):
+        other = get_user_model().objects.create_user(username='reader')
+        self.client.force_login(other)
+        session = self.client.session
+        session[conversations.SESSION_KEY] = self.conversation.pk
+        session.save()
+        self.add_turns(1)
+        response = self.client.get(reverse('blog:llm_history'))
+        self.assertEqual(response.json()['turns'], [])
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class PostShareTests(TestCase):
+    def setUp(self):
+        author = get_user_model().objects.create_user(username='author')
+        self.post = make_posts(author, 1, 0)[0]
+        self.client.force_login(author)
+
+    def test_double_submit_queues_one_email(self):
+        data = {'name': 'Ann', 'email': 'ann@example.com', 'to': 'bo@example.com', 'comments': 'try it'}
+        url = reverse('blog:post_share', args=[self.post.id])
+        for _ in range(2):
+            response = self.client.post(url, data)
+            self.assertTrue(response.context['sent'])
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'account.send_email')
+        self.assertEqual(job.payload['to_email'], 'bo@example.com')
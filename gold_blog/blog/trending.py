@@ -0,0 +1,110 @@
+"""Trending posts: views, likes and comments with exponential time decay.
+
+Every event adds its weight to the post's PostTrend row after decaying the
+stored score to the event time (it halves every BLOG_TRENDING_HALF_LIFE
+hours). Rows also store
+
+    rank = log2(score) + scored_at / half_life
+
+which differs from the log of the score decayed to *now* by the same amount
+for every row, so "ORDER BY rank DESC" on an indexed column is the current
+trending order, with no aggregation and no rewrite of idle rows as time
+passes.
+
+Events arrive already batched: view counts when they are flushed
+(blog/viewcounter.py), likes from blog/likes.py and new comments from a
+signal (blog/signals.py).
+"""
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Comment, Post, PostTrend
+
+VIEW_WEIGHT = 1.0
+LIKE_WEIGHT = 5.0
+COMMENT_WEIGHT = 8.0
+
+
+def _half_lives(moment):
+    return moment.timestamp() / (settings.BLOG_TRENDING_HALF_LIFE * 3600)
+
+
+def decayed(score, scored_at, moment):
+    return score * 2 ** (_half_lives(scored_at) - _half_lives(moment))
+
+
+def rank_of(score, moment):
+    return math.log2(score) + _half_lives(moment) if score > 0 else None
+
+
+def record(weights, at=None):
+    """Add ``{post_id: weight}`` at ``at`` (default now) in one batch."""
+    weights = {post_id: weight for post_id, weight in weights.items() if weight}
+    if not weights:
+        return
+    at = at or timezone.now()
+    with transaction.atomic():
+        rows = PostTrend.objects.select_for_update().in_bulk(list(weights))
+        missing = set(weights) - set(rows)
+        if missing:
+            # deleted posts may still show up in flushed view counts
+            missing &= set(Post.objects.filter(pk__in=missing).values_list('pk', flat=True))
+        created, changed = [], []
+        for post_id, weight in weights.items():
+            if post_id in rows:
+                row = rows[post_id]
+                changed.append(row)
+            elif post_id in missing:
+                row = PostTrend(post_id=post_id, score=0.0, scored_at=at)
+                created.append(row)
+            else:
+                continue
+            # unlikes subtract, but a post never trends below zero
+            row.score = max(decayed(row.score, row.scored_at, at) + weight, 0.0)
+            row.scored_at = at
+            row.rank = rank_of(row.score, at)
+        # a concurrent first event for the same post loses its weight, not the request
+        PostTrend.objects.bulk_create(created, ignore_conflicts=True)
+        PostTrend.objects.bulk_update(changed, ['score', 'scored_at', 'rank'])
+
+
+def trending(count=5):
+    """Top ``count`` published posts, each with ``trend_score`` as of now."""
+    rows = (
+        PostTrend.objects
+        .filter(post__status=Post.Status.PUBLISHED, rank__isnull=False)
+        .select_related('post')
+        .only('rank', 'post__id', 'post__title', 'post__slug', 'post__publish')
+        .order_by('-rank')[:count]
+    )
+    now = _half_lives(timezone.now())
+    posts = []
+    for row in rows:
+        row.post.trend_score = 2 ** (row.rank - now)
+        posts.append(row.post)
+    return posts
+
+
+def rebuild(days=14):
+    """Start over from the comments of the last ``days`` days, current likes and views.
+
+    Likes and views carry no time of their own, so they count as of now.
+    """
+    since = timezone.now() - timedelta(days=days)
+    with transaction.atomic():
+        PostTrend.objects.all().delete()
+        comments = Comment.objects.filter(active=True, created__gte=since)
+        for post_id, created in comments.order_by('created').values_list('post_id', 'created'):
+            record({post_id: COMMENT_WEIGHT}, at=created)
+        record({
+            post_id: like_count * LIKE_WEIGHT + views * VIEW_WEIGHT
+            for post_id, like_count, views in Post.objects
+            .filter(Q(like_count__gt=0) | Q(views__gt=0))
+            .values_list('id', 'like_count', 'views')
+        })
+    return PostTrend.objects.count()
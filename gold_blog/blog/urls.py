@@ -1,6 +1,7 @@
 from django.urls import path, include
 from . import  views 
 from .feeds import LatestPostsFeed
+from .pagecache import public_page
 app_name = 'blog'
 urlpatterns = [
     path(
@@ -39,9 +40,14 @@ urlpatterns = [
         views.post_comment,
         name='post_comment'
     ),
+    path(
+        '<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'
+    ),
     
     path('feed/',
-         LatestPostsFeed(),
+         public_page(LatestPostsFeed()),
          name='post_feed'
         ),
     path(
@@ -49,6 +55,16 @@ urlpatterns = [
         views.post_search,
         name='post_search'
     ),
+    path(
+        'search/suggest/',
+        views.post_suggest,
+        name='post_suggest'
+    ),
+    path(
+        'trending/',
+        views.trending_posts,
+        name='trending_posts'
+    ),
     path(
         'llm/',
         views.llm_page,
@@ -58,5 +74,13 @@ urlpatterns = [
          views.llm_generate,
          name='llm_generate'
          ),
+    path('llm/stream/',
+         views.llm_stream,
+         name='llm_stream'
+         ),
+    path('llm/history/',
+         views.llm_history,
+         name='llm_history'
+         ),
     path('like/', views.post_like, name='like'),
 ]
\ No newline at end of file
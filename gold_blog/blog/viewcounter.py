@@ -0,0 +1,188 @@
+"""Post view counts without a database write per page view.
+
+A detail view calls hit(), which only bumps counters:
+
+* with REDIS_URL set, a pending-delta hash and an all-time "most viewed"
+  sorted set in Redis (one pipelined round trip). The flush_views command,
+  run from a scheduler, moves the deltas into Post.views;
+* otherwise, a Counter in this process. A daemon thread flushes it every
+  BLOG_VIEW_FLUSH_INTERVAL seconds, and the ranking comes from Post.views.
+
+Either way a flush is one UPDATE ... CASE statement for every post that was
+viewed since the last one. A Redis flush is numbered, and the number is
+stored (ViewFlush) in the transaction of its UPDATE: a flush that crashes
+after the UPDATE is cleaned up, not applied again, by the next one.
+"""
+import threading
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from . import trending
+from .models import Post, ViewFlush
+
+PENDING_KEY = 'blog:views:pending'
+FLUSHING_KEY = 'blog:views:flushing'
+RANKING_KEY = 'blog:views:ranking'
+FLUSH_ID_KEY = 'blog:views:flush-id'
+FLUSH_ID_KEEP = timedelta(days=1)  # an id only matters until its flush cleans up
+
+
+def apply_deltas(deltas, flush_id=None):
+    """Add ``{post_id: views}`` to Post.views in a single UPDATE.
+
+    With a ``flush_id`` the deltas are applied at most once: the id is stored
+    in the same transaction, and an id stored before means nothing to do.
+    """
+    deltas = {int(post_id): int(n) for post_id, n in deltas.items() if int(n)}
+    if not deltas:
+        return 0
+    with transaction.atomic():
+        if flush_id is not None:
+            _, created = ViewFlush.objects.get_or_create(flush_id=flush_id)
+            if not created:
+                return 0  # applied by a flush that died before cleaning up
+        updated = Post.objects.filter(pk__in=deltas).update(views=F('views') + Case(
+            *[When(pk=post_id, then=Value(n)) for post_id, n in deltas.items()],
+            default=Value(0),
+        ))
+        trending.record({
+            post_id: n * trending.VIEW_WEIGHT for post_id, n in deltas.items()
+        })
+    return updated
+
+
+class RedisViewCounter:
+    def __init__(self, url):
+        import redis  # only needed when REDIS_URL is set
+
+        self.redis = redis.Redis.from_url(url)
+
+    def hit(self, post_id):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hincrby(PENDING_KEY, post_id, 1)
+        pipe.zincrby(RANKING_KEY, 1, post_id)
+        pipe.execute()
+
+    def pending(self, post_id):
+        return sum(
+            int(self.redis.hget(key, post_id) or 0) for key in (PENDING_KEY, FLUSHING_KEY)
+        )
+
+    def flush(self):
+        # a hash left by a crashed flush is applied first; renaming the live
+        # hash away means hits arriving meanwhile start a fresh one
+        if not self.redis.exists(FLUSHING_KEY):
+            if not self.redis.exists(PENDING_KEY):
+                return 0
+            pipe = self.redis.pipeline()  # MULTI/EXEC: the hash and its id move together
+            pipe.rename(PENDING_KEY, FLUSHING_KEY)
+            pipe.set(FLUSH_ID_KEY, uuid.uuid4().hex)
+            pipe.execute()
+        # left by a flush from before ids were used, it cannot have been recorded
+        self.redis.setnx(FLUSH_ID_KEY, uuid.uuid4().hex)
+        flush_id = self.redis.get(FLUSH_ID_KEY).decode()
+        # the id is stored with the UPDATE, so a flush that dies before the
+        # DEL below is not applied a second time by the next one
+        updated = apply_deltas(self.redis.hgetall(FLUSHING_KEY), flush_id)
+        self.redis.delete(FLUSHING_KEY, FLUSH_ID_KEY)
+        ViewFlush.objects.filter(created__lt=timezone.now() - FLUSH_ID_KEEP).delete()
+        if not self.redis.exists(RANKING_KEY):
+            self.seed_ranking()
+        return updated
+
+    def seed_ranking(self):
+        scores = dict(Post.published.filter(views__gt=0).values_list('id', 'views'))
+        if scores:
+            self.redis.zadd(RANKING_KEY, scores)
+
+    def top(self, count):
+        return [int(post_id) for post_id in self.redis.zrevrange(RANKING_KEY, 0, count - 1)]
+
+    def forget(self, post_id):
+        self.redis.zrem(RANKING_KEY, post_id)
+
+
+class LocalViewCounter:
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def hit(self, post_id):
+        with self.lock:
+            self.counts[post_id] += 1
+            if self.timer is None and self.interval > 0:
+                self.timer = threading.Timer(self.interval, self._scheduled_flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def pending(self, post_id):
+        with self.lock:
+            return self.counts[post_id]
+
+    def _scheduled_flush(self):
+        with self.lock:
+            self.timer = None
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            deltas, self.counts = self.counts, Counter()
+        try:
+            return apply_deltas(deltas)
+        except Exception:
+            with self.lock:
+                self.counts.update(deltas)  # keep them for the next flush
+            raise
+
+    def top(self, count):
+        return list(
+            Post.published.filter(views__gt=0).order_by('-views')
+            .values_list('id', flat=True)[:count]
+        )
+
+    def forget(self, post_id):
+        pass
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def get_counter():
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                if settings.REDIS_URL:
+                    _counter = RedisViewCounter(settings.REDIS_URL)
+                else:
+                    _counter = LocalViewCounter(settings.BLOG_VIEW_FLUSH_INTERVAL)
+    return _counter
+
+
+def hit(post_id):
+    get_counter().hit(post_id)
+
+
+def total_views(post):
+    """Stored views plus the ones not flushed yet."""
+    return post.views + get_counter().pending(post.pk)
+
+
+def flush():
+    return get_counter().flush()
+
+
+def most_viewed(count=5):
+    # ask for extra ids: the Redis ranking may still hold unpublished posts
+    ids = get_counter().top(count * 2)
+    posts = Post.published.only('id', 'title', 'slug', 'publish').in_bulk(ids)
+    return [posts[post_id] for post_id in ids if post_id in posts][:count]
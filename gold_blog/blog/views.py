@@ -1,29 +1,79 @@
+from asgiref.sync import sync_to_async
 from django.views.generic import ListView #this is for class based view
 from django.shortcuts import get_object_or_404, render
-from django.contrib.postgres.search import (SearchVector, SearchQuery, SearchRank)
+from django.template.loader import render_to_string
 from django.conf import settings  #  access DEFAULT_FROM_EMAIL / mail backend
 from django.views.decorators.http import require_POST
-from django.contrib.postgres.search import TrigramSimilarity
-from django.http import JsonResponse,HttpResponse
+from django.http import Http404, JsonResponse,HttpResponse, StreamingHttpResponse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count
+from django.db.models import Exists, OuterRef
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
 
 from taggit.models import Tag
-import requests
-# import redis
-import markdown
+import hashlib
+import json
 import os
 from dotenv import load_dotenv
 # creating post share view
 from .models import Post #this fetch data from post class
+from .pagecache import public_page
+from .pagination import paginate_by_cursor, paginate_newest
+from .search import search_posts
+from . import (
+    autocomplete, cache, conversations, likes, llm, retrieval, trending, viewcounter,
+)
 from .form import EmailPostForm, CommentForm, SearchForm, LLMForm # validate share-by-email inputs and  # needed for Post_detail
-from account.emailer import send_email_brevo
+from account.emailer import queue_email
+
+POSTS_PER_PAGE = 4
+COMMENTS_PER_BATCH = 3
+LLM_TURNS_PER_PAGE = 10
+
+def similar_posts_for(post, count=4):
+    #list of similar posts, precomputed in SimilarPost: shared-tag neighbours
+    #first, then content neighbours (blog/recommender.py) to fill the gaps
+    candidates = (
+        Post.published
+        .filter(recommended_in__post=post)
+        .order_by('-recommended_in__kind', '-recommended_in__score', '-publish')
+        .only('id', 'title', 'slug', 'publish')
+        )[:count * 2]
+    similar_posts = []
+    for candidate in candidates:
+        # a post can be both a tag and a content neighbour; list it once
+        if candidate not in similar_posts and len(similar_posts) < count:
+            similar_posts.append(candidate)
+    return similar_posts
+
+def post_validator(post, request):
+    # everything the detail page shows that can change without post.updated
+    # moving: comments (any comment change bumps the sidebar version), likes,
+    # the viewer, the similar posts and the markdown renderer. Also the
+    # session and the CSRF secret, which logging in again rotates: a page
+    # cached from an earlier login posts comments with a dead token.
+    # Views count as of the last flush: a 304 shows the number the browser
+    # already has, short of the views since (see blog/viewcounter.py).
+    get_token(request)  # the secret the page will use, created if missing
+    parts = [
+        post.id, post.updated.isoformat(), post.render_version,
+        post.active_comment_count, post.like_count, post.liked, post.views,
+        request.user.pk, request.session.session_key, request.META.get('CSRF_COOKIE'),
+        cache.current_version('similar'), cache.current_version('sidebar'),
+    ]
+    return '"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
 
 @login_required
 def Post_detail(request, year, month, day, slug, post_id): #here we have to pass the arguments here inorder to display the revered url.
     post = get_object_or_404( #this help as to catch the error without using try and except method.
-        Post,
+        # one query fetches the post and everything the ETag needs
+        Post.objects.annotate(
+            liked=Exists(Post.users_like.through.objects.filter(
+                post_id=OuterRef('pk'), user_id=request.user.pk,
+            )),
+        ),
         status = Post.Status.PUBLISHED, #return only published post
         slug = slug,
         publish__year = year,
@@ -31,78 +81,92 @@ def Post_detail(request, year, month, day, slug, post_id): #here we have to pass
         publish__day=day,
         id=post_id
     )
+    # a 304 is still a read: count it, in memory/Redis only
+    viewcounter.hit(post.id)
+    if settings.BLOG_LIKE_BUFFERING:
+        # count clicks still waiting for flush_likes
+        post.like_count += likes.pending_delta(post.id)
+        post.liked = likes.buffered_state(post.id, request.user.pk, post.liked)
+    # the browser already has this version: skip comments, similar posts
+    # and rendering altogether
+    etag = post_validator(post, request)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
     
     # then go to templates list.html
-    #list of active comments for this post
-    all_comments = post.comments.filter(active=True).order_by("-created") 
-    total_comments = all_comments.count()
-    try:
-        comment_limit = int(request.GET.get("climit", 3))
-    except (ValueError, TypeError):
-        comment_limit = total_comments
-    
-    #clamp to sane bounds
-    comment_limit = max(0, min(comment_limit, total_comments))
-    
-    comments = all_comments[:comment_limit]
-    has_more_comments = comment_limit < total_comments
-    next_comment_limit = min(comment_limit+5, total_comments)
+    #first batch of active comments; more come from post_comments (AJAX)
+    total_comments = post.active_comment_count
+    comments = paginate_newest(
+        post.comments.filter(active=True).select_related('user'),
+        None, COMMENTS_PER_BATCH,
+    )
     # --- end comments ---
     # form for users to comment
     comment_form = CommentForm()
     llm_form = LLMForm()
-    #list of similar posts
-    post_tag_ids = post.tags.values_list('id', flat = True)
-    # INCREMENT TOTAL POST VIEW BY ONE
-    # total_views = r.incr(f'post:{post.id}: views')
-    similar_posts = (
-        Post.published
-        .filter(tags__in = post_tag_ids)
-        .exclude(id=post.id)
-        )
-    similar_posts = (
-        similar_posts
-        .annotate(same_tags = Count('tags'))
-        .order_by('-same_tags', '-publish')
-        )[:4]
+    total_views = viewcounter.total_views(post)
+    similar_posts = cache.cached(
+        cache.versioned_key('similar', post.id),
+        lambda: similar_posts_for(post),
+    )
     
-    return render(
+    response = render(
         request, 
         'blog/post/detail.html',
         {
             'post': post,
             'comments': comments,
             'total_comments': total_comments,
-            'has_more_comments': has_more_comments,
-            'next_comment_limit': next_comment_limit,
-            'comment_limit': comment_limit,
             'llm_form': llm_form,
             'comment_form': comment_form,
-            'similar_posts':similar_posts
-            # 'total_views':total_views
+            'similar_posts':similar_posts,
+            'total_views':total_views
         }
     )
+    response['ETag'] = etag
+    # per user, and always revalidated so new comments and likes show up
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
     
 @login_required
 def post_list(request, tag_slug = None):
     
     llm_form = LLMForm()
-    post_list = Post.published.all()
+    # cards only need the stored excerpt, the author and the tags:
+    # join the author, prefetch tags in one query and skip the heavy columns
+    post_list = (
+        Post.published
+        .select_related('author')
+        .prefetch_related('tags')
+        .defer('body', 'body_html', 'search_vector')
+    )
     tag = None
     if tag_slug:
-        tag = get_object_or_404(Tag, slug=tag_slug)
+        tag = cache.cached(
+            cache.versioned_key('tags', tag_slug),
+            lambda: Tag.objects.filter(slug=tag_slug).first(),
+        )
+        if tag is None:
+            raise Http404('No Tag matches the given query.')
         post_list = post_list.filter(tags__in=[tag])
         
-    #--pagination with 3 posts per page
-    paginator = Paginator(post_list, 4) #from all published item take only three items.
-    page_number = request.GET.get('page', 1)#  read ?page= from query string; default to page 1 if missing.
-    try:
-        page_obj = paginator.page(page_number)
-    except EmptyPage:
-        #If page_number is out of range get last page of result
-        page_obj=paginator.page(paginator.num_pages)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
+    if 'page' in request.GET:
+        # old ?page=N links keep working through the offset paginator
+        paginator = Paginator(post_list, POSTS_PER_PAGE)
+        page_number = request.GET.get('page', 1)#  read ?page= from query string; default to page 1 if missing.
+        try:
+            page_obj = paginator.page(page_number)
+        except EmptyPage:
+            #If page_number is out of range get last page of result
+            page_obj=paginator.page(paginator.num_pages)
+        except PageNotAnInteger:
+            page_obj = paginator.page(1)
+    else:
+        # default: keyset pagination on (publish, id), no COUNT(*) and no OFFSET
+        page_obj = paginate_by_cursor(
+            post_list, request.GET.get('cursor'), POSTS_PER_PAGE
+        )
     
     return render(
         request,
@@ -113,11 +177,13 @@ def post_list(request, tag_slug = None):
          'llm_form':llm_form
         }
     )
+@public_page
 def kiya_view(request):
     return render(
         request, 
         'blog/post/kiya.html'
     )
+@public_page
 def home(request):
     return render(
         request, 
@@ -144,15 +210,17 @@ def post_share(request, post_id):
                 f"Read {post.title} at {post_url}\n\n"
                 f"{cd['name']}'s comments: {cd['comments']}"
             )
-            try:
-                send_email_brevo(
-                    to_email=cd["to"],
-                    subject=subject,
-                    text=message,
-                )
-                sent = True
-            except Exception:
-                sent = False
+            # a double-submitted form within the same minute is sent once
+            digest = hashlib.sha256(json.dumps(
+                [post.id, cd["to"], subject, message, timezone.now().strftime("%Y%m%d%H%M")]
+            ).encode()).hexdigest()
+            queue_email(
+                to_email=cd["to"],
+                subject=subject,
+                text=message,
+                key=f"share:{digest}",
+            )
+            sent = True
     else:
         form = EmailPostForm()
     return render(
@@ -192,6 +260,32 @@ def post_comment(request, post_id):
             'llm_form': llm_form
         }
     )
+@login_required
+def post_comments(request, post_id):
+    # next batch of active comments after ?cursor=, for "See more comments"
+    post = get_object_or_404(
+        Post.published.only('id'), id=post_id
+    )
+    comments = paginate_newest(
+        post.comments.filter(active=True).select_related('user'),
+        request.GET.get('cursor'), COMMENTS_PER_BATCH,
+    )
+    return JsonResponse({
+        'html': render_to_string(
+            'blog/post/includes/comment_items.html', {'comments': comments}, request
+        ),
+        'comments': [
+            {
+                'id': c.id,
+                'author': str(c.user or 'Anonymous'),
+                'body': c.body,
+                'created': c.created.isoformat(),
+            }
+            for c in comments
+        ],
+        'next_cursor': comments.next_cursor,
+    })
+
 @login_required   
 def post_search(request):
     form = SearchForm()
@@ -202,20 +296,8 @@ def post_search(request):
         form = SearchForm(request.GET)
         if form.is_valid():
             query = form.cleaned_data['query']
-            search_vector = SearchVector(
-                'title', weight = 'A'
-                ) + SearchVector(
-                    'body', weight = "B"
-                    )
-            search_query = SearchQuery(query)
-            results = (
-                Post.published.annotate(
-                    # search = search_vector,
-                    # rank = SearchRank(search_vector, search_query),
-                    similarity = TrigramSimilarity('title', query),
-                )
-                .filter(similarity__gt = 0.1)
-                .order_by('-similarity')
+            results = search_posts(
+                query, Post.published.defer('body', 'body_html', 'search_vector')
             )
     return render(
         request,
@@ -228,6 +310,39 @@ def post_search(request):
         }
     )
 
+@login_required
+def post_suggest(request):
+    # search-as-you-type: top title/tag suggestions for ?q=<prefix>
+    prefix = request.GET.get('q', '')[:100]
+    response = JsonResponse({
+        'query': prefix,
+        'suggestions': autocomplete.suggest(prefix),
+    })
+    # the widget debounces keystrokes; let the browser reuse answers for a minute
+    patch_cache_control(response, private=True, max_age=60)
+    return response
+
+def trending_posts(request):
+    # ?count= top posts by time-decayed views, likes and comments
+    try:
+        count = max(1, min(int(request.GET.get('count', 10)), 50))
+    except ValueError:
+        count = 10
+    posts = cache.get_or_build(f'trending:{count}', lambda: trending.trending(count))
+    response = JsonResponse({
+        'posts': [
+            {
+                'id': post.id,
+                'title': post.title,
+                'url': post.get_absolute_url(),
+                'score': round(post.trend_score, 3),
+            }
+            for post in posts
+        ],
+    })
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
 # Correct path: up one, then into foodie
 env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'foodie', '.env')
 load_dotenv(dotenv_path=env_path)
@@ -279,111 +394,138 @@ def post_like(request):
 
     if post_id and action:
         try:
-            post = Post.objects.get(id=post_id)
-
-            if action == 'like':
-                post.users_like.add(request.user)
-            else:
-                post.users_like.remove(request.user)
+            post = Post.objects.only('id', 'like_count').get(id=post_id)
+        except (Post.DoesNotExist, ValueError):
+            return JsonResponse({'status': 'error'})
 
-            return JsonResponse({
-                'status': 'ok',
-                'total_likes': post.users_like.count()
-            })
+        # F() update of like_count, or a cache write when buffering is on
+        buffered = settings.BLOG_LIKE_BUFFERING
+        likes.toggle(post.id, request.user.id, action == 'like', buffered=buffered)
+        if buffered:
+            total_likes = post.like_count + likes.pending_delta(post.id)
+        else:
+            post.refresh_from_db(fields=['like_count'])
+            total_likes = post.like_count
 
-        except Post.DoesNotExist:
-            return JsonResponse({'status': 'error'})
+        return JsonResponse({
+            'status': 'ok',
+            'total_likes': total_likes
+        })
 
     return JsonResponse({'status': 'error'})
 
-# r = redis.Redis(
-#     host=settings.REDIS_HOST,
-#     port=settings.REDIS_PORT,
-#     db=settings.REDIS_DB
-# )
 @require_POST
 @login_required
-def llm_generate(request):
+async def llm_generate(request):
+    # whole answer as JSON; the chat widget uses llm_stream instead
     prompt = (request.POST.get("prompt") or "").strip()
     if not prompt:
         return JsonResponse({"error": "Prompt is required."}, status=400)
 
-    # Get prior history from session (list of {"prompt":..., "response":...})
-    url = "https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash:generateContent"
-    history = request.session.get("llm_history", [])
-
-    # Optional: limit memory to last N turns to avoid token overflow
-    max_turns = 3
-    history = history[-max_turns:]
-
-    # Build Gemini contents from history + new prompt
-    contents = []
-    for item in history:
-        if item.get("prompt"):
-            contents.append({"role": "user", "parts": [{"text": item["prompt"]}]})
-        if item.get("response"):
-            contents.append({"role": "model", "parts": [{"text": item["response"]}]})
+    # the session only holds the conversation id; turns live in the database
+    conversation = await sync_to_async(conversations.current)(
+        request.session, await request.auser(), create=True
+    )
+    # the parts of our own posts that match the prompt; they take up part
+    # of the context budget, so fetch them before the history
+    passages = await sync_to_async(retrieval.passages)(prompt)
+    history = await sync_to_async(conversations.context)(conversation, prompt, passages)
+    contents = llm.build_contents(history, prompt, passages)
+    # same question, same history: answer (and its HTML) from the cache
+    answer = await llm.cached_reply(contents)
+    if answer is None:
+        try:
+            generated = await llm.generate(contents)
+        except llm.LLMError as exc:
+            return JsonResponse({"error": str(exc), "details": exc.details}, status=500)
+        answer = await llm.remember_reply(contents, generated)
 
-    contents.append({"role": "user", "parts": [{"text": prompt}]})
+    await sync_to_async(conversations.append)(
+        conversation, prompt, answer["text"], answer["html"]
+    )
+    # Return HTML for display
+    return JsonResponse({"generated": answer["html"]})
 
-    data = {"contents": contents}
+def sse_event(data, event=None):
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data)}\n\n"
 
-    # Call Gemini (your existing API loop)
-    api_keys = [
-            os.getenv("GEMINI_API_KEY_1"),
-            os.getenv("GEMINI_API_KEY_2"),
-            os.getenv("GEMINI_API_KEY_3"),
-            os.getenv("GEMINI_API_KEY_4"),
-        ]
-    last_error = None
-    for api_key in api_keys:
-        if not api_key:
-            continue
-        headers = {
-            "Content-Type": "application/json",
-            "x-goog-api-key": api_key
-        }
-        try:
-            response = requests.post(url, headers=headers, json=data, timeout=20)
-            if response.status_code == 200:
-                content = response.json()
-                generated = content["candidates"][0]["content"]["parts"][0]["text"]
+@require_POST
+@login_required
+async def llm_stream(request):
+    # server-sent events: {"delta": text} as tokens arrive, then a "done"
+    # event with the rendered HTML (or an "error" event)
+    prompt = (request.POST.get("prompt") or "").strip()
+    if not prompt:
+        return JsonResponse({"error": "Prompt is required."}, status=400)
+    conversation = await sync_to_async(conversations.current)(
+        request.session, await request.auser(), create=True
+    )
+    # the parts of our own posts that match the prompt; they take up part
+    # of the context budget, so fetch them before the history
+    passages = await sync_to_async(retrieval.passages)(prompt)
+    history = await sync_to_async(conversations.context)(conversation, prompt, passages)
+    contents = llm.build_contents(history, prompt, passages)
 
-                # Save new turn to session
-                history.append({"prompt": prompt, "response": generated})
-                request.session["llm_history"] = history
-                request.session.modified = True
+    async def events():
+        answer = await llm.cached_reply(contents)
+        if answer is not None:
+            yield sse_event({"delta": answer["text"]})
+        else:
+            pieces = []
+            try:
+                async for text in llm.stream_reply(contents):
+                    pieces.append(text)
+                    yield sse_event({"delta": text})
+            except llm.LLMError as exc:
+                yield sse_event({"error": str(exc), "details": exc.details}, event="error")
+                return
+            answer = await llm.remember_reply(contents, "".join(pieces))
+        await sync_to_async(conversations.append)(
+            conversation, prompt, answer["text"], answer["html"]
+        )
+        yield sse_event({"html": answer["html"]}, event="done")
 
-                # Return HTML for display
-                return JsonResponse({"generated": markdown.markdown(generated)})
-            last_error = {"status": response.status_code}
-        except Exception as exc:
-            last_error = {"error": str(exc)}
-            continue
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # don't let nginx hold the tokens back
+    return response
 
-    return JsonResponse(
-        {
-            "error": "All API keys failed or quota exceeded.",
-            "details": last_error,
-        },
-        status=500,
-    )
+def llm_turns_json(page):
+    # oldest first, the order the chat shows them in
+    return {
+        "turns": [
+            {"id": turn.id, "prompt": turn.prompt, "response": turn.response_html}
+            for turn in reversed(page.object_list)
+        ],
+        "next_cursor": page.next_cursor,
+    }
 
 @login_required
 def llm_page(request):
     llm_form = LLMForm()
-    history = request.session.get("llm_history", [])
-
-    # Convert response text to HTML for display
-    history_ui = [
-        {"prompt": h["prompt"], "response": markdown.markdown(h["response"])}
-        for h in history
-    ]
+    conversation = conversations.current(request.session, request.user)
+    history = {"turns": [], "next_cursor": None}
+    if conversation is not None:
+        # newest turns only, already rendered; older ones load on demand
+        history = llm_turns_json(
+            conversations.history_page(conversation, None, LLM_TURNS_PER_PAGE)
+        )
 
     return render(
         request,
         "blog/post/llm_page.html",
         {"llm_form": llm_form, 
-         "llm_history": history_ui
+         "llm_history": history
          }
     )
+
+@login_required
+def llm_history(request):
+    # turns older than ?cursor=, for "Load earlier messages"
+    conversation = conversations.current(request.session, request.user)
+    if conversation is None:
+        return JsonResponse({"turns": [], "next_cursor": None})
+    return JsonResponse(llm_turns_json(
+        conversations.history_page(conversation, request.GET.get("cursor"), LLM_TURNS_PER_PAGE)
+    ))
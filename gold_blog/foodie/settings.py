@@ -35,6 +35,7 @@ SITE_ID = 1
 INSTALLED_APPS = [
     "account.apps.AccountConfig",
     "blog.apps.BlogConfig",
+    "jobs.apps.JobsConfig",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -102,6 +103,48 @@ else:
     }
 
 
+# -----------------------------------------------------------------------------
+# Cache (CACHE_BACKEND: locmem, file or redis; redis is picked when REDIS_URL is set)
+# -----------------------------------------------------------------------------
+REDIS_URL = config("REDIS_URL", default="").strip()
+CACHE_BACKEND = config("CACHE_BACKEND", default="redis" if REDIS_URL else "locmem")
+
+# Likes, the LLM key pool, index writer locks, the autocomplete log and page
+# versions rely on cache.add()/incr() being atomic across processes, which
+# only redis provides: without it they hold within one process only, and
+# check blog.W001 warns when DEBUG is off.
+_CACHE_BACKENDS = {
+    # per process: fine for a single worker and for tests
+    "locmem": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "foodie",
+    },
+    # survives restarts, but add()/incr() are not atomic between processes,
+    # so like locmem it is only safe with a single process
+    "file": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": config("CACHE_LOCATION", default=str(BASE_DIR / "var" / "cache")),
+    },
+    # shared across machines (Django's built-in backend on top of redis-py)
+    "redis": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL or "redis://127.0.0.1:6379/1",
+    },
+}
+CACHES = {
+    "default": {
+        **_CACHE_BACKENDS[CACHE_BACKEND],
+        "KEY_PREFIX": "foodie",
+        "TIMEOUT": config("CACHE_TIMEOUT", default=300, cast=int),
+    }
+}
+
+# Per-process LRU in front of CACHES["default"] for hot keys (blog/cache.py).
+# Entries live at most BLOG_LOCAL_CACHE_TIMEOUT seconds, so writes made by other
+# workers show up within that window.
+BLOG_LOCAL_CACHE_SIZE = config("BLOG_LOCAL_CACHE_SIZE", default=512, cast=int)
+BLOG_LOCAL_CACHE_TIMEOUT = config("BLOG_LOCAL_CACHE_TIMEOUT", default=5, cast=int)
+
 # -----------------------------------------------------------------------------
 # Password validation
 # -----------------------------------------------------------------------------
@@ -151,6 +194,102 @@ DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL", default=EMAIL_HOST_USER)
 BREVO_API_KEY = config('BREVO_API_KEY', default='')
 BREVO_SENDER_EMAIL = config('BREVO_SENDER_EMAIL', default='')
 BREVO_SENDER_NAME = config('BREVO_SENDER_NAME', default='')
+# account/emailer.py: one pooled keep-alive session per thread
+BREVO_API_BASE = config('BREVO_API_BASE', default='https://api.brevo.com/v3')
+BREVO_CONNECT_TIMEOUT = config('BREVO_CONNECT_TIMEOUT', default=5, cast=float)
+BREVO_READ_TIMEOUT = config('BREVO_READ_TIMEOUT', default=30, cast=float)
+# recipients per batch request (Brevo takes at most 1000 message versions)
+BREVO_BATCH_SIZE = config('BREVO_BATCH_SIZE', default=500, cast=int)
+
+# -----------------------------------------------------------------------------
+# Background jobs (jobs/queue.py; run them with `python manage.py run_jobs`)
+# -----------------------------------------------------------------------------
+JOBS_MAX_ATTEMPTS = config("JOBS_MAX_ATTEMPTS", default=5, cast=int)
+# retry n waits JOBS_BACKOFF_BASE * 2**(n-1) seconds, at most JOBS_BACKOFF_MAX
+JOBS_BACKOFF_BASE = config("JOBS_BACKOFF_BASE", default=30, cast=float)
+JOBS_BACKOFF_MAX = config("JOBS_BACKOFF_MAX", default=3600, cast=float)
+# seconds a worker may hold a job before another one takes it over
+JOBS_LEASE = config("JOBS_LEASE", default=300, cast=int)
+JOBS_KEEP_DONE_DAYS = config("JOBS_KEEP_DONE_DAYS", default=7, cast=int)
+
+
+# -----------------------------------------------------------------------------
+# Blog
+# -----------------------------------------------------------------------------
+# Dotted path to a blog.search.base.SearchBackend; empty picks the backend
+# matching the database (postgres full-text search or SQLite FTS5).
+BLOG_SEARCH_BACKEND = config("BLOG_SEARCH_BACKEND", default="")
+
+# TF-IDF matrix behind the content-based related posts (build_recommendations)
+BLOG_RECOMMENDER_PATH = config(
+    "BLOG_RECOMMENDER_PATH", default=str(BASE_DIR / "var" / "recommender.npz")
+)
+
+# Chunk vectors of published posts for the chat's retrieval step
+# (build_retrieval_index); past BLOG_RETRIEVAL_ANN_MIN_CHUNKS chunks the
+# index also gets a k-means coarse quantizer so a query scores a fraction
+# of them, at a cost in recall (see the bench_retrieval command).
+BLOG_RETRIEVAL_PATH = config(
+    "BLOG_RETRIEVAL_PATH", default=str(BASE_DIR / "var" / "retrieval")
+)
+BLOG_RETRIEVAL_ANN_MIN_CHUNKS = config("BLOG_RETRIEVAL_ANN_MIN_CHUNKS", default=1000000, cast=int)
+
+# Seconds the sidebar widgets (latest, most commented, post count) stay fresh;
+# post and comment changes invalidate them immediately anyway.
+BLOG_SIDEBAR_CACHE_TIMEOUT = config("BLOG_SIDEBAR_CACHE_TIMEOUT", default=300, cast=int)
+
+# Buffer like/unlike clicks in the shared cache and write them in batches with
+# the flush_likes command (schedule it every minute or so) instead of per click.
+BLOG_LIKE_BUFFERING = config("BLOG_LIKE_BUFFERING", default=False, cast=bool)
+
+# Without REDIS_URL, view counts are kept per process and written to
+# Post.views this often (seconds); with Redis, run the flush_views command.
+BLOG_VIEW_FLUSH_INTERVAL = config("BLOG_VIEW_FLUSH_INTERVAL", default=60, cast=int)
+
+# Gemini endpoint for the chat widget (keys: GEMINI_API_KEY_1..4, see blog/llm.py)
+LLM_API_BASE = config("LLM_API_BASE", default="https://generativelanguage.googleapis.com")
+LLM_MODEL = config("LLM_MODEL", default="gemini-2.5-flash")
+LLM_TIMEOUT = config("LLM_TIMEOUT", default=60, cast=float)  # seconds between chunks
+# Per key, shared by all workers through the cache (blog/keypool.py): a 429
+# or LLM_KEY_FAILURE_THRESHOLD errors in a minute rest the key for
+# LLM_KEY_COOLDOWN seconds, doubling on repeat trips; LLM_KEY_RATE requests a
+# minute (0: unlimited) with bursts of LLM_KEY_BURST, and at most
+# LLM_KEY_MAX_CONCURRENCY requests in flight.
+LLM_KEY_FAILURE_THRESHOLD = config("LLM_KEY_FAILURE_THRESHOLD", default=3, cast=int)
+LLM_KEY_COOLDOWN = config("LLM_KEY_COOLDOWN", default=30, cast=float)
+LLM_KEY_RATE = config("LLM_KEY_RATE", default=60, cast=float)
+LLM_KEY_BURST = config("LLM_KEY_BURST", default=10, cast=int)
+LLM_KEY_MAX_CONCURRENCY = config("LLM_KEY_MAX_CONCURRENCY", default=8, cast=int)
+# Identical questions (same model, history window and prompt) are answered
+# from the cache for this long; LLM_CACHE_SIZE bounds the per-process LRU.
+LLM_CACHE_TIMEOUT = config("LLM_CACHE_TIMEOUT", default=3600, cast=int)
+LLM_CACHE_SIZE = config("LLM_CACHE_SIZE", default=256, cast=int)
+# How much earlier conversation is sent with a prompt (estimated tokens).
+LLM_CONTEXT_TOKENS = config("LLM_CONTEXT_TOKENS", default=4000, cast=int)
+# Chunks of our own posts sent along with each prompt (0 turns retrieval off).
+LLM_RETRIEVAL_CHUNKS = config("LLM_RETRIEVAL_CHUNKS", default=4, cast=int)
+
+# Hours after which a view, like or comment counts half as much for "trending"
+BLOG_TRENDING_HALF_LIFE = config("BLOG_TRENDING_HALF_LIFE", default=24, cast=float)
+
+
+# -----------------------------------------------------------------------------
+# Logging (to stderr, where gunicorn and supervisor collect it)
+# -----------------------------------------------------------------------------
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "plain": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "plain"},
+    },
+    "loggers": {
+        # one line per Brevo request: outcome, status, duration
+        "account": {"handlers": ["console"], "level": config("ACCOUNT_LOG_LEVEL", default="INFO")},
+    },
+}
 
 
 # -----------------------------------------------------------------------------
@@ -158,9 +297,8 @@ BREVO_SENDER_NAME = config('BREVO_SENDER_NAME', default='')
 # -----------------------------------------------------------------------------
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-# REDIS_HOST = "localhost"
-# REDIS_PORT = 6379
-# REDIS_DB = 0
+# points the on-disk indexes at a temporary directory during tests
+TEST_RUNNER = "foodie.test_runner.TestRunner"
 
 AUTHENTICATION_BACKENDS = [
     "django.contrib.auth.backends.ModelBackend",
@@ -0,0 +1,34 @@
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner that keeps the on-disk indexes of the tests apart.
+
+    Saving a post updates the files under BLOG_RECOMMENDER_PATH and
+    BLOG_RETRIEVAL_PATH, so every test that creates posts would otherwise
+    edit the real ones.
+
+    It also keeps the "account" logger at WARNING, so the Brevo requests the
+    tests make do not print a line each (assertLogs() still sees them), and
+    silences the shared cache check: the tests run on locmem on purpose.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._index_dir = tempfile.TemporaryDirectory(prefix='foodie-test-')
+        settings.BLOG_RECOMMENDER_PATH = os.path.join(self._index_dir.name, 'recommender.npz')
+        settings.BLOG_RETRIEVAL_PATH = os.path.join(self._index_dir.name, 'retrieval')
+        self._account_logger = logging.getLogger('account')
+        self._account_level = self._account_logger.level
+        self._account_logger.setLevel(logging.WARNING)
+        settings.SILENCED_SYSTEM_CHECKS = [*settings.SILENCED_SYSTEM_CHECKS, 'blog.W001']
+
+    def teardown_test_environment(self, **kwargs):
+        self._account_logger.setLevel(self._account_level)
+        self._index_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 
 from django.contrib.sitemaps.views import sitemap
+from blog.pagecache import public_page
 from blog.sitemaps import PostSitemap
 
 sitemaps = {
@@ -28,7 +29,7 @@ urlpatterns = [
     path('', include('blog.urls', namespace='blog')),  # 2
     path(
         'sitemap.xml',
-        sitemap,
+        public_page(sitemap, params=['p']),
         {'sitemaps':sitemaps},
         name= 'django.contrib.sitemaps.views.sitemap'
     ),
@@ -0,0 +1,17 @@
+from django.contrib import admin
+
+from .models import Job
+from .queue import requeue
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'max_attempts', 'run_at', 'updated']
+    list_filter = ['status', 'name']  # "Dead" is the dead-letter queue
+    search_fields = ['name', 'idempotency_key', 'last_error']
+    readonly_fields = ['attempts', 'locked_until', 'last_error', 'created', 'updated']
+    actions = ['retry_jobs']
+
+    @admin.action(description='Retry selected jobs')
+    def retry_jobs(self, request, queryset):
+        self.message_user(request, f"{requeue(queryset)} job(s) queued again.")
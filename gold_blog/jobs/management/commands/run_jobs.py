@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from jobs.queue import purge, work
+
+PURGE_EVERY = 3600  # seconds between clean-ups of finished jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (outgoing email) as they fall due"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Run the jobs due now, then exit"
+        )
+        parser.add_argument(
+            "--interval", type=float, default=2.0, help="Seconds to wait when the queue is empty"
+        )
+
+    def handle(self, *args, **options):
+        last_purge = None
+        try:
+            while True:
+                ran, failed = work()
+                if ran:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Ran {ran} job(s), {failed} failed"
+                    ))
+                if options["once"]:
+                    return
+                if last_purge is None or time.monotonic() - last_purge > PURGE_EVERY:
+                    purge()
+                    last_purge = time.monotonic()
+                if not ran:
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass  # a job cut off here is retried once its lease runs out
@@ -0,0 +1,35 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    # one unit of background work, run by the run_jobs command (jobs/queue.py)
+    class Status(models.TextChoices):
+        QUEUED = 'Q', 'Queued'
+        RUNNING = 'R', 'Running'
+        DONE = 'D', 'Done'
+        DEAD = 'X', 'Dead'  # out of attempts, kept for inspection and retry
+
+    name = models.CharField(max_length=100)  # the handler registered with @task
+    payload = models.JSONField(default=dict, blank=True)
+    # a second enqueue() with the same key returns the first job instead
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=1, choices=Status, default=Status.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)  # not before this
+    # while running: when the claim lapses and another worker may take over
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_at']
+        indexes = [
+            # what the worker polls: due jobs in order
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.get_status_display()})"
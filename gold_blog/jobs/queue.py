@@ -0,0 +1,158 @@
+"""A job queue in the database, so slow work such as email leaves the request.
+
+enqueue() inserts a Job row in the caller's transaction, so a rolled back
+registration never sends its email. `python manage.py run_jobs` polls for
+due jobs and calls the handler registered under the job's name with the
+payload as keyword arguments:
+
+* a worker claims a job with a conditional UPDATE (same status and attempt
+  count as it read), which works on SQLite and PostgreSQL alike and lets
+  several workers share the table. The claim lasts JOBS_LEASE seconds, after
+  which the job of a worker that died is picked up again. The outcome is
+  recorded the same way, so a worker that outlived its lease cannot
+  overwrite the attempt that took the job over;
+* a handler that raises is retried after JOBS_BACKOFF_BASE * 2**(attempt - 1)
+  seconds, capped at JOBS_BACKOFF_MAX and jittered. Once max_attempts is
+  used up the job is marked dead and kept with its last error, for the admin
+  to look at and requeue;
+* jobs with an idempotency key are enqueued at most once.
+
+Handlers must cope with running twice: a worker that dies between finishing
+a handler and marking its job done leaves the job to be run again. Payloads
+of finished jobs are cleared, since they may hold addresses and one-time
+codes; dead jobs keep theirs so they can be retried.
+"""
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+CLAIM_CANDIDATES = 10  # due jobs looked at per claim, in case others win some
+
+_handlers = {}
+
+
+def task(name):
+    """Register the decorated function as the handler of jobs called ``name``."""
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, key=None, delay=0, max_attempts=None):
+    """Queue a job; with ``key``, return the existing job if it was queued before."""
+    if name not in _handlers:
+        raise ValueError(f"no job handler named {name!r}")
+    fields = {
+        'name': name,
+        'payload': payload or {},
+        'run_at': timezone.now() + timedelta(seconds=delay),
+        'max_attempts': max_attempts or settings.JOBS_MAX_ATTEMPTS,
+    }
+    if key is None:
+        return Job.objects.create(**fields)
+    try:
+        with transaction.atomic():
+            return Job.objects.create(idempotency_key=key, **fields)
+    except IntegrityError:
+        return Job.objects.get(idempotency_key=key)
+
+
+def backoff(attempt):
+    """Seconds before retry number ``attempt`` (1 after the first failure)."""
+    delay = min(settings.JOBS_BACKOFF_BASE * 2 ** (attempt - 1), settings.JOBS_BACKOFF_MAX)
+    return random.uniform(delay / 2, delay)  # spread out retries that failed together
+
+
+def claim():
+    """Take the next due job for this worker, or None if there is none."""
+    now = timezone.now()
+    due = (
+        Job.objects
+        .filter(
+            Q(status=Job.Status.QUEUED, run_at__lte=now)
+            # claimed by a worker that never finished it
+            | Q(status=Job.Status.RUNNING, locked_until__lt=now)
+        )
+        .order_by('run_at')
+        .only('id', 'status', 'attempts')
+    )
+    for job in due[:CLAIM_CANDIDATES]:
+        claimed = Job.objects.filter(
+            pk=job.pk, status=job.status, attempts=job.attempts
+        ).update(
+            status=Job.Status.RUNNING,
+            attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=settings.JOBS_LEASE),
+            updated=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=job.pk)
+    return None
+
+
+def _finish(job, **fields):
+    # only while the claim is still ours: same attempt, still running
+    return Job.objects.filter(
+        pk=job.pk, status=Job.Status.RUNNING, attempts=job.attempts
+    ).update(locked_until=None, **fields)
+
+
+def run(job):
+    """Run a claimed job and record the outcome; True if it succeeded."""
+    now = timezone.now()
+    try:
+        if job.attempts > job.max_attempts:
+            # its last attempt died with the worker that ran it
+            raise RuntimeError("worker lost during the last attempt")
+        handler = _handlers.get(job.name)
+        if handler is None:
+            raise LookupError(f"no job handler named {job.name!r}")
+        handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            _finish(job, status=Job.Status.DEAD, last_error=error, updated=now)
+        else:
+            _finish(
+                job, status=Job.Status.QUEUED, last_error=error, updated=now,
+                run_at=now + timedelta(seconds=backoff(job.attempts)),
+            )
+        return False
+    _finish(job, status=Job.Status.DONE, payload={}, updated=timezone.now())
+    return True
+
+
+def work(limit=None):
+    """Run due jobs until there are none left (or ``limit``); return (ran, failed)."""
+    ran = failed = 0
+    while limit is None or ran < limit:
+        job = claim()
+        if job is None:
+            break
+        ran += 1
+        failed += not run(job)
+    return ran, failed
+
+
+def requeue(queryset):
+    """Give dead (or any) jobs a fresh set of attempts, due now."""
+    return queryset.exclude(status=Job.Status.RUNNING).update(
+        status=Job.Status.QUEUED, attempts=0, run_at=timezone.now(), locked_until=None,
+    )
+
+
+def purge(days=None):
+    """Delete jobs that finished more than ``days`` (JOBS_KEEP_DONE_DAYS) ago."""
+    days = settings.JOBS_KEEP_DONE_DAYS if days is None else days
+    deleted, _ = Job.objects.filter(
+        status=Job.Status.DONE, updated__lt=timezone.now() - timedelta(days=days)
+    ).delete()
+    return deleted
@@ -0,0 +1,142 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import queue
+from .models import Job
+
+calls = []
+
+
+@queue.task('jobs.test.record')
+def record(value, fail=0):
+    # fails the first ``fail`` times it is called for ``value``
+    calls.append(value)
+    if calls.count(value) <= fail:
+        raise RuntimeError(f'failure {calls.count(value)}')
+
+
+@override_settings(JOBS_MAX_ATTEMPTS=3, JOBS_BACKOFF_BASE=10, JOBS_BACKOFF_MAX=60, JOBS_LEASE=300)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def make_due(self):
+        Job.objects.filter(status=Job.Status.QUEUED).update(run_at=timezone.now())
+
+    def test_unknown_handler_is_refused(self):
+        with self.assertRaises(ValueError):
+            queue.enqueue('jobs.test.missing')
+
+    def test_same_key_is_enqueued_once(self):
+        first = queue.enqueue('jobs.test.record', {'value': 'a'}, key='k1')
+        second = queue.enqueue('jobs.test.record', {'value': 'b'}, key='k1')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Job.objects.count(), 1)
+        queue.enqueue('jobs.test.record', {'value': 'c'})
+        queue.enqueue('jobs.test.record', {'value': 'c'})
+        self.assertEqual(Job.objects.count(), 3)
+
+    def test_success_marks_done_and_clears_payload(self):
+        job = queue.enqueue('jobs.test.record', {'value': 'a'})
+        self.assertEqual(queue.work(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual(calls, ['a'])
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.payload, {})
+        self.assertEqual(queue.work(), (0, 0))
+
+    def test_delayed_job_waits(self):
+        queue.enqueue('jobs.test.record', {'value': 'a'}, delay=60)
+        self.assertEqual(queue.work(), (0, 0))
+        self.make_due()
+        self.assertEqual(queue.work(), (1, 0))
+
+    def test_failure_is_retried_with_backoff(self):
+        job = queue.enqueue('jobs.test.record', {'value': 'a', 'fail': 1})
+        before = timezone.now()
+        self.assertEqual(queue.work(), (1, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.QUEUED)
+        self.assertIn('failure 1', job.last_error)
+        # first retry waits between half and all of JOBS_BACKOFF_BASE
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=5))
+        self.assertLessEqual(job.run_at, timezone.now() + timedelta(seconds=10))
+        self.assertEqual(queue.work(), (0, 0))  # not due yet
+        self.make_due()
+        self.assertEqual(queue.work(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.DONE, 2))
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        for attempt, delay in [(1, 10), (2, 20), (3, 40), (4, 60), (9, 60)]:
+            self.assertTrue(delay / 2 <= queue.backoff(attempt) <= delay)
+
+    def test_out_of_attempts_is_dead_and_can_be_requeued(self):
+        job = queue.enqueue('jobs.test.record', {'value': 'a', 'fail': 5})
+        for _ in range(3):
+            self.make_due()
+            queue.work()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DEAD)
+        self.assertEqual(job.attempts, 3)
+        self.assertEqual(job.payload, {'value': 'a', 'fail': 5})  # kept for a retry
+        self.make_due()
+        self.assertEqual(queue.work(), (0, 0))
+
+        self.assertEqual(queue.requeue(Job.objects.all()), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.QUEUED, 0))
+
+    def test_claim_is_exclusive(self):
+        queue.enqueue('jobs.test.record', {'value': 'a'})
+        job = queue.claim()
+        self.assertEqual(job.status, Job.Status.RUNNING)
+        self.assertIsNone(queue.claim())  # another worker finds nothing to do
+
+    def test_expired_lease_is_taken_over(self):
+        queue.enqueue('jobs.test.record', {'value': 'a'})
+        job = queue.claim()  # and the worker dies
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(queue.work(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.DONE, 2))
+
+    def test_late_worker_does_not_overwrite_the_takeover(self):
+        queue.enqueue('jobs.test.record', {'value': 'a', 'fail': 1})
+        slow = queue.claim()  # outlives its lease
+        Job.objects.filter(pk=slow.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        current = queue.claim()
+        self.assertFalse(queue.run(slow))  # fails, but the job is no longer its own
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts, job.last_error), (Job.Status.RUNNING, 2, ''))
+        self.assertTrue(queue.run(current))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.payload), (Job.Status.DONE, {}))
+
+        queue.enqueue('jobs.test.record', {'value': 'b'})
+        slow = queue.claim()
+        Job.objects.filter(pk=slow.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        queue.claim()
+        self.assertTrue(queue.run(slow))  # done, but it must not mark the new attempt
+        self.assertEqual(Job.objects.get(pk=slow.pk).status, Job.Status.RUNNING)
+
+    def test_purge_keeps_recent_and_unfinished_jobs(self):
+        old = queue.enqueue('jobs.test.record', {'value': 'a'})
+        queue.enqueue('jobs.test.record', {'value': 'b'})
+        queue.work(limit=1)
+        Job.objects.filter(pk=old.pk).update(updated=timezone.now() - timedelta(days=8))
+        self.assertEqual(queue.purge(), 1)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_run_jobs_once(self):
+        queue.enqueue('jobs.test.record', {'value': 'a'})
+        queue.enqueue('jobs.test.record', {'value': 'b', 'fail': 1})
+        out = StringIO()
+        call_command('run_jobs', '--once', stdout=out)
+        self.assertIn('Ran 2 job(s), 1 failed', out.getvalue())
+        self.assertEqual(sorted(calls), ['a', 'b'])